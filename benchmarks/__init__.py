@@ -0,0 +1 @@
+# Offline benchmarks of domainconnect, run with: python -m benchmarks.run --help
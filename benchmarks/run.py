@@ -0,0 +1,240 @@
+from __future__ import print_function
+
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+# Throughput and latency of the public entry points against local stub DNS and provider
+#
+#   python -m benchmarks.run --domains 500 --concurrency 16 --http-latency 0.02 --dns-latency 0.005
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dns.resolver import Resolver
+
+from domainconnect import DomainConnect, DomainConnectAsyncCredentials, DomainConnectSigner, NetworkContext, \
+    DnsPythonBackend, StaticBackend
+from .stubs import StubDNSServer, StubProviderServer, PROVIDER_ID, SERVICE_ID
+
+
+def percentile(values, p):
+    """Nearest-rank percentile
+
+    :param values: list(float)
+        sorted values
+    :param p: float
+        percentile in (0, 100]
+    :return: float
+    """
+    if not values:
+        return float('nan')
+    rank = int(-(-len(values) * p // 100))
+    return values[max(rank, 1) - 1]
+
+
+class Result:
+    def __init__(self, name, operations, errors, elapsed, latencies):
+        self.name = name
+        self.operations = operations
+        self.errors = errors
+        self.elapsed = elapsed
+        self.latencies = sorted(latencies)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'operations': self.operations,
+            'errors': self.errors,
+            'ops_per_sec': self.operations / self.elapsed if self.elapsed else float('nan'),
+            'p50_ms': percentile(self.latencies, 50) * 1000,
+            'p99_ms': percentile(self.latencies, 99) * 1000,
+        }
+
+
+def measure(name, function, arguments, concurrency):
+    """Calls function once per argument from concurrency threads
+
+    :return: Result
+    """
+    def timed(argument):
+        start = time.time()
+        # noinspection PyBroadException
+        try:
+            function(argument)
+            error = 0
+        except Exception:
+            error = 1
+        return time.time() - start, error
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, arguments))
+    elapsed = time.time() - start
+    return Result(name, len(results), sum(error for _, error in results), elapsed,
+                  [latency for latency, _ in results])
+
+
+def measure_stream(name, results, count):
+    """Consumes generator of a bulk API, latency is the time until each result was yielded
+
+    :return: Result
+    """
+    start = time.time()
+    latencies = []
+    errors = 0
+    for _, result in results:
+        latencies.append(time.time() - start)
+        if isinstance(result, Exception):
+            errors += 1
+    elapsed = time.time() - start
+    assert len(latencies) == count, "Missing results: {} of {}".format(len(latencies), count)
+    return Result(name, count, errors, elapsed, latencies)
+
+
+def generate_private_key():
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                             serialization.NoEncryption()).decode('ascii')
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.provider = StubProviderServer(latency=args.http_latency).start()
+        # every scenario discovers its own set of domain roots, so nothing is served from caches
+        self.zones = dict()
+        self.dns = None
+        if not args.static_dns:
+            self.dns = StubDNSServer(self.zones, latency=args.dns_latency).start()
+        self.credentials = DomainConnectAsyncCredentials('client', 'secret', self.provider.url_api)
+        self.signer = DomainConnectSigner(generate_private_key(), '_dck1')
+
+    def close(self):
+        self.provider.stop()
+        if self.dns is not None:
+            self.dns.stop()
+
+    def domains(self, scenario):
+        ret = []
+        for i in range(self.args.domains):
+            domain_root = '{}{}.com'.format(scenario.replace('_', '-'), i)
+            self.zones['_domainconnect.{}'.format(domain_root)] = self.provider.address
+            ret.append('www.{}'.format(domain_root))
+        return ret
+
+    def client(self):
+        if self.args.static_dns:
+            backend = StaticBackend(self.zones, latency=self.args.dns_latency)
+        else:
+            resolver = Resolver(configure=False)
+            resolver.nameservers = ['127.0.0.1']
+            resolver.port = self.dns.port
+            backend = DnsPythonBackend(resolver)
+        return DomainConnect(networkcontext=NetworkContext(ca_file=self.provider.cert_file, dns_backend=backend))
+
+    def discovery(self):
+        dc = self.client()
+        return measure('get_domain_config', dc.get_domain_config, self.domains('discovery'),
+                       self.args.concurrency)
+
+    def discovery_bulk(self):
+        dc = self.client()
+        domains = self.domains('discovery_bulk')
+        return measure_stream('get_domain_configs', dc.get_domain_configs(domains, self.args.concurrency),
+                              len(domains))
+
+    def sync_url(self):
+        dc = self.client()
+
+        def call(domain):
+            dc.get_domain_connect_template_sync_url(domain, PROVIDER_ID, SERVICE_ID, params={'IP': '192.0.2.1'},
+                                                    state='s')
+        return measure('get_domain_connect_template_sync_url', call, self.domains('sync_url'),
+                       self.args.concurrency)
+
+    def sync_url_bulk(self):
+        dc = self.client()
+        domains = self.domains('sync_url_bulk')
+        results = dc.get_domain_connect_template_sync_urls(((domain, {'IP': '192.0.2.1'}) for domain in domains),
+                                                           PROVIDER_ID, SERVICE_ID, state='s',
+                                                           max_workers=self.args.concurrency)
+        return measure_stream('get_domain_connect_template_sync_urls', results, len(domains))
+
+    def signed_url(self):
+        dc = self.client()
+
+        def call(domain):
+            dc.get_domain_connect_template_sync_url(domain, PROVIDER_ID, SERVICE_ID, params={'IP': '192.0.2.1'},
+                                                    state='s', signer=self.signer)
+        return measure('get_domain_connect_template_sync_url (signed)', call, self.domains('signed_url'),
+                       self.args.concurrency)
+
+    def async_apply(self):
+        dc = self.client()
+
+        def call(domain):
+            context = dc.get_domain_connect_template_async_context(domain, PROVIDER_ID, SERVICE_ID,
+                                                                   'https://example.org/return')
+            context.code = 'code'
+            context = dc.get_async_token(context, self.credentials)
+            dc.apply_domain_connect_template_async(context, params={'IP': '192.0.2.1'})
+        return measure('async context + token + apply', call, self.domains('async_apply'), self.args.concurrency)
+
+    def sign(self):
+        domains = ['www.sign{}.com'.format(i) for i in range(self.args.domains)]
+
+        def call(domain):
+            self.signer.sig_params('domain={}&host=www&IP=192.0.2.1'.format(domain))
+        return measure('DomainConnectSigner.sig_params', call, domains, self.args.concurrency)
+
+
+SCENARIOS = ['discovery', 'discovery_bulk', 'sync_url', 'sync_url_bulk', 'signed_url', 'async_apply', 'sign']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmark of domainconnect against local stub servers')
+    parser.add_argument('--domains', type=int, default=200, help='operations per scenario (distinct domains)')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent callers or bulk workers')
+    parser.add_argument('--http-latency', type=float, default=0.0, help='seconds before each HTTP response')
+    parser.add_argument('--dns-latency', type=float, default=0.0, help='seconds before each DNS answer')
+    parser.add_argument('--static-dns', action='store_true', help='in-memory DNS backend instead of stub server')
+    parser.add_argument('--json', action='store_true', help='print results as JSON lines')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all if none given: {}'.format(
+        ', '.join(SCENARIOS)))
+    args = parser.parse_args(argv)
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: {}'.format(scenario))
+
+    bench = Bench(args)
+    try:
+        if not args.json:
+            print('{:<48} {:>7} {:>6} {:>10} {:>9} {:>9}'.format('scenario', 'ops', 'errors', 'ops/s', 'p50 ms',
+                                                               'p99 ms'))
+        for scenario in args.scenarios or SCENARIOS:
+            result = getattr(bench, scenario)().to_dict()
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print('{name:<48} {operations:>7} {errors:>6} {ops_per_sec:>10.1f} {p50_ms:>9.2f} {p99_ms:>9.2f}'
+                      .format(**result))
+            sys.stdout.flush()
+    finally:
+        bench.close()
+
+
+if __name__ == '__main__':
+    main()
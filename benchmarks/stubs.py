@@ -0,0 +1,189 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+# Local stand-ins of a DNS server and of a DNS provider's Domain Connect API with injectable latency
+
+import json
+import re
+import ssl
+import threading
+import time
+
+import dns.message
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+from six.moves import BaseHTTPServer, socketserver
+
+from domainconnect.tests.stub_server import self_signed_certificate
+
+PROVIDER_ID = 'exampleservice.domainconnect.org'
+SERVICE_ID = 'template1'
+
+
+class StubDNSServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    """UDP DNS server answering TXT queries from a zone map
+
+    Names not in the map get NXDOMAIN. Each query is answered in its own thread after latency seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, zones, latency=0, ttl=300):
+        """
+
+        :param zones: dict
+            lower case name mapped to TXT record, may be filled after start
+        :param latency: float
+            seconds before each answer
+        :param ttl: int
+        """
+        socketserver.UDPServer.__init__(self, ('127.0.0.1', 0), _DNSHandler)
+        self.zones = zones
+        self.latency = latency
+        self.ttl = ttl
+        self.queries = 0
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _DNSHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        data, sock = self.request
+        server = self.server
+        server.queries += 1
+        query = dns.message.from_wire(data)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        value = server.zones.get(question.name.to_text().rstrip('.').lower())
+        if value is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif question.rdtype == dns.rdatatype.TXT:
+            rrset = response.find_rrset(response.answer, question.name, dns.rdataclass.IN, dns.rdatatype.TXT,
+                                        create=True)
+            rrset.add(dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.TXT, '"{}"'.format(value)),
+                      server.ttl)
+        if server.latency:
+            time.sleep(server.latency)
+        sock.sendto(response.to_wire(), self.client_address)
+
+
+class StubProviderServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """HTTPS server playing a DNS provider for any domain root
+
+    Serves /v2/<root>/settings, template lookups of SERVICE_ID, /v2/oauth/access_token and apply.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    block_on_close = False
+    # concurrent clients open many connections at once
+    request_queue_size = 128
+
+    def __init__(self, latency=0, tls=True):
+        """
+
+        :param latency: float
+            seconds before each response
+        :param tls: bool
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _ProviderHandler)
+        self.latency = latency
+        self.tls = tls
+        self.cert_file = None
+        self.requests = 0
+        if tls:
+            self.cert_file, key_file = self_signed_certificate()
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(self.cert_file, key_file)
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def address(self):
+        return '127.0.0.1:{}'.format(self.server_address[1])
+
+    @property
+    def url_api(self):
+        return '{}://{}'.format('https' if self.tls else 'http', self.address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # clients closing kept alive connections are expected
+        pass
+
+
+class _ProviderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    _settings = re.compile(r'^/v2/([^/]+)/settings$')
+    _template = re.compile(r'^/v2/domainTemplates/providers/([^/]+)/services/([^/]+)(/apply)?$')
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _route(self, path):
+        server = self.server
+        match = self._settings.match(path)
+        if match is not None and self.command == 'GET':
+            return 200, {'providerId': 'stub', 'providerName': 'Stub', 'providerDisplayName': 'Stub',
+                         'urlSyncUX': 'https://sync.example.net', 'urlAsyncUX': 'https://async.example.net',
+                         'urlAPI': server.url_api}
+        if path == '/v2/oauth/access_token' and self.command == 'POST':
+            return 200, {'access_token': 'token', 'token_type': 'bearer', 'expires_in': 3600,
+                         'refresh_token': 'refresh'}
+        match = self._template.match(path)
+        if match is not None and match.group(1) == PROVIDER_ID and match.group(2) == SERVICE_ID:
+            if match.group(3) is None and self.command == 'GET':
+                return 200, {'providerId': PROVIDER_ID, 'serviceId': SERVICE_ID}
+            if match.group(3) is not None and self.command == 'POST':
+                return 202, {}
+        return 404, {'error': 'not found'}
+
+    def _handle(self):
+        self.server.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        status, body = self._route(self.path.split('?', 1)[0])
+        body = json.dumps(body).encode('utf-8')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
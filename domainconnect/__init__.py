@@ -7,5 +7,28 @@ __maintainer__ = "Pawel Kowalik"
 __email__ = "pawel-kow@users.noreply.github.com"
 __status__ = "Beta"
 
+import logging
+import sys
+
 from .domainconnect import *
-from .network import NetworkContext
+from .network import NetworkContext, ResponseTooLargeException
+from .cache import DiscoveryCache, SettingsCache, TemplateCache
+from .persistence import SQLiteStore
+from .signing import DomainConnectSigner
+from .tokens import AsyncTokenManager
+from .retry import RetryPolicy, CircuitBreaker, CircuitOpenException
+from .ratelimit import RateLimiter, RateLimitExceededException
+from .metrics import Tracer, HistogramCollector
+from .resolver import DnsBackend, DnsPythonBackend, DoHBackend, StaticBackend, TxtAnswer
+
+# logging is configured by the application, not at import of the library
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
+
+def __getattr__(name):
+    # asyncio client is imported on first use, python 3.7+ only
+    if name == 'AsyncDomainConnect' and sys.version_info >= (3, 7):
+        from .aio import AsyncDomainConnect
+        globals()[name] = AsyncDomainConnect
+        return AsyncDomainConnect
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
@@ -0,0 +1,690 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+# asyncio counterpart of DomainConnect, requires python 3.7+
+
+import asyncio
+import logging
+import socket
+import time
+
+try:
+    import dns.asyncresolver as asyncresolver
+except ImportError:
+    # dnspython < 2.0, lookups are run in executor
+    asyncresolver = None
+
+from .domainconnect import _DomainConnectBase, AsyncTokenException, ConflictOnApplyException, ApplyException, \
+    DeadlineExceededException
+from .cache import SettingsCache
+from .network import NetworkContext, ConnectionPool, HttpStatusException, ResponseTooLargeException, split_url, \
+    _is_failure, _parse_json, _CHUNK_SIZE, _IDEMPOTENT_METHODS
+from .concurrency import SingleFlightTimeout
+from .metrics import trace
+from .ratelimit import RateLimitExceededException
+from .retry import parse_retry_after
+from .resolver import get_resolver, get_dns_backend, query_options, txt_answer
+
+logger = logging.getLogger(__name__)
+
+
+class _StaleConnection(Exception):
+    pass
+
+
+class AsyncHttpClient:
+    """Minimal non-blocking HTTP/1.1 client with kept alive connections
+
+    Honors proxy, keep_alive and pool limits of NetworkContext.
+    """
+
+    def __init__(self, context):
+        """
+
+        :param context: NetworkContext
+        """
+        self._context = context
+        self._idle = dict()
+        self._semaphores = dict()
+        self._max_idle = None
+        self._idle_count = 0
+        self._next_sweep = 0
+        if context.pool is not None:
+            self._max_per_host = context.pool.max_per_host
+            self._idle_timeout = context.pool.idle_timeout
+            self._max_idle = context.pool.max_idle
+        else:
+            self._max_per_host = 10
+            self._idle_timeout = 0
+
+    async def request(self, method, url, body=None, headers=None, accepted_statuses=None, timeout=None):
+        """Sends request and reads the response
+
+        :param method: str
+        :param url: str
+        :param body: str
+        :param headers: dict
+        :param accepted_statuses: list(int)
+            list statuses which do not rise exception
+        :param timeout: float
+            remaining budget of the operation, limits connect and read timeouts of the context
+        :return: (bytes, int, dict)
+            response body, status and response headers with lower case names
+        """
+        if accepted_statuses is None:
+            accepted_statuses = [200]
+        protocol, host, path = split_url(url)
+        logger.debug('method = %s protocol = %s, host = %s, path = %s', method, protocol, host, path)
+        request = self._format_request(method, host, path, body, headers)
+        breaker = self._context.circuit_breaker
+        policy = self._context.retry_policy
+        limiter = self._context.rate_limiter
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            budget = None if timeout is None else timeout - (time.time() - start)
+            if breaker is not None:
+                breaker.before_request(host)
+            try:
+                if limiter is not None:
+                    delay = limiter.reserve(host, budget)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                        budget = None if timeout is None else timeout - (time.time() - start)
+                ret, status, response_headers = await self._send(protocol, host, method, request, budget)
+            except RateLimitExceededException:
+                # given up before sending, not a failure of the host
+                raise
+            except Exception as e:
+                if breaker is not None:
+                    breaker.record_failure(host)
+                delay = policy.next_delay(method, attempt, error=e, budget=budget) if policy is not None else None
+                if delay is None:
+                    raise
+                logger.debug('%s %s failed, retry in %.2fs: %s', method, url, delay, e)
+                await asyncio.sleep(delay)
+                continue
+            if breaker is not None:
+                if _is_failure(status):
+                    breaker.record_failure(host)
+                else:
+                    breaker.record_success(host)
+            if limiter is not None and status in (429, 503):
+                limiter.throttled(host, parse_retry_after(response_headers.get('retry-after')))
+            if status not in accepted_statuses and policy is not None:
+                delay = policy.next_delay(method, attempt, status=status, headers=response_headers, budget=budget)
+                if delay is not None:
+                    logger.debug('%s %s returned %s, retry in %.2fs', method, url, status, delay)
+                    await asyncio.sleep(delay)
+                    continue
+            break
+        if status not in accepted_statuses:
+            logger.debug('Failed to query %s: %s', url, status)
+            raise HttpStatusException(url, status, response_headers)
+        return ret, status, response_headers
+
+    async def _send(self, protocol, host, method, request, timeout):
+        """Sends request over kept alive or fresh connection and reads the response
+
+        :return: (bytes, int, dict)
+        """
+        connect_timeout, read_timeout = self._context.timeouts(timeout)
+        key = (protocol, host.lower())
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            limit = self._max_per_host
+            if self._context.rate_limiter is not None:
+                limit = min(limit, self._context.rate_limiter.capacity(host) or limit)
+            semaphore = self._semaphores[key] = asyncio.Semaphore(limit)
+        async with semaphore:
+            while True:
+                connection, reused = self._take_idle(key)
+                if connection is None:
+                    try:
+                        with trace(self._context.tracer, 'connect', host=host, tls=protocol == 'https'):
+                            connection = await asyncio.wait_for(self._open_connection(protocol, host),
+                                                                connect_timeout)
+                    except asyncio.TimeoutError:
+                        raise socket.timeout('timed out')
+                reader, writer = connection
+                try:
+                    # response is read along with the status line, request span includes the body
+                    with trace(self._context.tracer, 'request', host=host, method=method) as span:
+                        ret, status, response_headers, will_close = await asyncio.wait_for(
+                            self._exchange(reader, writer, request, method, host, self._context.max_body_size),
+                            read_timeout)
+                        span.set(status=status, bytes=len(ret))
+                except asyncio.TimeoutError:
+                    writer.close()
+                    raise socket.timeout('timed out')
+                except (_StaleConnection, asyncio.IncompleteReadError, ConnectionError) as e:
+                    writer.close()
+                    # the request may have been processed already, only idempotent ones are resent
+                    if reused and method.upper() in _IDEMPOTENT_METHODS:
+                        logger.debug('Kept alive connection to %s closed by server, reconnecting: %s', host, e)
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if will_close or self._context.pool is None:
+                    writer.close()
+                else:
+                    self._idle.setdefault(key, []).append((connection, time.time()))
+                    self._idle_count += 1
+                    self._evict_idle()
+                return ret, status, response_headers
+
+    async def close(self):
+        """Closes all kept alive connections"""
+        for idle in self._idle.values():
+            for (reader, writer), _ in idle:
+                writer.close()
+        self._idle.clear()
+        self._idle_count = 0
+
+    def _evict_idle(self):
+        """Closes expired idle connections of all hosts and the oldest ones beyond max_idle of the pool"""
+        now = time.time()
+        over_limit = self._max_idle is not None and self._idle_count > self._max_idle
+        if now < self._next_sweep and not over_limit:
+            return
+        self._next_sweep = now + ConnectionPool._SWEEP_INTERVAL
+        threshold = now - self._idle_timeout
+        for key in list(self._idle):
+            while self._idle.get(key) and self._idle[key][0][1] < threshold:
+                self._close_idle(key)
+        while self._max_idle is not None and self._idle_count > self._max_idle:
+            self._close_idle(min(self._idle, key=lambda k: self._idle[k][0][1]))
+
+    def _close_idle(self, key):
+        idle = self._idle[key]
+        (reader, writer), _ = idle.pop(0)
+        writer.close()
+        self._idle_count -= 1
+        if not idle:
+            del self._idle[key]
+
+    def _take_idle(self, key):
+        idle = self._idle.get(key)
+        threshold = time.time() - self._idle_timeout
+        while idle:
+            connection, last_used = idle.pop()
+            self._idle_count -= 1
+            if not idle:
+                del self._idle[key]
+            if last_used >= threshold and not connection[0].at_eof():
+                return connection, True
+            connection[1].close()
+        return None, False
+
+    @staticmethod
+    def _format_request(method, host, path, body, headers):
+        lines = ['{} {} HTTP/1.1'.format(method, path), 'Host: {}'.format(host), 'Accept-Encoding: identity']
+        if headers is not None:
+            lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+        if body is not None:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8')
+            lines.append('Content-Length: {}'.format(len(body)))
+        elif method in ('POST', 'PUT'):
+            lines.append('Content-Length: 0')
+        ret = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        if body is not None:
+            ret += body
+        return ret
+
+    async def _open_connection(self, protocol, host):
+        hostname, _, port = host.partition(':')
+        port = int(port) if port else (443 if protocol == 'https' else 80)
+        context = self._context
+        ssl_context = context.get_ssl_context() if protocol == 'https' else None
+        server_hostname = hostname if ssl_context is not None else None
+        if context.proxyHost is None or context.proxyPort is None:
+            return await asyncio.open_connection(hostname, port, ssl=ssl_context, server_hostname=server_hostname)
+
+        logger.debug('using proxy %s:%s', context.proxyHost, context.proxyPort)
+        loop = asyncio.get_running_loop()
+        family, socktype, proto, _, address = \
+            (await loop.getaddrinfo(context.proxyHost, int(context.proxyPort), type=socket.SOCK_STREAM))[0]
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+            await loop.sock_sendall(sock, 'CONNECT {0}:{1} HTTP/1.1\r\nHost: {0}:{1}\r\n\r\n'
+                                    .format(hostname, port).encode('latin-1'))
+            response = b''
+            while b'\r\n\r\n' not in response:
+                chunk = await loop.sock_recv(sock, 4096)
+                if not chunk:
+                    break
+                response += chunk
+            status_line = response.split(b'\r\n', 1)[0].decode('latin-1')
+            if len(status_line.split(' ')) < 2 or status_line.split(' ')[1] != '200':
+                raise Exception('Tunnel connection failed: {}'.format(status_line))
+            return await asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=server_hostname)
+        except BaseException:
+            sock.close()
+            raise
+
+    @classmethod
+    async def _exchange(cls, reader, writer, request, method, host=None, max_body_size=None):
+        writer.write(request)
+        await writer.drain()
+        return await cls._read_response(reader, method, host, max_body_size)
+
+    @staticmethod
+    async def _read_response(reader, method, host=None, max_body_size=None):
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise _StaleConnection('Connection closed without response')
+            parts = status_line.decode('latin-1').split(None, 2)
+            version, status = parts[0], int(parts[1])
+            headers = dict()
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, value = line.decode('latin-1').split(':', 1)
+                name = name.strip().lower()
+                headers[name] = headers[name] + ', ' + value.strip() if name in headers else value.strip()
+            if status != 100:
+                break
+
+        will_close = version == 'HTTP/1.0' or headers.get('connection', '').lower() == 'close'
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            total = 0
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                total += size
+                if max_body_size is not None and total > max_body_size:
+                    raise ResponseTooLargeException(host, max_body_size)
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            length = int(headers['content-length'])
+            if max_body_size is not None and length > max_body_size:
+                raise ResponseTooLargeException(host, max_body_size, length)
+            body = await reader.readexactly(length)
+        else:
+            chunks = []
+            total = 0
+            while True:
+                chunk = await reader.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if max_body_size is not None and total > max_body_size:
+                    raise ResponseTooLargeException(host, max_body_size)
+                chunks.append(chunk)
+            body = b''.join(chunks)
+            will_close = True
+        return body, status, headers, will_close
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent calls of the same coroutine, see: concurrency.SingleFlight"""
+
+    def __init__(self):
+        self._calls = dict()
+        self.leaders = 0
+        self.shared = 0
+
+    async def do(self, key, coroutine_function, *args, timeout=None):
+        """Awaits coroutine or the same operation started by another task
+
+        :param key: hashable
+            identifies the operation
+        :param coroutine_function: callable
+        :param timeout: float
+            seconds to wait for the operation of another task, no limit if not given
+        :return: result of the coroutine
+        :raises: SingleFlightTimeout
+            when the operation of another task did not finish within timeout
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            # not wait_for, a socket.timeout of the operation is also asyncio.TimeoutError on python 3.11+
+            await asyncio.wait([future], timeout=timeout)
+            if not future.done():
+                raise SingleFlightTimeout('Timeout waiting for {}'.format(key))
+            return future.result()
+        self.leaders += 1
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coroutine_function(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark as retrieved, there may be no other task waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self):
+        """Returns counters of operations run and of calls which shared result of another one
+
+        :return: dict
+        """
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'shared': self.shared}
+
+
+class AsyncDomainConnect(_DomainConnectBase):
+    """asyncio counterpart of DomainConnect
+
+    DNS lookups and HTTP requests do not block the event loop, so many discoveries can run concurrently.
+    All methods performing I/O are coroutines, otherwise the API mirrors DomainConnect.
+    """
+
+    def __init__(self, networkcontext=NetworkContext(), discovery_cache=None, settings_cache=None,
+                 template_cache=None):
+        """
+
+        :param networkcontext: NetworkContext
+        :param discovery_cache: DiscoveryCache
+            optional cache of _domainconnect TXT record lookups shared between calls
+        :param settings_cache: SettingsCache
+            optional cache of /settings documents of DNS providers shared between calls
+        :param template_cache: TemplateCache
+            optional cache of template existence checks shared between calls
+        """
+        _DomainConnectBase.__init__(self, networkcontext, discovery_cache, settings_cache, template_cache)
+        self._http = AsyncHttpClient(networkcontext)
+        self._revalidations = set()
+        # concurrent lookups of the same TXT record, settings or template share one request
+        self._flights = AsyncSingleFlight()
+        if networkcontext.dns_backend is None and asyncresolver is not None:
+            self._dns = None
+            self._resolver = get_resolver(networkcontext, asyncresolver.Resolver)
+        else:
+            # custom backends and dnspython < 2.0 block, lookups are run in executor
+            self._dns = get_dns_backend(networkcontext)
+            self._resolver = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        """Closes kept alive connections"""
+        await self._http.close()
+
+    async def _query_txt(self, name, lifetime=None):
+        if self._dns is None:
+            answer = await self._resolver.resolve(name, 'TXT', search=True,
+                                                  **query_options(self._networkContext, lifetime))
+            return txt_answer(answer)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._dns.lookup_txt, name, lifetime)
+
+    async def _do_shared(self, key, budget, function, *args):
+        """See: DomainConnect._do_shared"""
+        while True:
+            remaining = budget()
+            own = []
+
+            async def run():
+                own.append(True)
+                return await function(*(args + (remaining,)))
+            try:
+                return await self._flights.do(key, run, timeout=remaining)
+            except self._BUDGET_ERRORS:
+                if own:
+                    raise
+
+    async def _identify_domain_connect_api(self, domain_root, deadline=None):
+        domain_connect_api = self._cached_domain_connect_api(domain_root)
+        if domain_connect_api is not None:
+            return domain_connect_api
+        name = '_domainconnect.{}'.format(domain_root)
+        # noinspection PyBroadException
+        try:
+            with trace(self._networkContext.tracer, 'resolve', host=domain_root):
+                answer = await self._do_shared(('TXT', name), lambda: self._dns_lifetime(deadline, domain_root),
+                                               self._query_txt, name)
+        except Exception as e:
+            if deadline is not None:
+                deadline.check('resolving _domainconnect.{}'.format(domain_root))
+            raise self._domain_connect_api_not_found(domain_root, e)
+        return self._domain_connect_api_found(domain_root, answer)
+
+    async def get_domain_config(self, domain, timeout=None):
+        """Makes a discovery of domain name and resolves configuration of DNS provider
+
+        See: DomainConnect.get_domain_config
+        """
+        return await self._get_domain_config(domain, self._deadline(timeout))
+
+    async def _get_domain_config(self, domain, deadline):
+        domain_root, host = self._split_domain(domain)
+
+        domain_connect_api = await self._identify_domain_connect_api(domain_root, deadline)
+
+        ret = await self._get_domain_config_for_root(domain_root, domain_connect_api, deadline)
+        return self._domain_config(domain, domain_root, host, ret)
+
+    async def _get_domain_config_for_root(self, domain_root, domain_connect_api, deadline=None):
+        url = self._settings_url(domain_root, domain_connect_api)
+        stage = 'fetching settings of {}'.format(domain_root)
+        try:
+            with trace(self._networkContext.tracer, 'settings', host=domain_connect_api, domain=domain_root) as span:
+                if self._settings_cache is not None:
+                    response = await self._get_settings_cached(url, deadline, stage, span)
+                else:
+                    response = await self._do_shared(('settings', url), lambda: self._budget(deadline, stage),
+                                                     self._get_json, url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Domain Connect config for %s over %s: %s', domain_root, domain_connect_api, response)
+            return response
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            logger.debug("Exception when getting config:%s", e)
+            if deadline is not None:
+                deadline.check(stage)
+        raise self._settings_not_found(domain_root)
+
+    async def _get_json(self, url, timeout):
+        ret, _, _ = await self._http.request('GET', url, timeout=timeout)
+        return _parse_json(self._networkContext, ret)
+
+    async def _get_settings_cached(self, url, deadline=None, stage=None, span=None):
+        entry, state = self._settings_cache.lookup(url)
+        if span is not None:
+            span.set(cache_hit=state in (SettingsCache.FRESH, SettingsCache.STALE))
+        if state == SettingsCache.FRESH:
+            return entry.settings
+        if state == SettingsCache.STALE:
+            if self._settings_cache.start_revalidation(url):
+                task = asyncio.ensure_future(self._revalidate_settings(url, entry))
+                self._revalidations.add(task)
+                task.add_done_callback(self._revalidations.discard)
+            return entry.settings
+        return await self._do_shared(('settings', url), lambda: self._budget(deadline, stage),
+                                     self._fetch_settings, url, entry)
+
+    async def _revalidate_settings(self, url, entry):
+        # noinspection PyBroadException
+        try:
+            await self._fetch_settings(url, entry)
+        except Exception as e:
+            logger.debug('Revalidation of %s failed: %s', url, e)
+        finally:
+            self._settings_cache.finish_revalidation(url)
+
+    async def _fetch_settings(self, url, entry, timeout=None):
+        headers = dict()
+        if entry is not None and entry.etag is not None:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified is not None:
+            headers['If-Modified-Since'] = entry.last_modified
+        ret, status, response_headers = await self._http.request('GET', url, headers=headers,
+                                                                 accepted_statuses=[200, 304], timeout=timeout)
+        if status == 304:
+            if entry is None:
+                raise Exception('Unexpected 304 response from {}'.format(url))
+            return self._settings_cache.refresh(url, entry, response_headers).settings
+        data = _parse_json(self._networkContext, ret)
+        self._settings_cache.store(url, data, response_headers)
+        return data
+
+    async def _check_template(self, config, provider_id, service_id, deadline=None):
+        supported = self._cached_template_support(config, provider_id, service_id)
+        if supported is not None:
+            return supported
+        url = self._template_url(config, provider_id, service_id)
+        stage = 'checking template {}'.format(service_id)
+        try:
+            with trace(self._networkContext.tracer, 'template', api=config.urlAPI, service_id=service_id):
+                response = await self._do_shared(('template', url), lambda: self._budget(deadline, stage),
+                                                 self._get_http, url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Template for serviceId: %s from %s: %s', service_id, provider_id, response)
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if deadline is not None:
+                deadline.check(stage)
+            return self._template_checked(config, provider_id, service_id, e)
+        return self._template_checked(config, provider_id, service_id, None)
+
+    async def _get_http(self, url, timeout):
+        ret, _, _ = await self._http.request('GET', url, timeout=timeout)
+        return ret
+
+    async def check_template_supported(self, config, provider_id, service_ids, timeout=None):
+        """Checks templates of all service ids concurrently
+
+        :param config: DomainConnectConfig
+            domain connect config
+        :param provider_id: str
+            provider_id to check
+        :param service_ids: str or list(str)
+            service_id to check
+        :param timeout: float
+            seconds for all checks, operation_timeout of network context if not given
+        :raises: TemplateNotSupportedException
+            when any of templates is not supported, service_ids field lists all not supported ones
+        :raises: DeadlineExceededException
+            when checks did not finish in time
+        """
+        await self._check_templates_supported(config, provider_id, service_ids, self._deadline(timeout))
+
+    async def _check_templates_supported(self, config, provider_id, service_ids, deadline):
+        if type(service_ids) != list:
+            service_ids = [service_ids]
+
+        supported = await asyncio.gather(*[self._check_template(config, provider_id, service_id, deadline)
+                                           for service_id in service_ids])
+        self._raise_unsupported_templates(provider_id, service_ids, supported)
+
+    async def get_domain_connect_template_sync_url(self, domain, provider_id, service_id, redirect_uri=None,
+                                                   params=None, state=None, group_ids=None, sign=False,
+                                                   private_key=None, keyid=None, signer=None, timeout=None):
+        """Makes full Domain Connect discovery of a domain and returns full url to request sync consent.
+
+        See: DomainConnect.get_domain_connect_template_sync_url
+        """
+        if params is None:
+            params = {}
+
+        deadline = self._deadline(timeout)
+
+        config = await self._get_domain_config(domain, deadline)
+
+        await self._check_templates_supported(config, provider_id, service_id, deadline)
+
+        return self._build_sync_url(config, provider_id, service_id, redirect_uri, params, state, group_ids,
+                                    sign, private_key, keyid, signer)
+
+    async def get_domain_connect_template_async_context(self, domain, provider_id, service_id, redirect_uri,
+                                                        params=None, state=None, service_id_in_path=False,
+                                                        timeout=None):
+        """Makes full Domain Connect discovery of a domain and returns full context to request async consent.
+
+        See: DomainConnect.get_domain_connect_template_async_context
+        """
+        if params is None:
+            params = {}
+
+        deadline = self._deadline(timeout)
+
+        config = await self._get_domain_config(domain, deadline)
+
+        await self._check_templates_supported(config, provider_id, service_id, deadline)
+
+        return self._build_async_context(config, provider_id, service_id, redirect_uri, params, state,
+                                         service_id_in_path)
+
+    async def get_async_token(self, context, credentials, refresh_margin=60):
+        """Gets access_token in async process
+
+        See: DomainConnect.get_async_token
+        """
+        url_get_access_token = self._async_token_url(context, credentials, refresh_margin)
+        if url_get_access_token is None:
+            return context
+
+        try:
+            body = self._async_token_body(context, credentials)
+            ret, status, _ = await self._http.request('POST', url_get_access_token, body=body,
+                                                      headers={'Content-Type': 'application/json'},
+                                                      accepted_statuses=[200, 400])
+            try:
+                data = _parse_json(self._networkContext, ret)
+            except ValueError:
+                raise ValueError("Invalid JSON returned ({}): {}".format(status, ret.decode('utf-8', 'replace')))
+            self._check_async_token_status(data, status)
+        except AsyncTokenException:
+            raise
+        except Exception as ex:
+            logger.debug('Cannot get async token: %s', ex)
+            raise AsyncTokenException('Cannot get async token: {}'.format(ex))
+
+        return self._update_async_token(context, data)
+
+    async def apply_domain_connect_template_async(self, context, host=None, service_id=None,
+                                                  params=None, force=False, group_ids=None):
+        """Applies template with access token of the context
+
+        See: DomainConnect.apply_domain_connect_template_async
+        """
+        url = self._async_apply_url(context, host, service_id, params, force, group_ids)
+
+        try:
+            ret, status, _ = await self._http.request('POST', url,
+                                                      headers={'Authorization': 'Bearer {}'.format(
+                                                          context.access_token)},
+                                                      accepted_statuses=[200, 202, 409])
+            res = _parse_json(self._networkContext, ret)
+            if status in [409]:
+                raise ConflictOnApplyException("Conflict: {}".format(res))
+        except ConflictOnApplyException:
+            raise
+        except Exception as e:
+            raise ApplyException('Error on apply: {}'.format(e))
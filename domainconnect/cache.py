@@ -0,0 +1,468 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_tz, mktime_tz
+
+
+class LRUCache(object):
+    """Thread safe mapping with a size bound and least recently used eviction
+
+    Counts hits and misses of get() calls, see: stats()
+    """
+
+    def __init__(self, max_size=1024):
+        """
+
+        :param max_size: int
+            maximum number of entries kept, the least recently used one is evicted first
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Returns counters of the cache
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CacheEntry(object):
+    """Cached value with an absolute expiry time
+
+    Negative entries keep the error message of a failed lookup as value.
+    """
+
+    def __init__(self, value, expires, negative=False):
+        """
+
+        :param value: object
+        :param expires: float
+            unix timestamp after which the entry is not valid anymore
+        :param negative: bool
+        """
+        self.value = value
+        self.expires = expires
+        self.negative = negative
+
+
+def _encode_cache_entry(entry):
+    return json.dumps([entry.value, entry.negative]), entry.expires
+
+
+def _decode_cache_entry(text, expires):
+    value, negative = json.loads(text)
+    return CacheEntry(value, expires, negative)
+
+
+class DiscoveryCache(object):
+    """Cache for results of _domainconnect TXT record discovery keyed by domain root
+
+    Positive answers are kept for the TTL of the DNS answer (bounded by min_ttl and max_ttl),
+    negative answers (NXDOMAIN, no TXT record) for negative_ttl seconds.
+    """
+
+    _namespace = 'discovery'
+
+    def __init__(self, max_size=4096, negative_ttl=300, min_ttl=0, max_ttl=86400, clock=time.time, store=None):
+        """
+
+        :param max_size: int
+            maximum number of domain roots kept in memory
+        :param negative_ttl: int
+            seconds to remember a domain root without Domain Connect record, 0 disables negative caching
+        :param min_ttl: int
+            lower bound applied to the TTL of the DNS answer
+        :param max_ttl: int
+            upper bound applied to the TTL of the DNS answer
+        :param clock: callable
+            source of current time, for tests
+        :param store: SQLiteStore
+            keeps entries in a file shared with other processes instead of memory
+        """
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self._clock = clock
+        if store is not None:
+            self._entries = store.namespace(self._namespace, _encode_cache_entry, _decode_cache_entry)
+        else:
+            self._entries = LRUCache(max_size)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, domain_root):
+        """Returns a valid cache entry for the domain root
+
+        :param domain_root: str
+        :return: CacheEntry
+            or None if not cached or expired
+        """
+        entry = self._entries.get(domain_root)
+        if entry is not None and entry.expires <= self._clock():
+            # not deleted here, reads of a shared store must not write; replaced by put or removed by the cleaner
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, domain_root, domain_connect_api, ttl):
+        """Stores discovered API host for domain root
+
+        :param domain_root: str
+        :param domain_connect_api: str
+        :param ttl: int
+            TTL of the DNS answer in seconds
+        """
+        ttl = max(self.min_ttl, min(self.max_ttl, ttl))
+        if ttl <= 0:
+            return
+        self._entries.put(domain_root, CacheEntry(domain_connect_api, self._clock() + ttl))
+
+    def put_negative(self, domain_root, message):
+        """Remembers that domain root has no Domain Connect record
+
+        :param domain_root: str
+        :param message: str
+            error message to raise on cache hit
+        """
+        if self.negative_ttl <= 0:
+            return
+        self._entries.put(domain_root, CacheEntry(message, self._clock() + self.negative_ttl, negative=True))
+
+    def invalidate(self, domain_root):
+        self._entries.invalidate(domain_root)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Returns hit/miss counters of the cache
+
+        :return: dict
+        """
+        ret = self._entries.stats()
+        ret['hits'] = self.hits
+        ret['misses'] = self.misses
+        return ret
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TemplateCache(DiscoveryCache):
+    """Cache of template existence keyed by (urlAPI, provider_id, service_id)
+
+    Supported templates are remembered for ttl seconds, templates reported as not existing for negative_ttl seconds.
+    """
+
+    _namespace = 'template'
+
+    def __init__(self, max_size=4096, ttl=3600, negative_ttl=300, clock=time.time, store=None):
+        """
+
+        :param max_size: int
+            maximum number of templates kept in memory
+        :param ttl: int
+            seconds to remember an existing template
+        :param negative_ttl: int
+            seconds to remember a not existing template, 0 disables negative caching
+        :param clock: callable
+            source of current time, for tests
+        :param store: SQLiteStore
+            keeps entries in a file shared with other processes instead of memory
+        """
+        DiscoveryCache.__init__(self, max_size=max_size, negative_ttl=negative_ttl, max_ttl=ttl, clock=clock,
+                                store=store)
+        self.ttl = ttl
+
+    def put_supported(self, key):
+        self.put(key, True, self.ttl)
+
+
+def parse_cache_control(value):
+    """Parses value of Cache-Control header
+
+    :param value: str
+    :return: dict
+        directive names in lower case mapped to their value or None
+    """
+    ret = dict()
+    if not value:
+        return ret
+    for directive in value.split(','):
+        directive = directive.strip()
+        if not directive:
+            continue
+        if '=' in directive:
+            name, arg = directive.split('=', 1)
+            ret[name.strip().lower()] = arg.strip().strip('"')
+        else:
+            ret[directive.lower()] = None
+    return ret
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class SettingsEntry(object):
+    """Cached /settings document of a DNS provider together with HTTP validators"""
+
+    def __init__(self, settings, expires, stale_until, etag=None, last_modified=None):
+        """
+
+        :param settings: dict
+        :param expires: float
+            unix timestamp until which the document is fresh
+        :param stale_until: float
+            unix timestamp until which the document may be served while it is revalidated
+        :param etag: str
+        :param last_modified: str
+        """
+        self.settings = settings
+        self.expires = expires
+        self.stale_until = stale_until
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+def _encode_settings_entry(entry):
+    return json.dumps([entry.settings, entry.expires, entry.etag, entry.last_modified]), entry.stale_until
+
+
+def _decode_settings_entry(text, stale_until):
+    settings, expires, etag, last_modified = json.loads(text)
+    return SettingsEntry(settings, expires, stale_until, etag, last_modified)
+
+
+class SettingsCache(object):
+    """Cache for /settings documents of DNS providers keyed by URL
+
+    Freshness is taken from Cache-Control max-age (or Expires) of the response. Stale documents
+    with ETag or Last-Modified are revalidated with conditional GET. Within the stale-while-revalidate
+    window a stale document is served while the revalidation runs in background.
+    """
+
+    FRESH = 'fresh'
+    STALE = 'stale'
+    EXPIRED = 'expired'
+
+    def __init__(self, max_size=1024, default_max_age=0, stale_while_revalidate=60, clock=time.time, store=None):
+        """
+
+        :param max_size: int
+            maximum number of documents kept in memory
+        :param default_max_age: int
+            freshness in seconds for responses without Cache-Control max-age or Expires
+        :param stale_while_revalidate: int
+            seconds a stale document may be served during revalidation, if not given by the response; applies
+            only to responses with Cache-Control max-age or Expires
+        :param clock: callable
+            source of current time, for tests
+        :param store: SQLiteStore
+            keeps documents in a file shared with other processes instead of memory
+        """
+        self.default_max_age = default_max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self.clock = clock
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        if store is not None:
+            self._entries = store.namespace('settings', _encode_settings_entry, _decode_settings_entry)
+        else:
+            self._entries = LRUCache(max_size)
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, url):
+        """Returns cached document and its state
+
+        :param url: str
+        :return: (SettingsEntry, str)
+            entry (None if not cached) and one of FRESH, STALE (may be served during revalidation),
+            EXPIRED (has to be revalidated before use)
+        """
+        entry = self._entries.get(url)
+        now = self.clock()
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None, None
+            if now < entry.expires:
+                self.hits += 1
+                return entry, SettingsCache.FRESH
+            if now < entry.stale_until:
+                self.stale_hits += 1
+                return entry, SettingsCache.STALE
+            self.misses += 1
+            return entry, SettingsCache.EXPIRED
+
+    def store(self, url, settings, headers):
+        """Stores document received with 200 response
+
+        :param url: str
+        :param settings: dict
+        :param headers: dict
+            response headers with lower case names
+        :return: SettingsEntry
+            or None if the response must not be stored
+        """
+        cache_control = parse_cache_control(headers.get('cache-control'))
+        if 'no-store' in cache_control:
+            self._entries.invalidate(url)
+            return None
+        entry = SettingsEntry(settings, 0, 0, headers.get('etag'), headers.get('last-modified'))
+        self._update_freshness(entry, cache_control, headers)
+        if entry.stale_until <= self.clock() and entry.etag is None and entry.last_modified is None:
+            # nothing to serve from and nothing to revalidate with; an earlier entry is left to expire, another
+            # process may have just stored a fresh one
+            return None
+        self._entries.put(url, entry)
+        return entry
+
+    def refresh(self, url, entry, headers):
+        """Updates freshness of a document after 304 Not Modified response
+
+        :param url: str
+        :param entry: SettingsEntry
+        :param headers: dict
+            response headers with lower case names
+        :return: SettingsEntry
+        """
+        with self._lock:
+            self.not_modified += 1
+        refreshed = SettingsEntry(entry.settings, 0, 0,
+                                  headers.get('etag', entry.etag),
+                                  headers.get('last-modified', entry.last_modified))
+        self._update_freshness(refreshed, parse_cache_control(headers.get('cache-control')), headers)
+        self._entries.put(url, refreshed)
+        return refreshed
+
+    def start_revalidation(self, url):
+        """Marks URL as being revalidated
+
+        :param url: str
+        :return: bool
+            False if a revalidation of the URL is already running
+        """
+        with self._lock:
+            if url in self._revalidating:
+                return False
+            self._revalidating.add(url)
+            self.revalidations += 1
+            return True
+
+    def finish_revalidation(self, url):
+        with self._lock:
+            self._revalidating.discard(url)
+
+    def invalidate(self, url):
+        self._entries.invalidate(url)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Returns counters of the cache
+
+        :return: dict
+        """
+        ret = self._entries.stats()
+        with self._lock:
+            ret.update({
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'revalidations': self.revalidations,
+                'not_modified': self.not_modified,
+            })
+        return ret
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _update_freshness(self, entry, cache_control, headers):
+        now = self.clock()
+        max_age = 0
+        # only providers which opted into caching get stale documents served by default
+        opted_in = False
+        if 'no-cache' not in cache_control:
+            max_age = _int_or_none(cache_control.get('max-age'))
+            if max_age is not None:
+                max_age -= _int_or_none(headers.get('age')) or 0
+                opted_in = True
+            elif headers.get('expires') is not None:
+                expires = parsedate_tz(headers['expires'])
+                max_age = mktime_tz(expires) - now if expires is not None else 0
+                opted_in = True
+            else:
+                max_age = self.default_max_age
+        stale_while_revalidate = _int_or_none(cache_control.get('stale-while-revalidate'))
+        if stale_while_revalidate is None:
+            stale_while_revalidate = self.stale_while_revalidate if opted_in else 0
+        if 'must-revalidate' in cache_control or 'no-cache' in cache_control:
+            stale_while_revalidate = 0
+        entry.expires = now + max(max_age, 0)
+        entry.stale_until = entry.expires + stale_while_revalidate
@@ -0,0 +1,185 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import threading
+from collections import deque, OrderedDict
+
+
+class SingleFlightTimeout(Exception):
+    """Waiting for the result of an operation running in another thread timed out"""
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls of the same operation
+
+    While an operation for a key is running, other threads calling do() with the same key wait for it and get
+    its result or exception instead of running the operation again. Results are not kept after the operation
+    finished, caching is left to the caller.
+    """
+
+    def __init__(self):
+        self._calls = dict()
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, function, *args, **kwargs):
+        """Runs function or waits for the same operation started by another thread
+
+        :param key: hashable
+            identifies the operation
+        :param function: callable
+        :param timeout: float
+            keyword only, seconds to wait for the operation of another thread, no limit if not given
+        :return: result of the function
+        :raises: SingleFlightTimeout
+            when the operation of another thread did not finish within timeout
+        """
+        timeout = kwargs.pop('timeout', None)
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+        if not leader:
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeout('Timeout waiting for {}'.format(key))
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """Returns counters of operations run and of calls which shared result of another one
+
+        :return: dict
+        """
+        with self._lock:
+            return {'in_flight': len(self._calls), 'leaders': self.leaders, 'shared': self.shared}
+
+
+class FairScheduler(object):
+    """Queues of jobs per key, e.g. per provider API host, served in turns
+
+    pop() takes the next job of the key whose turn it is and moves the key to the end of the line. Keys running
+    max_per_key jobs already or refused by take are skipped, so jobs of other keys go ahead instead of waiting
+    behind them. Not thread safe, meant for the thread dispatching the jobs to a pool.
+    """
+
+    def __init__(self, max_per_key=None, take=None, delay=None):
+        """
+
+        :param max_per_key: int or callable
+            maximum of running jobs per key, or function of the key returning it (None for no limit)
+        :param take: callable
+            function of the key called before its job is popped, returns False if the job may not start now,
+            e.g. RateLimiter.take
+        :param delay: callable
+            function of the key returning seconds until take would succeed, e.g. RateLimiter.delay
+        """
+        self._max_per_key = max_per_key
+        self._take = take
+        self._delay = delay
+        self._queues = OrderedDict()
+        self._running = dict()
+        self._queued = 0
+
+    def push(self, key, job, first=False):
+        """Queues job
+
+        :param key: hashable
+        :param job: object
+        :param first: bool
+            put the job in front of other jobs of the key, e.g. a retry
+        """
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        if first:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        self._queued += 1
+
+    def pop(self):
+        """Takes next job which may start now and counts it as running until done(key)
+
+        :return: (hashable, object)
+            key and job, None if no job may start now
+        """
+        for key in list(self._queues):
+            if not self._may_start(key):
+                continue
+            queue = self._queues.pop(key)
+            job = queue.popleft()
+            if queue:
+                # the key takes its next turn after all others
+                self._queues[key] = queue
+            self._queued -= 1
+            self._running[key] = self._running.get(key, 0) + 1
+            return key, job
+        return None
+
+    def done(self, key):
+        """Marks job of the key finished"""
+        running = self._running[key] - 1
+        if running:
+            self._running[key] = running
+        else:
+            del self._running[key]
+
+    def retry_in(self):
+        """Returns seconds until a queued job delayed by its key may start
+
+        :return: float
+            None if no job waits for a delay
+        """
+        ret = None
+        if self._delay is None:
+            return ret
+        for key in self._queues:
+            if self._below_limit(key):
+                delay = self._delay(key)
+                if delay > 0 and (ret is None or delay < ret):
+                    ret = delay
+        return ret
+
+    def running(self):
+        """Returns number of running jobs"""
+        return sum(self._running.values())
+
+    def __len__(self):
+        return self._queued
+
+    def _below_limit(self, key):
+        limit = self._max_per_key(key) if callable(self._max_per_key) else self._max_per_key
+        return limit is None or self._running.get(key, 0) < limit
+
+    def _may_start(self, key):
+        return self._below_limit(key) and (self._take is None or self._take(key))
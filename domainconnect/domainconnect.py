@@ -7,32 +7,115 @@ __maintainer__ = "Pawel Kowalik"
 __email__ = "pawel-kow@users.noreply.github.com"
 __status__ = "Beta"
 
+import functools
 import logging
 import json
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from six.moves import urllib
 from dns.exception import Timeout
-from dns.resolver import Resolver, NXDOMAIN, YXDOMAIN, NoAnswer, NoNameservers
-from publicsuffixlist import PublicSuffixList
-try:
-    import webbrowser
-except ModuleNotFoundError:
-    pass
-import sys
-from .network import get_json, get_http, http_request_json, NetworkContext
-
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-
-from base64 import b64decode, b64encode
-
-logging.basicConfig(format='%(asctime)s %(levelname)s [%(name)s] %(message)s', level=logging.WARN)
+from dns.resolver import NXDOMAIN, NoAnswer, NoNameservers
+from .network import get_json, get_json_conditional, get_http, http_request_json, NetworkContext, \
+    HttpStatusException
+from .cache import LRUCache, SettingsCache
+from .concurrency import SingleFlight, FairScheduler
+from .metrics import trace, trace_event
+from .ratelimit import RateLimitExceededException
+from .resolver import get_dns_backend
+
+from .signing import DomainConnectSigner
+
 logger = logging.getLogger(__name__)
 
-psl = PublicSuffixList()
+_psl = None
+_psl_lock = threading.Lock()
+
+# (domain_root, host) by domain name, cleared when the Public Suffix List changes
+_domain_splits = LRUCache(max_size=65536)
+
+
+def get_public_suffix_list():
+    """Returns Public Suffix List used to identify domain roots
+
+    The list is loaded on first use, unless set before with set_public_suffix_list.
+
+    :return: PublicSuffixList
+    """
+    global _psl
+    if _psl is None:
+        with _psl_lock:
+            if _psl is None:
+                from publicsuffixlist import PublicSuffixList
+                _psl = PublicSuffixList()
+    return _psl
+
+
+def set_public_suffix_list(public_suffix_list):
+    """Sets Public Suffix List used to identify domain roots
+
+    Allows to share an already loaded list or to use a custom one.
+
+    :param public_suffix_list: PublicSuffixList
+        or any object with privatesuffix(domain) method
+    """
+    global _psl
+    with _psl_lock:
+        _psl = public_suffix_list
+        _domain_splits.clear()
+
+
+def split_domain(domain):
+    """Splits domain name into zone root and host
+
+    Results are memoized by domain name, a repeated name is split without consulting Public Suffix List again.
+
+    :param domain: str
+        domain name
+    :return: (str, str)
+        zone root and host (empty for the zone root itself),
+        (None, None) if the domain is a public suffix or not a valid domain name
+    """
+    ret = _domain_splits.get(domain)
+    if ret is None:
+        domain_root = get_public_suffix_list().privatesuffix(domain)
+        if domain_root is None:
+            ret = (None, None)
+        else:
+            name = domain.rstrip('.')
+            ret = (domain_root, name[:-len(domain_root) - 1] if len(name) > len(domain_root) else '')
+        _domain_splits.put(domain, ret)
+    return ret
+
+
+def split_domains(domains):
+    """Splits many domain names into zone root and host
+
+    :param domains: iterable(str)
+        domain names
+    :return: list((str, str))
+        zone root and host of each domain, in order of the input, see: split_domain
+    """
+    splits = dict()
+    ret = []
+    for domain in domains:
+        split = splits.get(domain)
+        if split is None:
+            split = splits[domain] = split_domain(domain)
+        ret.append(split)
+    return ret
+
+
+class _LazyPublicSuffixList(object):
+    """Former module attribute psl, loads the list on first use, see: get_public_suffix_list"""
+
+    def __getattr__(self, name):
+        return getattr(get_public_suffix_list(), name)
+
+
+psl = _LazyPublicSuffixList()
 
 
 class DomainConnectException(Exception):
@@ -86,20 +169,88 @@ class AsyncTokenException(DomainConnectException):
         DomainConnectException.__init__(self, *args, **kwargs)
 
 
-class DomainConnectConfig:
-    # TODO: implement serialization and deserialization to JSON
-    domain = None
-    domain_root = None
-    host = None
-    hosts = {}
-    urlSyncUX = None
-    urlAsyncUX = None
-    urlAPI = None
-    providerId = None
-    providerName = None
-    providerDisplayName = None
-    uxSize = None
-    urlControlPanel = None
+class DeadlineExceededException(DomainConnectException):
+    def __init__(self, *args, **kwargs):
+        DomainConnectException.__init__(self, *args, **kwargs)
+
+
+class Deadline:
+    """Time budget of an operation consisting of several network requests
+
+    Every stage of the operation gets only the remaining part of the budget.
+    """
+
+    def __init__(self, timeout, clock=getattr(time, 'monotonic', time.time)):
+        """
+
+        :param timeout: float
+            seconds available for the whole operation
+        :param clock: callable
+            source of current time, for tests
+        """
+        self._clock = clock
+        self.expires = clock() + timeout
+
+    def remaining(self):
+        """Returns seconds left, not less than 0
+
+        :return: float
+        """
+        return max(0.0, self.expires - self._clock())
+
+    def expired(self):
+        return self._clock() >= self.expires
+
+    def check(self, stage):
+        """Raises if the budget is used up
+
+        :param stage: str
+            description of the stage about to run or just failed, for the message
+        :raises: DeadlineExceededException
+        """
+        if self.expired():
+            logger.debug('Deadline exceeded while %s', stage)
+            raise DeadlineExceededException('Deadline exceeded while {}'.format(stage))
+
+
+# format version of to_bytes, first byte of the output
+_BINARY_VERSION = b'\x01'
+
+
+def _dump_bytes(values):
+    return _BINARY_VERSION + json.dumps(values, separators=(',', ':')).encode('utf-8')
+
+
+def _load_bytes(data, length):
+    if data[:1] != _BINARY_VERSION:
+        raise ValueError('Unsupported binary format: {!r}'.format(data[:1]))
+    values = json.loads(data[1:].decode('utf-8'))
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Malformed binary data')
+    return values
+
+
+def _get_state(obj):
+    return dict((name, getattr(obj, name)) for name in obj._FIELDS if hasattr(obj, name))
+
+
+def _set_state(obj, state):
+    # accepts the __dict__ of instances pickled before __slots__ and the (None, slots) state of the default
+    # protocol 2 reduction, attributes missing there were class defaults of None
+    if isinstance(state, tuple) and len(state) == 2:
+        state = dict(state[0] or {}, **(state[1] or {}))
+    for name in obj._FIELDS:
+        setattr(obj, name, state.get(name))
+
+
+class DomainConnectConfig(object):
+    """Settings of the DNS provider of a domain, see: DomainConnect.get_domain_config
+
+    Serialized with to_dict/to_json/to_bytes to keep it between steps of a flow.
+    """
+    _FIELDS = ('domain', 'domain_root', 'host', 'hosts', 'urlSyncUX', 'urlAsyncUX', 'urlAPI', 'providerId',
+               'providerName', 'providerDisplayName', 'uxSize', 'urlControlPanel')
+    __slots__ = _FIELDS
 
     def __init__(self, domain, domain_root, host, config):
         """Creates config object from /settings output of DNS provider
@@ -112,49 +263,93 @@ class DomainConnectConfig:
         self.domain = domain
         self.domain_root = domain_root
         self.host = host
-        if 'urlSyncUX' in config:
-            self.urlSyncUX = config['urlSyncUX']
-        if 'urlAsyncUX' in config:
-            self.urlAsyncUX = config['urlAsyncUX']
-        if 'urlAPI' in config:
-            self.urlAPI = config['urlAPI']
-        if 'providerId' in config:
-            self.providerId = config['providerId']
-        if 'providerName' in config:
-            self.providerName = config['providerName']
-        if 'providerDisplayName' in config:
-            self.providerDisplayName = config['providerDisplayName']
+        self.hosts = None
+        self.urlSyncUX = config.get('urlSyncUX')
+        self.urlAsyncUX = config.get('urlAsyncUX')
+        self.urlAPI = config.get('urlAPI')
+        self.providerId = config.get('providerId')
+        self.providerName = config.get('providerName')
+        self.providerDisplayName = config.get('providerDisplayName')
+        self.uxSize = None
         if 'width' in config and 'height' in config:
             self.uxSize = (config['width'], config['height'])
-        if 'urlControlPanel' in config:
-            self.urlControlPanel = config['urlControlPanel']
+        self.urlControlPanel = config.get('urlControlPanel')
 
+    def to_dict(self):
+        """Returns attributes as dict of JSON compatible values
 
-class DomainConnectAsyncContext:
-    config = None
-    """ :type: DomainConnectConfig """
-    providerId = None
-    """ :type: str """
-    serviceId = None
-    """ :type: str """
-    client_secret = None
-    """ :type: str """
-    asyncConsentUrl = None
-    """ :type: str """
-    code = None
-    """ :type: str """
-    params = None
-    """ :type: dict """
-    return_url = None
-    """ :type: str """
-    access_token = None
-    """ :type: str """
-    refresh_token = None
-    """ :type: str """
-    access_token_expires_in = None
-    """ :type: int """
-    iat = None
-    """ :type: int """
+        :return: dict
+        """
+        ret = dict((name, getattr(self, name)) for name in self._FIELDS)
+        if self.uxSize is not None:
+            ret['uxSize'] = list(self.uxSize)
+        return ret
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores config from to_dict output
+
+        :param data: dict
+        :return: DomainConnectConfig
+        """
+        ret = cls.__new__(cls)
+        for name in cls._FIELDS:
+            setattr(ret, name, data.get(name))
+        if ret.uxSize is not None:
+            ret.uxSize = tuple(ret.uxSize)
+        return ret
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def to_bytes(self):
+        """Returns compact binary form, attribute values without names
+
+        :return: bytes
+        """
+        return _dump_bytes(self._values())
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Restores config from to_bytes output
+
+        :param data: bytes
+        :return: DomainConnectConfig
+        :raises: ValueError
+            if data was not produced by to_bytes
+        """
+        return cls._from_values(_load_bytes(data, len(cls._FIELDS)))
+
+    def _values(self):
+        ret = [getattr(self, name) for name in self._FIELDS]
+        if self.uxSize is not None:
+            ret[self._FIELDS.index('uxSize')] = list(self.uxSize)
+        return ret
+
+    @classmethod
+    def _from_values(cls, values):
+        return cls.from_dict(dict(zip(cls._FIELDS, values)))
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        _set_state(self, state)
+
+
+class DomainConnectAsyncContext(object):
+    """State of the asynchronous flow of one domain between consent, token and apply
+
+    Serialized with to_dict/to_json/to_bytes to keep it between steps of the OAuth flow. The serialized form
+    contains the client secret and tokens and must be stored as securely as the credentials.
+    """
+    _FIELDS = ('config', 'providerId', 'serviceId', 'client_secret', 'asyncConsentUrl', 'code', 'params',
+               'return_url', 'access_token', 'refresh_token', 'access_token_expires_in', 'iat')
+    __slots__ = _FIELDS
 
     def __init__(self, config, provider_id, service_id, return_url, params):
         """Initiates the object
@@ -168,11 +363,86 @@ class DomainConnectAsyncContext:
         :param params: dict
         """
         self.config = config
+        """ :type: DomainConnectConfig """
         self.providerId = provider_id
         self.serviceId = service_id
         self.return_url = return_url
         self.params = params
         self.client_secret = ''
+        self.asyncConsentUrl = None
+        self.code = None
+        self.access_token = None
+        self.refresh_token = None
+        self.access_token_expires_in = None
+        """ :type: int """
+        self.iat = None
+        """ :type: int """
+
+    def to_dict(self):
+        """Returns attributes as dict of JSON compatible values, config included
+
+        :return: dict
+        """
+        ret = dict((name, getattr(self, name)) for name in self._FIELDS)
+        if self.config is not None:
+            ret['config'] = self.config.to_dict()
+        return ret
+
+    @classmethod
+    def from_dict(cls, data):
+        """Restores context from to_dict output
+
+        :param data: dict
+        :return: DomainConnectAsyncContext
+        """
+        ret = cls.__new__(cls)
+        for name in cls._FIELDS:
+            setattr(ret, name, data.get(name))
+        if ret.config is not None:
+            ret.config = DomainConnectConfig.from_dict(ret.config)
+        return ret
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def to_bytes(self):
+        """Returns compact binary form, attribute values without names
+
+        :return: bytes
+        """
+        values = [getattr(self, name) for name in self._FIELDS]
+        if self.config is not None:
+            values[0] = self.config._values()
+        return _dump_bytes(values)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Restores context from to_bytes output
+
+        :param data: bytes
+        :return: DomainConnectAsyncContext
+        :raises: ValueError
+            if data was not produced by to_bytes
+        """
+        values = _load_bytes(data, len(cls._FIELDS))
+        ret = cls.__new__(cls)
+        for name, value in zip(cls._FIELDS, values):
+            setattr(ret, name, value)
+        if ret.config is not None:
+            if len(ret.config) != len(DomainConnectConfig._FIELDS):
+                raise ValueError('Malformed binary data')
+            ret.config = DomainConnectConfig._from_values(ret.config)
+        return ret
+
+    def __getstate__(self):
+        return _get_state(self)
+
+    def __setstate__(self, state):
+        _set_state(self, state)
 
 
 class DomainConnectAsyncCredentials:
@@ -195,74 +465,620 @@ class DomainConnectAsyncCredentials:
         self.api_url = api_url
 
 
-class DomainConnect:
+class _DomainConnectBase:
+    """Protocol logic shared by DomainConnect and AsyncDomainConnect, free of any I/O"""
     _networkContext = NetworkContext()
-    _resolver = Resolver()
 
-    def __init__(self, networkcontext=NetworkContext()):
+    def __init__(self, networkcontext=NetworkContext(), discovery_cache=None, settings_cache=None,
+                 template_cache=None):
+        """
+
+        :param networkcontext: NetworkContext
+        :param discovery_cache: DiscoveryCache
+            optional cache of _domainconnect TXT record lookups shared between calls
+        :param settings_cache: SettingsCache
+            optional cache of /settings documents of DNS providers shared between calls
+        :param template_cache: TemplateCache
+            optional cache of template existence checks shared between calls
+        """
         self._networkContext = networkcontext
-        if networkcontext.nameservers is not None:
-            self._resolver.nameservers = networkcontext.nameservers.split(',')
+        self._discovery_cache = discovery_cache
+        self._settings_cache = settings_cache
+        self._template_cache = template_cache
+
+    def _deadline(self, timeout):
+        """Creates deadline of a compound operation
+
+        :param timeout: float
+            seconds for the operation, operation_timeout of network context if not given
+        :return: Deadline
+            or None if the operation is not limited
+        """
+        if timeout is None:
+            timeout = self._networkContext.operation_timeout
+        if timeout is None:
+            return None
+        return Deadline(timeout)
+
+    @staticmethod
+    def _budget(deadline, stage):
+        """Returns time left for the next stage of an operation
+
+        :return: float
+            or None if the operation is not limited
+        :raises: DeadlineExceededException
+            when nothing is left
+        """
+        if deadline is None:
+            return None
+        deadline.check(stage)
+        return deadline.remaining()
+
+    # errors of a shared request which may be caused by the short budget of the caller who ran it
+    _BUDGET_ERRORS = (socket.timeout, Timeout, RateLimitExceededException)
+
+    def _dns_lifetime(self, deadline, domain_root):
+        lifetime = self._networkContext.dns_timeout
+        budget = self._budget(deadline, 'resolving _domainconnect.{}'.format(domain_root))
+        if budget is not None and (lifetime is None or budget < lifetime):
+            lifetime = budget
+        return lifetime
 
     @staticmethod
     def identify_domain_root(domain):
-        return psl.privatesuffix(domain)
+        return split_domain(domain)[0]
+
+    @staticmethod
+    def _split_domain(domain):
+        domain_root, host = split_domain(domain)
+        if domain_root is None:
+            raise NoDomainConnectRecordException('Cannot identify domain root of "{}"'.format(domain))
+        return domain_root, host
+
+    def _cached_domain_connect_api(self, domain_root):
+        """Returns API host from discovery cache
+
+        :return: str
+            or None if not cached
+        :raises: NoDomainConnectRecordException
+            when cached negative answer is found
+        """
+        if self._discovery_cache is not None:
+            entry = self._discovery_cache.get(domain_root)
+            if entry is not None:
+                trace_event(self._networkContext.tracer, 'resolve', host=domain_root, cache_hit=True,
+                            negative=entry.negative)
+                if entry.negative:
+                    raise NoDomainConnectRecordException(entry.value)
+                logger.debug('Domain Connect API %s for %s found in cache.', entry.value, domain_root)
+                return entry.value
+        return None
+
+    def _domain_connect_api_found(self, domain_root, answer):
+        """
+
+        :param domain_root: str
+        :param answer: TxtAnswer
+        :return: str
+        """
+        domain_connect_api = answer.values[0]
+        logger.debug('Domain Connect API %s for %s found.', domain_connect_api, domain_root)
+        if self._discovery_cache is not None:
+            self._discovery_cache.put(domain_root, domain_connect_api, answer.ttl)
+        return domain_connect_api
+
+    def _domain_connect_api_not_found(self, domain_root, error):
+        """Translates resolver error into exception to be raised
+
+        :param domain_root: str
+        :param error: Exception
+        :return: NoDomainConnectRecordException
+        """
+        if isinstance(error, Timeout):
+            logger.debug('Timeout. Failed to find Domain Connect API for "%s"', domain_root)
+            return NoDomainConnectRecordException(
+                'Timeout. Failed to find Domain Connect API for "{}"'.format(domain_root))
+        if isinstance(error, NXDOMAIN):
+            logger.debug('Failed to resolve "%s"', domain_root)
+            self._cache_negative_discovery(domain_root, 'Failed to resolve "{}"'.format(domain_root))
+            return NoDomainConnectRecordException('Failed to resolve "{}"'.format(domain_root))
+        if isinstance(error, NoAnswer):
+            logger.debug('No Domain Connect API found for "%s"', domain_root)
+            self._cache_negative_discovery(domain_root, 'No Domain Connect API found for "{}"'.format(domain_root))
+            return NoDomainConnectRecordException('No Domain Connect API found for "{}"'.format(domain_root))
+        if isinstance(error, NoNameservers):
+            logger.debug('No nameservers avalaible for "%s"', domain_root)
+            return NoDomainConnectRecordException('No nameservers avalaible for "{}"'.format(domain_root))
+        logger.debug('No Domain Connect API found for "%s"', domain_root)
+        return NoDomainConnectRecordException('No Domain Connect API found for "{}"'.format(domain_root))
+
+    def _cache_negative_discovery(self, domain_root, message):
+        if self._discovery_cache is not None:
+            self._discovery_cache.put_negative(domain_root, message)
+
+    def _domain_config(self, domain, domain_root, host, settings):
+        config = DomainConnectConfig(domain, domain_root, host, settings)
+        self._register_provider(config)
+        return config
+
+    def _register_provider(self, config):
+        # limits configured per provider id apply to its API host
+        limiter = self._networkContext.rate_limiter
+        if limiter is not None:
+            limiter.register_provider(config.providerId, config.urlAPI)
+
+    @staticmethod
+    def _settings_url(domain_root, domain_connect_api):
+        return 'https://{}/v2/{}/settings'.format(domain_connect_api, domain_root)
+
+    @staticmethod
+    def _template_url(config, provider_id, service_id):
+        return '{}/v2/domainTemplates/providers/{}/services/{}' \
+            .format(config.urlAPI, provider_id, service_id)
+
+    def _cached_template_support(self, config, provider_id, service_id):
+        """Returns cached result of template check
+
+        :return: bool
+            or None if not cached
+        """
+        if self._template_cache is None:
+            return None
+        entry = self._template_cache.get((config.urlAPI, provider_id, service_id))
+        if entry is None:
+            return None
+        trace_event(self._networkContext.tracer, 'template', api=config.urlAPI, service_id=service_id,
+                    cache_hit=True, negative=entry.negative)
+        return not entry.negative
+
+    def _template_checked(self, config, provider_id, service_id, error):
+        """Records result of template check
+
+        :param error: Exception
+            error of template request or None if template exists
+        :return: bool
+            template supported, None if not known because of a transient error
+        """
+        key = (config.urlAPI, provider_id, service_id)
+        if error is None:
+            if self._template_cache is not None:
+                self._template_cache.put_supported(key)
+            return True
+        logger.debug("Exception when getting config:%s", error)
+        # only definite answer of the provider is remembered, not transient errors
+        if not isinstance(error, HttpStatusException) or error.status != 404:
+            return None
+        if self._template_cache is not None:
+            self._template_cache.put_negative(key, 'No template for serviceId: {} from {}'.format(service_id,
+                                                                                               provider_id))
+        return False
+
+    @staticmethod
+    def _raise_unsupported_templates(provider_id, service_ids, supported):
+        unsupported = [service_id for service_id, ok in zip(service_ids, supported) if not ok]
+        if unsupported:
+            ex = TemplateNotSupportedException(
+                'No template for serviceId: {} from {}'.format(', '.join(unsupported), provider_id))
+            ex.service_ids = unsupported
+            # some checks failed with transient errors, the templates may exist
+            ex.transient = any(ok is None for ok in supported)
+            raise ex
+
+    @staticmethod
+    def _settings_not_found(domain_root):
+        logger.debug('No Domain Connect config found for %s.', domain_root)
+        return NoDomainConnectSettingsException('No Domain Connect config found for {}.'.format(domain_root))
+
+    # Generates a signature on the passed in data
+    @staticmethod
+    def _generate_sig(private_key, data):
+        return DomainConnectSigner(private_key, None).sign(data)
+
+    @staticmethod
+    def _generate_sig_params(queryparams, private_key=None, keyid=None, signer=None):
+        if signer is None:
+            if private_key is None or keyid is None:
+                raise InvalidDomainConnectSettingsException("Private key and/or key ID not provided for signing")
+            signer = DomainConnectSigner(private_key, keyid)
+        return signer.sig_params(queryparams)
+
+    def _build_sync_url(self, config, provider_id, service_id, redirect_uri, params, state, group_ids, sign,
+                        private_key, keyid, signer=None):
+        if config.urlSyncUX is None:
+            raise InvalidDomainConnectSettingsException("No sync URL in config")
+
+        sync_url_format = '{}/v2/domainTemplates/providers/{}/services/{}/' \
+                          'apply?{}{}'
+
+        params['domain'] = config.domain_root
+        if config.host is not None and config.host != '':
+            params['host'] = config.host
+        if redirect_uri is not None:
+            params["redirect_uri"] = redirect_uri
+        if state is not None:
+            params["state"] = state
+        if group_ids is not None:
+            params["groupId"] = ",".join(group_ids)
+
+        queryparams = urllib.parse.urlencode(sorted(params.items(), key=lambda val: val[0]))
+        sigparams = ''
+        if sign or signer is not None:
+            with trace(self._networkContext.tracer, 'sign'):
+                sigparams = self._generate_sig_params(queryparams, private_key, keyid, signer)
+
+        return sync_url_format.format(config.urlSyncUX, provider_id, service_id, queryparams, sigparams)
+
+    @staticmethod
+    def _build_async_context(config, provider_id, service_id, redirect_uri, params, state, service_id_in_path):
+        if config.urlAsyncUX is None:
+            raise InvalidDomainConnectSettingsException("No asynch UX URL in config")
+
+        if service_id_in_path:
+            if type(service_id) is list:
+                raise DomainConnectException("Multiple services are only supported with service_id_in_path=false")
+            async_url_format = '{0}/v2/domainTemplates/providers/{1}/services/{2}' \
+                               '?client_id={1}&scope={2}&domain={3}&host={4}&{5}'
+        else:
+            if type(service_id) is list:
+                service_id = '+'.join(service_id)
+            async_url_format = '{0}/v2/domainTemplates/providers/{1}' \
+                               '?client_id={1}&scope={2}&domain={3}&host={4}&{5}'
+
+        if redirect_uri is not None:
+            params["redirect_uri"] = redirect_uri
+        if state is not None:
+            params["state"] = state
+
+        ret = DomainConnectAsyncContext(config, provider_id, service_id, redirect_uri, params)
+        ret.asyncConsentUrl = async_url_format.format(config.urlAsyncUX, provider_id, service_id,
+                                                      config.domain_root, config.host,
+                                                      urllib.parse.urlencode(
+                                                          sorted(params.items(), key=lambda val: val[0])))
+        return ret
+
+    @staticmethod
+    def _async_token_url(context, credentials, refresh_margin=60):
+        """Returns URL to obtain or refresh access token
+
+        :param refresh_margin: int
+            seconds before expiry from which the access token gets refreshed, None to refresh it anyway
+        :return: str
+            or None if the context has a valid access token
+        """
+        params = {'code': context.code, 'grant_type': 'authorization_code'}
+        if getattr(context, 'iat', None) and getattr(context, 'access_token_expires_in', None) and \
+                getattr(context, 'refresh_token', None):
+            if refresh_margin is None or \
+                    int(time.time()) + refresh_margin > context.iat + context.access_token_expires_in:
+                params = {'refresh_token': context.refresh_token, 'grant_type': 'refresh_token',
+                          'client_id': credentials.client_id, 'client_secret': credentials.client_secret
+                }
+            else:
+                logger.debug('Context has a valid access token')
+                return None
+        params['redirect_uri'] = context.return_url
+
+        return '{}/v2/oauth/access_token?{}'.format(context.config.urlAPI,
+                                                   urllib.parse.urlencode(
+                                                       sorted(params.items(), key=lambda val: val[0])))
+
+    @staticmethod
+    def _async_token_body(context, credentials):
+        # this has to be checked to avoid secret leakage by spoofed "settings" end-point
+        if credentials.api_url != context.config.urlAPI:
+            raise AsyncTokenException("URL API for provider does not match registered one with credentials")
+        return json.dumps({
+            'client_id': credentials.client_id,
+            'client_secret': credentials.client_secret,
+        })
+
+    @staticmethod
+    def _check_async_token_status(data, status):
+        if status == 400:
+            raise AsyncTokenException(
+                'Failed to get async token: {} {} {}'.format(
+                        status,
+                        data["error"],
+                        data["error_description"] if "error_description" in data else ""))
+
+    @staticmethod
+    def _update_async_token(context, data):
+        if 'access_token' not in data \
+                or 'expires_in' not in data \
+                or 'token_type' not in data \
+                or data['token_type'].lower() != 'bearer':
+            logger.debug('Token not complete: %s', data)
+            raise AsyncTokenException('Token not complete: {}'.format(data))
+
+        context.access_token = data['access_token']
+        context.access_token_expires_in = data['expires_in']
+        context.iat = int(time.time())
+
+        if 'refresh_token' in data:
+            context.refresh_token = data['refresh_token']
+
+        return context
+
+    @staticmethod
+    def _async_apply_url(context, host, service_id, params, force, group_ids):
+        if params is None:
+            params = {}
+        if host is None:
+            host = context.config.host
+        if service_id is None:
+            service_id = context.serviceId
+        if group_ids is not None:
+            params["groupId"] = ",".join(group_ids)
+
+        async_url_format = '{}/v2/domainTemplates/providers/{}/services/{}/' \
+                           'apply?domain={}&host={}&{}'
+
+        if force:
+            params['force'] = 'true'
+
+        return async_url_format.format(context.config.urlAPI, context.providerId, service_id,
+                                       context.config.domain_root, host,
+                                       urllib.parse.urlencode(sorted(params.items(), key=lambda val: val[0])))
+
+
+class DomainConnect(_DomainConnectBase):
+
+    def __init__(self, networkcontext=NetworkContext(), discovery_cache=None, settings_cache=None,
+                 template_cache=None):
+        """
 
-    def _identify_domain_connect_api(self, domain_root):
+        :param networkcontext: NetworkContext
+        :param discovery_cache: DiscoveryCache
+            optional cache of _domainconnect TXT record lookups shared between calls
+        :param settings_cache: SettingsCache
+            optional cache of /settings documents of DNS providers shared between calls
+        :param template_cache: TemplateCache
+            optional cache of template existence checks shared between calls
+        """
+        _DomainConnectBase.__init__(self, networkcontext, discovery_cache, settings_cache, template_cache)
+        self._dns = get_dns_backend(networkcontext)
+        # concurrent lookups of the same TXT record, settings or template share one request
+        self._flights = SingleFlight()
+
+    def _do_shared(self, key, budget, function, *args):
+        """Runs function(*args, budget()) once for concurrent callers of the key
+
+        A caller which waited for the request of another one and got its timeout tries again with its own
+        remaining budget, so a short deadline of one caller does not fail the others.
+
+        :param budget: callable
+            returns time left for this caller, None if not limited
+        """
+        while True:
+            remaining = budget()
+            own = []
+
+            def run():
+                own.append(True)
+                return function(*(args + (remaining,)))
+            try:
+                return self._flights.do(key, run, timeout=remaining)
+            except self._BUDGET_ERRORS:
+                if own:
+                    raise
+
+    def _identify_domain_connect_api(self, domain_root, deadline=None):
+        domain_connect_api = self._cached_domain_connect_api(domain_root)
+        if domain_connect_api is not None:
+            return domain_connect_api
+        name = '_domainconnect.{}'.format(domain_root)
         # noinspection PyBroadException
         try:
-            dns = self._resolver.query('_domainconnect.{}'.format(domain_root), 'TXT')
-            domain_connect_api = str(dns[0]).replace('"', '')
-            logger.debug('Domain Connect API {} for {} found.'.format(domain_connect_api, domain_root))
-            return domain_connect_api
-        except Timeout:
-            logger.debug('Timeout. Failed to find Domain Connect API for "{}"'.format(domain_root))
-            raise NoDomainConnectRecordException(
-                'Timeout. Failed to find Domain Connect API for "{}"'.format(domain_root))
-        except NXDOMAIN or YXDOMAIN:
-            logger.debug('Failed to resolve "{}"'.format(domain_root))
-            raise NoDomainConnectRecordException('Failed to resolve "{}"'.format(domain_root))
-        except NoAnswer:
-            logger.debug('No Domain Connect API found for "{}"'.format(domain_root))
-            raise NoDomainConnectRecordException('No Domain Connect API found for "{}"'.format(domain_root))
-        except NoNameservers:
-            logger.debug('No nameservers avalaible for "{}"'.format(domain_root))
-            raise NoDomainConnectRecordException('No nameservers avalaible for "{}"'.format(domain_root))
-        except Exception:
-            pass
-        logger.debug('No Domain Connect API found for "{}"'.format(domain_root))
-        raise NoDomainConnectRecordException('No Domain Connect API found for "{}"'.format(domain_root))
-
-    def get_domain_config(self, domain):
+            with trace(self._networkContext.tracer, 'resolve', host=domain_root):
+                answer = self._do_shared(('TXT', name), lambda: self._dns_lifetime(deadline, domain_root),
+                                         self._dns.lookup_txt, name)
+        except Exception as e:
+            if deadline is not None:
+                deadline.check('resolving _domainconnect.{}'.format(domain_root))
+            raise self._domain_connect_api_not_found(domain_root, e)
+        return self._domain_connect_api_found(domain_root, answer)
+
+    def identify_domain_connect_apis(self, domain_roots, timeout=None):
+        """Discovers Domain Connect API of many domain roots with one batch lookup
+
+        Roots found in discovery cache are not looked up again.
+
+        :param domain_roots: iterable(str)
+            domain roots, see: identify_domain_root
+        :param timeout: float
+            seconds for the lookups, dns_timeout of network context if not given
+        :return: dict
+            domain root mapped to API host or to NoDomainConnectRecordException
+        """
+        ret = dict()
+        names = dict()
+        for domain_root in domain_roots:
+            try:
+                domain_connect_api = self._cached_domain_connect_api(domain_root)
+            except NoDomainConnectRecordException as e:
+                ret[domain_root] = e
+                continue
+            if domain_connect_api is not None:
+                ret[domain_root] = domain_connect_api
+            else:
+                names['_domainconnect.{}'.format(domain_root)] = domain_root
+        if names:
+            lifetime = timeout if timeout is not None else self._networkContext.dns_timeout
+            for name, answer in self._dns.lookup_txt_many(list(names), lifetime).items():
+                domain_root = names[name]
+                if isinstance(answer, Exception):
+                    ret[domain_root] = self._domain_connect_api_not_found(domain_root, answer)
+                else:
+                    ret[domain_root] = self._domain_connect_api_found(domain_root, answer)
+        return ret
+
+    def get_domain_config(self, domain, timeout=None):
         """Makes a discovery of domain name and resolves configuration of DNS provider
 
         :param domain: str
             domain name
+        :param timeout: float
+            seconds for the whole discovery, operation_timeout of network context if not given
         :return: DomainConnectConfig
             domain connect config
         :raises: NoDomainConnectRecordException
             when no _domainconnect record found
         :raises: NoDomainConnectSettingsException
             when settings are not found
+        :raises: DeadlineExceededException
+            when discovery did not finish in time
         """
-        domain_root = self.identify_domain_root(domain)
+        return self._get_domain_config(domain, self._deadline(timeout))
 
-        host = ''
-        if len(domain_root) != len(domain):
-            host = domain.replace('.' + domain_root, '')
+    def _get_domain_config(self, domain, deadline):
+        domain_root, host = self._split_domain(domain)
 
-        domain_connect_api = self._identify_domain_connect_api(domain_root)
+        ret = self._get_domain_settings(domain_root, deadline)
+        return self._domain_config(domain, domain_root, host, ret)
 
-        ret = self._get_domain_config_for_root(domain_root, domain_connect_api)
-        return DomainConnectConfig(domain, domain_root, host, ret)
+    def get_domain_configs(self, domains, max_workers=16):
+        """Makes discovery of many domain names concurrently
 
-    def _get_domain_config_for_root(self, domain_root, domain_connect_api):
+        Each domain root is resolved and its settings fetched only once. Results are yielded in order of
+        completion, the input is consumed lazily.
+
+        :param domains: iterable(str)
+            domain names
+        :param max_workers: int
+            maximum number of concurrent discoveries
+        :return: generator((str, DomainConnectConfig or DomainConnectException))
+            domain name and its config or the exception raised by its discovery
+        """
+        for domain, _, result in self._iter_domain_configs(((domain, None) for domain in domains), max_workers):
+            yield domain, result
+
+    def _iter_domain_configs(self, items, max_workers):
+        """Bulk discovery carrying a payload along with each domain
+
+        :param items: iterable((str, object))
+            domain name and payload
+        :param max_workers: int
+        :return: generator((str, object, DomainConnectConfig or DomainConnectException))
+        """
+        items = iter(items)
+        window = max_workers * 4
+        # settings are fetched in turns per provider API host, honoring its rate limits
+        scheduler = self._provider_scheduler(None)
+        # domain root -> future with its settings or with the error of its discovery, bounded for long streams,
+        # an evicted root is discovered again, through discovery and settings caches if the client has them
+        results = LRUCache(max_size=4096)
+        # domain root -> [(domain, payload, host)] waiting for the discovery of the root
+        waiting = dict()
+        # future -> (domain root, API host or None for the DNS lookup)
+        futures = dict()
+        in_flight = 0
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while True:
+                while not exhausted and in_flight < window:
+                    try:
+                        domain, payload = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    try:
+                        domain_root, host = self._split_domain(domain)
+                    except NoDomainConnectRecordException as e:
+                        yield domain, payload, e
+                        continue
+                    finished = results.get(domain_root)
+                    if finished is not None:
+                        yield domain, payload, self._domain_config_from_future(domain, domain_root, host, finished)
+                        continue
+                    if domain_root not in waiting:
+                        waiting[domain_root] = []
+                        future = executor.submit(self._identify_domain_connect_api, domain_root)
+                        futures[future] = (domain_root, None)
+                    waiting[domain_root].append((domain, payload, host))
+                    in_flight += 1
+                while scheduler.running() < max_workers:
+                    scheduled = scheduler.pop()
+                    if scheduled is None:
+                        break
+                    api, domain_root = scheduled
+                    futures[executor.submit(self._get_domain_config_for_root, domain_root, api)] = (domain_root, api)
+                if not futures and not scheduler:
+                    break
+                for future in self._wait_scheduled(futures, scheduler):
+                    domain_root, api = futures.pop(future)
+                    if api is not None:
+                        scheduler.done(api)
+                    elif future.exception() is None:
+                        scheduler.push(future.result(), domain_root)
+                        continue
+                    results.put(domain_root, future)
+                    for domain, payload, host in waiting.pop(domain_root):
+                        in_flight -= 1
+                        yield domain, payload, self._domain_config_from_future(domain, domain_root, host, future)
+        finally:
+            executor.shutdown(wait=False)
+
+    def _provider_scheduler(self, max_per_provider):
+        """Returns FairScheduler of jobs keyed by API host or URL of providers, honoring rate limiter of the context
+
+        :param max_per_provider: int
+            maximum of concurrent jobs per provider, None for no limit besides the rate limiter
+        :return: FairScheduler
+        """
+        limiter = self._networkContext.rate_limiter
+        if limiter is None:
+            return FairScheduler(max_per_provider)
+
+        def max_per_key(key):
+            capacity = limiter.capacity(key)
+            if capacity is None or max_per_provider is None:
+                return max_per_provider if capacity is None else capacity
+            return min(capacity, max_per_provider)
+        return FairScheduler(max_per_key, limiter.take, limiter.delay)
+
+    @staticmethod
+    def _wait_scheduled(futures, scheduler):
+        """Waits until a future finished or a job delayed by the rate limit may start
+
+        :return: set(Future)
+            finished futures
+        """
+        timeout = scheduler.retry_in()
+        if futures:
+            done, _ = wait(list(futures), timeout=timeout, return_when=FIRST_COMPLETED)
+            return done
+        time.sleep(timeout if timeout is not None else 0.01)
+        return set()
+
+    def _domain_config_from_future(self, domain, domain_root, host, future):
+        error = future.exception()
+        if error is None:
+            return self._domain_config(domain, domain_root, host, future.result())
+        if isinstance(error, DomainConnectException):
+            return error
+        return DomainConnectException('Discovery of "{}" failed: {}'.format(domain, error))
+
+    def _get_domain_settings(self, domain_root, deadline=None):
+        """Discovers Domain Connect API of the domain root and fetches its settings
+
+        :param domain_root: str
+        :param deadline: Deadline
+        :return: dict
+            domain connect config
+        """
+        domain_connect_api = self._identify_domain_connect_api(domain_root, deadline)
+
+        return self._get_domain_config_for_root(domain_root, domain_connect_api, deadline)
+
+    def _get_domain_config_for_root(self, domain_root, domain_connect_api, deadline=None):
         """
 
         :param domain_root: str
             domain name for zone root
         :param domain_connect_api: str
             URL of domain connect API of the vendor
+        :param deadline: Deadline
         :return: dict
             domain connect config
         :raises: NoDomainConnectRecordException
@@ -270,80 +1086,120 @@ class DomainConnect:
         :raises: NoDomainConnectSettingsException
             when settings are not found
         """
-        url = 'https://{}/v2/{}/settings'.format(domain_connect_api, domain_root)
+        url = self._settings_url(domain_root, domain_connect_api)
+        stage = 'fetching settings of {}'.format(domain_root)
         try:
-            response = get_json(self._networkContext, url)
-            logger.debug('Domain Connect config for {} over {}: {}'.format(domain_root, domain_connect_api,
-                                                                           response))
+            with trace(self._networkContext.tracer, 'settings', host=domain_connect_api, domain=domain_root) as span:
+                if self._settings_cache is not None:
+                    response = self._get_settings_cached(url, deadline, stage, span)
+                else:
+                    response = self._do_shared(('settings', url), lambda: self._budget(deadline, stage),
+                                               get_json, self._networkContext, url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Domain Connect config for %s over %s: %s', domain_root, domain_connect_api, response)
             return response
+        except DeadlineExceededException:
+            raise
         except Exception as e:
-            logger.debug("Exception when getting config:{}".format(e))
-        logger.debug('No Domain Connect config found for {}.'.format(domain_root))
-        raise NoDomainConnectSettingsException('No Domain Connect config found for {}.'.format(domain_root))
-
-    # Generates a signature on the passed in data
-    @staticmethod
-    def _generate_sig(private_key, data):
-        pk = serialization.load_pem_private_key(
-            private_key.encode(),
-            password=None,
-            backend=default_backend()
-        )
-
-        sig = pk.sign(
-            data.encode(),
-            padding.PKCS1v15(),
-            hashes.SHA256()
-        )
-
-        return b64encode(sig)
+            logger.debug("Exception when getting config:%s", e)
+            if deadline is not None:
+                deadline.check(stage)
+        raise self._settings_not_found(domain_root)
+
+    def _get_settings_cached(self, url, deadline=None, stage=None, span=None):
+        entry, state = self._settings_cache.lookup(url)
+        if span is not None:
+            span.set(cache_hit=state in (SettingsCache.FRESH, SettingsCache.STALE))
+        if state == SettingsCache.FRESH:
+            return entry.settings
+        if state == SettingsCache.STALE:
+            if self._settings_cache.start_revalidation(url):
+                thread = threading.Thread(target=self._revalidate_settings, args=(url, entry))
+                thread.daemon = True
+                thread.start()
+            return entry.settings
+        return self._do_shared(('settings', url), lambda: self._budget(deadline, stage),
+                               self._fetch_settings, url, entry)
+
+    def _revalidate_settings(self, url, entry):
+        # noinspection PyBroadException
+        try:
+            self._fetch_settings(url, entry)
+        except Exception as e:
+            logger.debug('Revalidation of %s failed: %s', url, e)
+        finally:
+            self._settings_cache.finish_revalidation(url)
 
-    @staticmethod
-    def _generate_sig_params(queryparams, private_key=None, keyid=None):
-        if private_key is None or keyid is None:
-            raise InvalidDomainConnectSettingsException("Private key and/or key ID not provided for signing")
-        signature = DomainConnect._generate_sig(private_key, queryparams)
-        return '&' + urllib.parse.urlencode(
-            {
-                "sig": signature,
-                "key": keyid,
-            }
-        )
+    def _fetch_settings(self, url, entry, timeout=None):
+        if entry is None:
+            data, status, headers = get_json_conditional(self._networkContext, url, timeout=timeout)
+        else:
+            data, status, headers = get_json_conditional(self._networkContext, url, etag=entry.etag,
+                                                         last_modified=entry.last_modified, timeout=timeout)
+        if status == 304:
+            if entry is None:
+                raise Exception('Unexpected 304 response from {}'.format(url))
+            return self._settings_cache.refresh(url, entry, headers).settings
+        self._settings_cache.store(url, data, headers)
+        return data
+
+    def _check_template(self, config, provider_id, service_id, deadline=None):
+        supported = self._cached_template_support(config, provider_id, service_id)
+        if supported is not None:
+            return supported
+        url = self._template_url(config, provider_id, service_id)
+        stage = 'checking template {}'.format(service_id)
+        try:
+            with trace(self._networkContext.tracer, 'template', api=config.urlAPI, service_id=service_id):
+                response = self._do_shared(('template', url), lambda: self._budget(deadline, stage),
+                                           get_http, self._networkContext, url)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Template for serviceId: %s from %s: %s', service_id, provider_id, response)
+        except DeadlineExceededException:
+            raise
+        except Exception as e:
+            if deadline is not None:
+                deadline.check(stage)
+            return self._template_checked(config, provider_id, service_id, e)
+        return self._template_checked(config, provider_id, service_id, None)
 
-    def check_template_supported(self, config, provider_id, service_ids):
-        """
+    def check_template_supported(self, config, provider_id, service_ids, max_workers=8, timeout=None):
+        """Checks templates of all service ids, multiple service ids are checked concurrently
 
         :param config: DomainConnectConfig
             domain connect config
         :param provider_id: str
             provider_id to check
-        :param service_ids: str
+        :param service_ids: str or list(str)
             service_id to check
-        :return: (dict, str)
-            (template supported, error)
+        :param max_workers: int
+            maximum number of concurrent checks
+        :param timeout: float
+            seconds for all checks, operation_timeout of network context if not given
+        :return: None
         :raises: TemplateNotSupportedException
-            when template is not supported
+            when any of templates is not supported, service_ids field lists all not supported ones
+        :raises: DeadlineExceededException
+            when checks did not finish in time
         """
+        self._check_templates_supported(config, provider_id, service_ids, self._deadline(timeout), max_workers)
 
+    def _check_templates_supported(self, config, provider_id, service_ids, deadline, max_workers=8):
         if type(service_ids) != list:
             service_ids = [service_ids]
 
-        for service_id in service_ids:
-            url = '{}/v2/domainTemplates/providers/{}/services/{}' \
-                .format(config.urlAPI, provider_id, service_id)
-
-            try:
-                response = get_http(self._networkContext, url)
-                logger.debug('Template for serviceId: {} from {}: {}'.format(service_id, provider_id,
-                                                                             response))
-            except Exception as e:
-                logger.debug("Exception when getting config:{}".format(e))
-                raise TemplateNotSupportedException(
-                    'No template for serviceId: {} from {}'.format(service_id, provider_id))
-
+        if len(service_ids) == 1:
+            supported = [self._check_template(config, provider_id, service_ids[0], deadline)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(service_ids), max_workers)) as executor:
+                supported = list(executor.map(functools.partial(self._check_template, config, provider_id,
+                                                                deadline=deadline),
+                                              service_ids))
+        self._raise_unsupported_templates(provider_id, service_ids, supported)
 
     def get_domain_connect_template_sync_url(self, domain, provider_id, service_id, redirect_uri=None, params=None,
-                                             state=None, group_ids=None, sign=False, private_key=None, keyid=None):
+                                             state=None, group_ids=None, sign=False, private_key=None, keyid=None,
+                                             signer=None, timeout=None):
         """Makes full Domain Connect discovery of a domain and returns full url to request sync consent.
 
         :param domain: str
@@ -356,6 +1212,9 @@ class DomainConnect:
         :param sign: bool
         :param private_key: str - RSA key in PEM format
         :param keyid: str - host name of the TXT record with public KEY (appended to syncPubKeyDomain)
+        :param signer: DomainConnectSigner - alternative to private_key and keyid, implies sign
+        :param timeout: float - seconds for discovery and template check together,
+            operation_timeout of network context if not given
         :return: (str, str)
             first field is an url which shall be used to redirect the browser to
             second field is an indication of error
@@ -365,39 +1224,86 @@ class DomainConnect:
             when settings are not found
         :raises: InvalidDomainConnectSettingsException
             when settings contain missing fields
+        :raises: DeadlineExceededException
+            when discovery and template check did not finish in time
         """
         # TODO: support for provider_name (for shared templates)
 
         if params is None:
             params = {}
 
-        config = self.get_domain_config(domain)
+        deadline = self._deadline(timeout)
 
-        self.check_template_supported(config, provider_id, service_id)
+        config = self._get_domain_config(domain, deadline)
 
-        if config.urlSyncUX is None:
-            raise InvalidDomainConnectSettingsException("No sync URL in config")
+        self._check_templates_supported(config, provider_id, service_id, deadline)
 
-        sync_url_format = '{}/v2/domainTemplates/providers/{}/services/{}/' \
-                          'apply?{}{}'
+        return self._build_sync_url(config, provider_id, service_id, redirect_uri, params, state, group_ids,
+                                    sign, private_key, keyid, signer)
 
-        params['domain'] = config.domain_root
-        if config.host is not None and config.host != '':
-            params['host'] = config.host
-        if redirect_uri is not None:
-            params["redirect_uri"] = redirect_uri
-        if state is not None:
-            params["state"] = state
-        if group_ids is not None:
-            params["groupId"] = ",".join(group_ids)
+    def get_domain_connect_template_sync_urls(self, items, provider_id, service_id, redirect_uri=None, state=None,
+                                              group_ids=None, sign=False, private_key=None, keyid=None,
+                                              signer=None, max_workers=16):
+        """Makes Domain Connect discovery of many domains and returns urls to request sync consent.
 
-        queryparams = urllib.parse.urlencode(sorted(params.items(), key=lambda val: val[0]))
-        sigparams = DomainConnect._generate_sig_params(queryparams, private_key, keyid) if sign else ''
+        Discovery runs concurrently as in get_domain_configs. Template support is checked once per DNS provider
+        (urlAPI) and the signing key is loaded once; a check failing with a transient error is reported for that
+        domain only and repeated for the next one. Results are yielded in order of completion, the input is
+        consumed lazily.
 
-        return sync_url_format.format(config.urlSyncUX, provider_id, service_id, queryparams, sigparams)
+        :param items: iterable((str, dict))
+            domain name and template params (may be None)
+        :param provider_id: str
+        :param service_id: str or list(str)
+        :param redirect_uri: str
+        :param state: str
+        :param group_ids: list(str)
+        :param sign: bool
+        :param private_key: str - RSA key in PEM format
+        :param keyid: str - host name of the TXT record with public KEY (appended to syncPubKeyDomain)
+        :param signer: DomainConnectSigner - alternative to private_key and keyid, implies sign
+        :param max_workers: int
+            maximum number of concurrent discoveries
+        :return: generator((str, str or DomainConnectException))
+            domain name and its url or the exception raised for it
+        :raises: InvalidDomainConnectSettingsException
+            when signing is requested without private key and key ID
+        """
+        if signer is None and sign:
+            if private_key is None or keyid is None:
+                raise InvalidDomainConnectSettingsException("Private key and/or key ID not provided for signing")
+            signer = DomainConnectSigner(private_key, keyid)
+
+        # template support per provider urlAPI: None if supported, exception otherwise
+        templates = dict()
+        for domain, params, config in self._iter_domain_configs(items, max_workers):
+            if isinstance(config, DomainConnectException):
+                yield domain, config
+                continue
+            if config.urlAPI not in templates:
+                try:
+                    self.check_template_supported(config, provider_id, service_id)
+                    templates[config.urlAPI] = None
+                except TemplateNotSupportedException as e:
+                    if e.transient:
+                        # not remembered, checked again with the next domain of the provider
+                        yield domain, e
+                        continue
+                    templates[config.urlAPI] = e
+                except DeadlineExceededException as e:
+                    yield domain, e
+                    continue
+            if templates[config.urlAPI] is not None:
+                yield domain, templates[config.urlAPI]
+                continue
+            try:
+                yield domain, self._build_sync_url(config, provider_id, service_id, redirect_uri,
+                                                   dict(params or {}), state, group_ids, False, None, None, signer)
+            except DomainConnectException as e:
+                yield domain, e
 
     def get_domain_connect_template_async_context(self, domain, provider_id, service_id, redirect_uri, params=None,
-                                                  state=None, service_id_in_path=False):
+                                                  state=None, service_id_in_path=False, timeout=None):
         """Makes full Domain Connect discovery of a domain and returns full context to request async consent.
 
         :param domain: str
@@ -407,6 +1313,8 @@ class DomainConnect:
         :param params: dict
         :param state: str
         :param service_id_in_path: bool
+        :param timeout: float - seconds for discovery and template check together,
+            operation_timeout of network context if not given
         :return: (DomainConnectAsyncContext, str)
             asyncConsentUrl field of returned context shall be used to redirect the browser to
             second field is an indication of error
@@ -418,41 +1326,22 @@ class DomainConnect:
             when template is not found
         :raises: InvalidDomainConnectSettingsException
             when parts of the settings are missing
+        :raises: DeadlineExceededException
+            when discovery and template check did not finish in time
         :raises: DomainConnectException
             on other domain connect issues
         """
         if params is None:
             params = {}
 
-        config = self.get_domain_config(domain)
+        deadline = self._deadline(timeout)
 
-        self.check_template_supported(config, provider_id, service_id)
+        config = self._get_domain_config(domain, deadline)
 
-        if config.urlAsyncUX is None:
-            raise InvalidDomainConnectSettingsException("No asynch UX URL in config")
+        self._check_templates_supported(config, provider_id, service_id, deadline)
 
-        if service_id_in_path:
-            if type(service_id) is list:
-                raise DomainConnectException("Multiple services are only supported with service_id_in_path=false")
-            async_url_format = '{0}/v2/domainTemplates/providers/{1}/services/{2}' \
-                               '?client_id={1}&scope={2}&domain={3}&host={4}&{5}'
-        else:
-            if type(service_id) is list:
-                service_id = '+'.join(service_id)
-            async_url_format = '{0}/v2/domainTemplates/providers/{1}' \
-                               '?client_id={1}&scope={2}&domain={3}&host={4}&{5}'
-
-        if redirect_uri is not None:
-            params["redirect_uri"] = redirect_uri
-        if state is not None:
-            params["state"] = state
-
-        ret = DomainConnectAsyncContext(config, provider_id, service_id, redirect_uri, params)
-        ret.asyncConsentUrl = async_url_format.format(config.urlAsyncUX, provider_id, service_id,
-                                                      config.domain_root, config.host,
-                                                      urllib.parse.urlencode(
-                                                          sorted(params.items(), key=lambda val: val[0])))
-        return ret
+        return self._build_async_context(config, provider_id, service_id, redirect_uri, params, state,
+                                         service_id_in_path)
 
     def open_domain_connect_template_asynclink(self, domain, provider_id, service_id, redirect_uri, params=None,
                                                state=None, service_id_in_path=False):
@@ -484,79 +1373,49 @@ class DomainConnect:
             domain, provider_id, service_id, redirect_uri, params, state, service_id_in_path)
 
         print('Please open URL: {}'.format(async_context.asyncConsentUrl))
-        if "webbrowser" in sys.modules:
+        try:
+            import webbrowser
+        except ImportError:
+            webbrowser = None
+        if webbrowser is not None:
             try:
                 webbrowser.open_new_tab(async_context.asyncConsentUrl)
             except webbrowser.Error as err:
                 raise Exception("Error opening browser window: {}".format(err))
         return async_context
 
-    def get_async_token(self, context, credentials):
+    def get_async_token(self, context, credentials, refresh_margin=60):
         """Gets access_token in async process
 
         :param context: DomainConnectAsyncContext
         :param credentials: DomainConnectAsyncCredentials
+        :param refresh_margin: int
+            seconds before expiry from which an existing access token gets refreshed, None to refresh it anyway
         :return: DomainConnectAsyncContext
             context enriched with access_token and refresh_token if existing
         :raises: AsyncTokenException
         """
-        params = {'code': context.code, 'grant_type': 'authorization_code'}
-        if getattr(context, 'iat', None) and getattr(context, 'access_token_expires_in', None) and \
-                getattr(context, 'refresh_token', None):
-            now = int(time.time()) + 60
-            if now > context.iat + context.access_token_expires_in:
-                params = {'refresh_token': context.refresh_token, 'grant_type': 'refresh_token',
-                          'client_id': credentials.client_id, 'client_secret': credentials.client_secret
-                }
-            else:
-                logger.debug('Context has a valid access token')
-                return context
-        params['redirect_uri'] = context.return_url
+        url_get_access_token = self._async_token_url(context, credentials, refresh_margin)
+        if url_get_access_token is None:
+            return context
 
-        url_get_access_token = '{}/v2/oauth/access_token?{}'.format(context.config.urlAPI,
-                                                                    urllib.parse.urlencode(
-                                                                        sorted(params.items(), key=lambda val: val[0])))
         try:
-            # this has to be checked to avoid secret leakage by spoofed "settings" end-point
-            if credentials.api_url != context.config.urlAPI:
-                raise AsyncTokenException("URL API for provider does not match registered one with credentials")
+            body = self._async_token_body(context, credentials)
             data, status = http_request_json(self._networkContext,
                                              method='POST',
                                              content_type='application/json',
-                                             body=json.dumps({
-                                                 'client_id': credentials.client_id,
-                                                 'client_secret': credentials.client_secret,
-                                             }),
+                                             body=body,
                                              url=url_get_access_token,
                                              accepted_statuses=[200, 400]
                                              )
-            if status == 400:
-                raise AsyncTokenException(
-                    'Failed to get async token: {} {} {}'.format(
-                            status,
-                            data["error"],
-                            data["error_description"] if "error_description" in data else ""))
+            self._check_async_token_status(data, status)
         except AsyncTokenException:
             raise
         except Exception as ex:
-            logger.debug('Cannot get async token: {}'.format(ex))
+            logger.debug('Cannot get async token: %s', ex)
             raise AsyncTokenException('Cannot get async token: {}'.format(ex))
 
-        if 'access_token' not in data \
-                or 'expires_in' not in data \
-                or 'token_type' not in data \
-                or data['token_type'].lower() != 'bearer':
-            logger.debug('Token not complete: {}'.format(data))
-            raise AsyncTokenException('Token not complete: {}'.format(data))
-
-        context.access_token = data['access_token']
-        context.access_token_expires_in = data['expires_in']
-        context.iat = int(time.time())
-
-        if 'refresh_token' in data:
-            context.refresh_token = data['refresh_token']
-
-        return context
+        return self._update_async_token(context, data)
 
     def apply_domain_connect_template_async(self, context, host=None, service_id=None,
                                             params=None, force=False, group_ids=None):
@@ -574,24 +1433,15 @@ class DomainConnect:
         :raises: ApplyException
             Other errors in apply operation
         """
-        if params is None:
-            params = {}
-        if host is None:
-            host = context.config.host
-        if service_id is None:
-            service_id = context.serviceId
-        if group_ids is not None:
-            params["groupId"] = ",".join(group_ids)
-
-        async_url_format = '{}/v2/domainTemplates/providers/{}/services/{}/' \
-                           'apply?domain={}&host={}&{}'
-
-        if force:
-            params['force'] = 'true'
+        url = self._async_apply_url(context, host, service_id, params, force, group_ids)
+        self._apply_async(context, url)
 
-        url = async_url_format.format(context.config.urlAPI, context.providerId, service_id, context.config.domain_root,
-                                      host, urllib.parse.urlencode(sorted(params.items(), key=lambda val: val[0])))
+    def _apply_async(self, context, url):
+        """
 
+        :return: int
+            HTTP status, 200 or 202
+        """
         try:
             res, status = http_request_json(self._networkContext, 'POST', url, bearer=context.access_token,
                                             accepted_statuses=[200, 202, 409])
@@ -601,5 +1451,78 @@ class DomainConnect:
             raise
         except Exception as e:
             raise ApplyException('Error on apply: {}'.format(e))
+        return status
+
+    def apply_domain_connect_template_async_bulk(self, jobs, force=False, retry_conflicts=False, group_ids=None,
+                                                 max_workers=16, max_per_provider=None):
+        """Applies templates to many domains concurrently
+
+        Jobs are grouped by urlAPI of their context and the groups are served in turns. At most max_per_provider
+        applies run at once against one urlAPI, so pooled connections are reused and a slow provider occupies only
+        its own share of the workers. Results are yielded in order of completion, the input is consumed lazily.
+
+        :param jobs: iterable((DomainConnectAsyncContext, str, str, dict))
+            context with access token, host, service_id and template params; host and service_id of the context
+            are used if None
+        :param force: bool
+        :param retry_conflicts: bool
+            apply again with force=true when the provider reports a conflict
+        :param group_ids: list(str)
+        :param max_workers: int
+            maximum number of concurrent applies
+        :param max_per_provider: int
+            maximum number of concurrent applies per urlAPI, max_connections_per_host of network context if not
+            given
+        :return: generator((tuple, int or DomainConnectException))
+            job and HTTP status of the apply (200 or 202) or the exception raised for it,
+            ConflictOnApplyException on conflict
+        """
+        if max_per_provider is None:
+            pool = self._networkContext.pool
+            max_per_provider = pool.max_per_host if pool is not None else max_workers
+        jobs = iter(jobs)
+        max_queued = max_workers * 16
+        scheduler = self._provider_scheduler(max_per_provider)
+        futures = dict()
+        exhausted = False
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while True:
+                while not exhausted and len(scheduler) < max_queued:
+                    try:
+                        job = next(jobs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    self._register_provider(job[0].config)
+                    scheduler.push(job[0].config.urlAPI, (job, force))
+                while len(futures) < max_workers:
+                    scheduled = scheduler.pop()
+                    if scheduled is None:
+                        break
+                    url_api, (job, forced) = scheduled
+                    futures[executor.submit(self._apply_job, job, forced, group_ids)] = (job, forced, url_api)
+                if not futures and not scheduler:
+                    break
+                for future in self._wait_scheduled(futures, scheduler):
+                    job, forced, url_api = futures.pop(future)
+                    scheduler.done(url_api)
+                    error = future.exception()
+                    if isinstance(error, ConflictOnApplyException) and retry_conflicts and not forced:
+                        scheduler.push(url_api, (job, True), first=True)
+                        continue
+                    if error is None:
+                        yield job, future.result()
+                    elif isinstance(error, DomainConnectException):
+                        yield job, error
+                    else:
+                        yield job, ApplyException('Error on apply: {}'.format(error))
+        finally:
+            executor.shutdown(wait=False)
+
+    def _apply_job(self, job, force, group_ids):
+        context, host, service_id, params = job
+        return self._apply_async(context, self._async_apply_url(context, host, service_id, dict(params or {}),
+                                                                force, group_ids))
 
     # TODO: implement revert
@@ -0,0 +1,199 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import bisect
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Tracer(object):
+    """Receives timed spans of the stages of discovery and requests
+
+    Stages:
+        resolve - lookup of _domainconnect TXT record (host: domain root, cache_hit, negative)
+        settings - fetch of provider settings (host: provider API host, domain: domain root, cache_hit)
+        template - template check (api: provider API URL, service_id, cache_hit, negative)
+        connect - TCP connect (host; tls for asyncio and python < 3.6, where it includes the handshake)
+        tls - TLS handshake (host, resumed)
+        request - sending request and waiting for the status line (host, method, status; asyncio client
+                  reads the body within this span and reports bytes)
+        response - reading the response body (host, status, bytes)
+        json - parsing JSON document (bytes)
+        sign - signing of sync URL
+
+    A span of a failed stage has attribute error with name of the exception class. on_span is called from the
+    thread which ran the stage, implementations must be thread safe.
+    """
+
+    def on_span(self, stage, duration, attributes):
+        """Called when a stage finished
+
+        :param stage: str
+        :param duration: float
+            seconds
+        :param attributes: dict
+        """
+        pass
+
+
+class _Span(object):
+    def __init__(self, tracer, stage, attributes):
+        self._tracer = tracer
+        self._stage = stage
+        self.attributes = attributes
+        self._start = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._start = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        # noinspection PyBroadException
+        try:
+            self._tracer.on_span(self._stage, _clock() - self._start, self.attributes)
+        except Exception:
+            # tracing must never break the traced operation
+            pass
+        return False
+
+
+class _NoSpan(object):
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def trace(tracer, stage, **attributes):
+    """Returns context manager timing a stage
+
+    :param tracer: Tracer
+        or None, then nothing is measured
+    :param stage: str
+    :return: context manager with set(**attributes) to add attributes known only during the stage
+    """
+    if tracer is None:
+        return _NO_SPAN
+    return _Span(tracer, stage, attributes)
+
+
+def trace_event(tracer, stage, **attributes):
+    """Reports stage which took no time, e.g. answered from cache
+
+    :param tracer: Tracer
+        or None
+    :param stage: str
+    """
+    if tracer is not None:
+        # noinspection PyBroadException
+        try:
+            tracer.on_span(stage, 0.0, attributes)
+        except Exception:
+            pass
+
+
+class Histogram(object):
+    """Cumulative histogram of durations with fixed bucket bounds"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        buckets = []
+        total = 0
+        for bound, count in zip(list(self.bounds) + [float('inf')], self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {'count': self.count, 'sum': self.sum, 'buckets': buckets}
+
+
+class HistogramCollector(Tracer):
+    """In-memory histograms and counters of spans, to be scraped by a metrics exporter
+
+    Series are kept per stage and, if by_host is set, per host as well.
+    """
+
+    DEFAULT_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS, by_host=False):
+        """
+
+        :param bounds: tuple(float)
+            upper bounds of histogram buckets in seconds, ascending
+        :param by_host: bool
+            keep series per host, beware of cardinality with many providers
+        """
+        self.bounds = tuple(bounds)
+        self.by_host = by_host
+        self._series = dict()
+        self._lock = threading.Lock()
+
+    def on_span(self, stage, duration, attributes):
+        key = (stage, attributes.get('host', attributes.get('api'))) if self.by_host else (stage, None)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'histogram': Histogram(self.bounds), 'errors': 0, 'cache_hits': 0,
+                                              'bytes': 0, 'statuses': dict()}
+            if attributes.get('cache_hit'):
+                series['cache_hits'] += 1
+            else:
+                series['histogram'].observe(duration)
+            if 'error' in attributes:
+                series['errors'] += 1
+            series['bytes'] += attributes.get('bytes', 0)
+            status = attributes.get('status')
+            if status is not None:
+                series['statuses'][status] = series['statuses'].get(status, 0) + 1
+
+    def snapshot(self):
+        """Returns copy of all series
+
+        :return: list(dict)
+            one dict per series with stage, host (if by_host), count, sum, cumulative buckets as list of
+            (upper bound, count), errors, cache_hits, bytes and count per HTTP status; cache hits are not
+            part of the histogram
+        """
+        with self._lock:
+            ret = []
+            for (stage, host), series in sorted(self._series.items(), key=lambda item: (item[0][0],
+                                                                                          item[0][1] or '')):
+                entry = {'stage': stage, 'errors': series['errors'], 'cache_hits': series['cache_hits'],
+                         'bytes': series['bytes'], 'statuses': dict(series['statuses'])}
+                if self.by_host:
+                    entry['host'] = host
+                entry.update(series['histogram'].to_dict())
+                ret.append(entry)
+            return ret
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
@@ -11,11 +11,19 @@ import logging
 import base64
 import json
 import re
+import select
+import socket
 import ssl
+import threading
+import time
 
 from six.moves import http_client as client
 
-logging.basicConfig(format='%(asctime)s %(levelname)s [%(name)s] %(message)s', level=logging.WARN)
+from .cache import LRUCache
+from .metrics import trace
+from .ratelimit import RateLimitExceededException
+from .retry import parse_retry_after
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,27 +31,696 @@ class NetworkContext:
     proxyHost = None
     proxyPort = None
     nameservers = None
+    pool = None
+    tls_sessions = None
+    connect_timeout = None
+    read_timeout = None
+    dns_timeout = None
+    dns_query_timeout = None
+    dns_tcp = False
+    dns_edns = None
+    dns_payload = None
+    operation_timeout = None
+    retry_policy = None
+    circuit_breaker = None
+    dns_backend = None
+    tracer = None
+    max_body_size = None
+    rate_limiter = None
+
+    def __init__(self, proxy_host=None, proxy_port=None, nameservers=None, keep_alive=True,
+                 max_connections_per_host=10, idle_timeout=30, verify_ssl=True, ca_file=None, ca_path=None,
+                 min_tls_version=None, client_cert=None, client_key=None, ssl_context=None, connect_timeout=None,
+                 read_timeout=None, dns_timeout=None, operation_timeout=None, retry_policy=None,
+                 circuit_breaker=None, dns_query_timeout=None, dns_tcp=False, dns_edns=None, dns_payload=None,
+                 dns_backend=None, tracer=None, max_body_size=1024 * 1024, rate_limiter=None,
+                 max_idle_connections=256):
+        """
 
-    def __init__(self, proxy_host=None, proxy_port=None, nameservers=None):
+        :param proxy_host: str
+        :param proxy_port: int
+        :param nameservers: str
+            comma separated list of DNS resolvers
+        :param keep_alive: bool
+            keep HTTP connections open and reuse them for subsequent requests to the same host
+        :param max_connections_per_host: int
+            maximum number of open connections per host when keep_alive is used
+        :param idle_timeout: int
+            seconds after which an unused connection is closed
+        :param verify_ssl: bool
+            verify certificates and host names of HTTPS servers
+        :param ca_file: str
+            file with trusted CA certificates in PEM format, system defaults if not given
+        :param ca_path: str
+            directory with trusted CA certificates
+        :param min_tls_version: ssl.TLSVersion
+            minimum TLS version accepted (python 3.7+)
+        :param client_cert: str
+            file with client certificate in PEM format (may contain the private key as well)
+        :param client_key: str
+            file with private key of client certificate
+        :param ssl_context: ssl.SSLContext
+            SSL context to use instead of building one from the parameters above
+        :param connect_timeout: float
+            seconds to establish a connection (including TLS handshake), no limit if not given
+        :param read_timeout: float
+            seconds to wait for data from an established connection, no limit if not given
+        :param dns_timeout: float
+            seconds for a DNS lookup, resolver default if not given
+        :param operation_timeout: float
+            default deadline in seconds of operations consisting of several lookups and requests,
+            like get_domain_connect_template_sync_url
+        :param retry_policy: RetryPolicy
+            retries of idempotent requests failing with transient errors, no retries if not given
+        :param circuit_breaker: CircuitBreaker
+            fails requests fast while a host keeps failing
+        :param dns_query_timeout: float
+            seconds to wait for an answer of one nameserver, resolver default if not given
+        :param dns_tcp: bool
+            send DNS queries over TCP instead of UDP
+        :param dns_edns: int or bool
+            EDNS version, False disables EDNS, resolver default if not given
+        :param dns_payload: int
+            maximum UDP payload size advertised with EDNS
+        :param dns_backend: DnsBackend
+            used for _domainconnect lookups instead of dnspython resolver configured with the options above,
+            e.g. DoHBackend or StaticBackend
+        :param tracer: Tracer
+            receives timed spans of DNS lookups, connects, TLS handshakes, requests, JSON parsing and signing,
+            e.g. HistogramCollector
+        :param max_body_size: int
+            maximum size of response body in bytes, larger responses are rejected with ResponseTooLargeException;
+            None for no limit
+        :param rate_limiter: RateLimiter
+            per host or per provider rate limits and concurrency caps of requests
+        :param max_idle_connections: int
+            maximum number of unused connections kept open to all hosts together when keep_alive is used
+        """
         self.proxyPort = proxy_port
         self.proxyHost = proxy_host
         self.nameservers = nameservers
+        if keep_alive:
+            self.pool = ConnectionPool(max_per_host=max_connections_per_host, idle_timeout=idle_timeout,
+                                       max_idle=max_idle_connections)
+        self.verify_ssl = verify_ssl
+        self.ca_file = ca_file
+        self.ca_path = ca_path
+        self.min_tls_version = min_tls_version
+        self.client_cert = client_cert
+        self.client_key = client_key
+        self._ssl_context = ssl_context
+        self._ssl_context_lock = threading.Lock()
+        self.tls_sessions = LRUCache(max_size=256)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.dns_timeout = dns_timeout
+        self.operation_timeout = operation_timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.dns_query_timeout = dns_query_timeout
+        self.dns_tcp = dns_tcp
+        self.dns_edns = dns_edns
+        self.dns_payload = dns_payload
+        self.dns_backend = dns_backend
+        self.tracer = tracer
+        self.max_body_size = max_body_size
+        self.rate_limiter = rate_limiter
+
+    def stats(self):
+        """Returns counters of connection pool, retries, rate limits and state of circuit breakers
+
+        :return: dict
+        """
+        return {
+            'pool': self.pool.stats() if self.pool is not None else None,
+            'retry': self.retry_policy.stats() if self.retry_policy is not None else None,
+            'circuit_breaker': self.circuit_breaker.stats() if self.circuit_breaker is not None else None,
+            'rate_limiter': self.rate_limiter.stats() if self.rate_limiter is not None else None,
+        }
+
+    def timeouts(self, timeout=None):
+        """Returns connect and read timeouts of a request
+
+        :param timeout: float
+            remaining budget of the operation the request is part of
+        :return: (float, float)
+            connect and read timeout, None for no limit
+        """
+        return _min_timeout(self.connect_timeout, timeout), _min_timeout(self.read_timeout, timeout)
+
+    def get_ssl_context(self):
+        """Returns SSL context shared by all HTTPS connections of this network context
+
+        The context is built on first use.
+
+        :return: ssl.SSLContext
+        """
+        if self._ssl_context is None:
+            with self._ssl_context_lock:
+                if self._ssl_context is None:
+                    self._ssl_context = self._create_ssl_context()
+        return self._ssl_context
+
+    def _create_ssl_context(self):
+        if self.verify_ssl:
+            ssl_context = ssl.create_default_context(cafile=self.ca_file, capath=self.ca_path)
+        else:
+            # noinspection PyProtectedMember
+            ssl_context = ssl._create_unverified_context()
+        if self.min_tls_version is not None:
+            ssl_context.minimum_version = self.min_tls_version
+        if self.client_cert is not None:
+            ssl_context.load_cert_chain(self.client_cert, self.client_key)
+        return ssl_context
+
+    def close(self):
+        """Closes all kept alive connections"""
+        if self.pool is not None:
+            self.pool.close()
+
+
+def _min_timeout(timeout, budget):
+    if timeout is None:
+        return budget
+    if budget is None:
+        return timeout
+    return min(timeout, budget)
+
+
+class HttpStatusException(Exception):
+    """Response with status not accepted by the caller"""
+
+    def __init__(self, url, status, headers=None):
+        Exception.__init__(self, 'Failed to read from {}. HTTP code: {}'.format(url, status))
+        self.url = url
+        self.status = status
+        self.headers = headers if headers is not None else dict()
+
+
+class ResponseTooLargeException(Exception):
+    """Response body exceeds max_body_size of the network context"""
+
+    def __init__(self, host, max_size, length=None):
+        Exception.__init__(self, 'Response from {} exceeds {} bytes{}'.format(
+            host, max_size, '' if length is None else ' ({} announced)'.format(length)))
+        self.host = host
+        self.max_size = max_size
+        self.length = length
+
+
+class _BudgetExhausted(socket.timeout):
+    """Time left for a request used up before it was sent, e.g. waiting for the rate limit or a free connection"""
+
+
+def _check_budget(budget):
+    # a socket timeout of zero makes the socket non-blocking, a negative one is an error
+    if budget is not None and budget <= 0:
+        raise _BudgetExhausted('timed out')
+
+
+class ConnectionPool:
+    """Thread safe pool of kept alive HTTP(S) connections
+
+    Connections are keyed by (scheme, host, proxy host, proxy port) and used by one request at a time.
+    Idle connections of all keys are closed after idle_timeout, checked on every acquire and release, and the
+    oldest ones beyond max_idle.
+    """
+
+    # seconds between checks of idle connections of all keys
+    _SWEEP_INTERVAL = 1.0
+
+    def __init__(self, max_per_host=10, idle_timeout=30, acquire_timeout=60, max_idle=256, clock=time.time):
+        """
+
+        :param max_per_host: int
+            maximum number of open connections (idle and in use) per key
+        :param idle_timeout: int
+            seconds after which an idle connection is closed
+        :param acquire_timeout: int
+            seconds to wait for a free connection when max_per_host is reached
+        :param max_idle: int
+            maximum number of idle connections of all keys together
+        :param clock: callable
+            source of current time, for tests
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_idle = max_idle
+        self._clock = clock
+        self._idle = dict()
+        self._idle_count = 0
+        self._next_sweep = 0
+        self._open = dict()
+        self._condition = threading.Condition()
+        self.created = 0
+        self.reused = 0
+
+    def acquire(self, key, factory, timeout=None):
+        """Takes an idle connection for the key or opens a new one
+
+        :param key: tuple
+        :param factory: callable
+            creates a new connection
+        :param timeout: float
+            remaining budget of the request, limits the wait for a free connection
+        :return: (HTTPConnection, bool)
+            connection and indication whether it was reused
+        :raises: socket.timeout
+            when the budget is used up waiting for a free connection
+        """
+        wait = self.acquire_timeout if timeout is None else min(self.acquire_timeout, timeout)
+        deadline = self._clock() + wait
+        with self._condition:
+            while True:
+                self._evict_idle(key)
+                idle = self._idle.get(key)
+                if idle:
+                    connection, _ = idle.pop()
+                    self._idle_count -= 1
+                    if not idle:
+                        del self._idle[key]
+                    self.reused += 1
+                    return connection, True
+                if self._open.get(key, 0) < self.max_per_host:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    break
+                remaining = deadline - self._clock()
+                if remaining <= 0:
+                    if wait < self.acquire_timeout:
+                        raise _BudgetExhausted('No free connection to {} available in time'.format(key[1]))
+                    raise Exception('No free connection to {} available'.format(key[1]))
+                self._condition.wait(remaining)
+        try:
+            connection = factory()
+        except Exception:
+            self._forget(key)
+            raise
+        with self._condition:
+            self.created += 1
+        return connection, False
+
+    def release(self, key, connection):
+        """Returns a connection with fully read response to the pool"""
+        with self._condition:
+            self._idle.setdefault(key, []).append((connection, self._clock()))
+            self._idle_count += 1
+            self._evict_idle(key)
+            self._condition.notify()
+
+    def discard(self, key, connection):
+        """Closes a connection which cannot be reused"""
+        connection.close()
+        self._forget(key)
+
+    def close(self):
+        """Closes all idle connections"""
+        with self._condition:
+            for key, idle in list(self._idle.items()):
+                for connection, _ in idle:
+                    connection.close()
+                self._closed(key, len(idle))
+            self._idle.clear()
+            self._idle_count = 0
+            self._condition.notify_all()
+
+    def stats(self):
+        """Returns counters of the pool
+
+        :return: dict
+        """
+        with self._condition:
+            return {
+                'open': sum(self._open.values()),
+                'idle': self._idle_count,
+                'created': self.created,
+                'reused': self.reused,
+            }
+
+    def _forget(self, key):
+        with self._condition:
+            self._closed(key, 1)
+            self._condition.notify()
+
+    def _closed(self, key, count):
+        # called with the condition held, keys of hosts not used any more are dropped
+        self._open[key] -= count
+        if self._open[key] <= 0:
+            del self._open[key]
+
+    def _evict_idle(self, key):
+        """Closes expired idle connections of the key, of all keys once per _SWEEP_INTERVAL and beyond max_idle"""
+        now = self._clock()
+        threshold = now - self.idle_timeout
+        if now >= self._next_sweep:
+            self._next_sweep = now + self._SWEEP_INTERVAL
+            keys = list(self._idle)
+        else:
+            keys = [key] if key in self._idle else []
+        for k in keys:
+            idle = self._idle[k]
+            while idle and idle[0][1] < threshold:
+                self._close_idle(k, idle)
+        while self.max_idle is not None and self._idle_count > self.max_idle:
+            oldest = min(self._idle, key=lambda k: self._idle[k][0][1])
+            self._close_idle(oldest, self._idle[oldest])
+
+    def _close_idle(self, key, idle):
+        connection, _ = idle.pop(0)
+        connection.close()
+        self._idle_count -= 1
+        if not idle:
+            del self._idle[key]
+        self._closed(key, 1)
+
+
+def split_url(url):
+    """Splits URL into protocol, host (with port if given) and path
+
+    :param url: str
+    :return: (str, str, str)
+    """
+    url_parts = re.match('(?i)(https?)://([^:/]+(?::\d+)?)(/.*)', url)
+    if url_parts is None:
+        raise Exception('Given issuer is not a valid URL')
+    return url_parts.group(1).lower(), url_parts.group(2), url_parts.group(3)
+
+
+# errors which indicate that server closed a kept alive connection, possibly after processing the request
+_STALE_CONNECTION_ERRORS = (client.BadStatusLine, client.CannotSendRequest, socket.error)
+
+# requests resent automatically on a fresh connection when a kept alive one fails; the others may have been
+# processed already (e.g. apply or redeeming a single use code)
+_IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+def _closed_by_peer(connection):
+    """Checks if idle kept alive connection was closed by server, an idle socket is readable only then"""
+    if connection.sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (ValueError, select.error):
+        return True
+    return bool(readable)
+
+
+class _HTTPSConnection(client.HTTPSConnection):
+    """HTTPS connection resuming TLS session of an earlier connection to the same host"""
+
+    def __init__(self, host, port=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, context=None, sessions=None,
+                 session_key=None, tracer=None):
+        client.HTTPSConnection.__init__(self, host, port, timeout=timeout, context=context)
+        self._sessions = sessions
+        self._session_key = session_key
+        self._tracer = tracer
+
+    def connect(self):
+        with trace(self._tracer, 'connect', host=self._session_key):
+            client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host if self._tunnel_host else self.host
+        with trace(self._tracer, 'tls', host=self._session_key) as span:
+            self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname,
+                                                  session=self._sessions.get(self._session_key))
+            span.set(resumed=self.sock.session_reused)
+
+    def remember_session(self):
+        """Keeps TLS session for next connections, to be called after a response was read
+
+        Session tickets of TLS 1.3 are sent by the server after the handshake, so they are only
+        available once some data was received.
+        """
+        if self.sock is not None and self.sock.session is not None:
+            self._sessions.put(self._session_key, self.sock.session)
+
+
+# TLS session resumption needs python 3.6+
+_TLS_SESSIONS = hasattr(ssl.SSLSocket, 'session')
+
+
+def _create_connection(context, protocol, host, timeout=None):
+    # noinspection PyProtectedMember
+    timeout = socket._GLOBAL_DEFAULT_TIMEOUT if timeout is None else timeout
+    if protocol == 'http':
+        if context.proxyHost is not None and context.proxyPort is not None:
+            logger.debug('using proxy %s:%s', context.proxyHost, context.proxyPort)
+            connection = client.HTTPConnection(context.proxyHost, context.proxyPort, timeout=timeout)
+            connection.set_tunnel(host)
+        else:
+            connection = client.HTTPConnection(host, timeout=timeout)
+    else:
+        ssl_context = context.get_ssl_context()
+        proxy = context.proxyHost is not None and context.proxyPort is not None
+        if proxy:
+            logger.debug('using proxy %s:%s', context.proxyHost, context.proxyPort)
+        address = (context.proxyHost, context.proxyPort) if proxy else (host, None)
+        if _TLS_SESSIONS:
+            connection = _HTTPSConnection(address[0], address[1], timeout=timeout, context=ssl_context,
+                                          sessions=context.tls_sessions, session_key=host.lower(),
+                                          tracer=context.tracer)
+        else:
+            connection = client.HTTPSConnection(address[0], address[1], timeout=timeout, context=ssl_context)
+        if proxy:
+            connection.set_tunnel(host)
+    return connection
+
+
+def _remember_session(connection):
+    if isinstance(connection, _HTTPSConnection):
+        connection.remember_session()
+
+
+def _connect(connection, read_timeout, tracer=None, host=None):
+    """Opens connection if not open yet, the connection was created with connect timeout"""
+    if connection.sock is None:
+        if isinstance(connection, _HTTPSConnection):
+            # traces TCP connect and TLS handshake separately
+            connection.connect()
+        else:
+            with trace(tracer, 'connect', host=host, tls=isinstance(connection, client.HTTPSConnection)):
+                connection.connect()
+    connection.sock.settimeout(read_timeout)
+
+
+def _exchange(connection, tracer, host, method, path, body, header, max_body_size=None, read_timeout=None,
+              deadline=None):
+    """Sends request over open connection and reads the response
+
+    :param read_timeout: float
+        timeout of single socket reads
+    :param deadline: float
+        time by which the whole response must be read, checked between socket reads, not limited if None
+    :return: (HTTPResponse, bytes)
+    """
+    check = None
+    if deadline is not None:
+        sock = connection.sock
+
+        def check():
+            # a server sending slowly would otherwise hold the call far beyond the deadline
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise socket.timeout('timed out')
+            sock.settimeout(_min_timeout(read_timeout, remaining))
+        check()
+    with trace(tracer, 'request', host=host, method=method) as span:
+        connection.request(method, path, body, header)
+        if check is not None:
+            check()
+        response = connection.getresponse()
+        span.set(status=response.status)
+    with trace(tracer, 'response', host=host, status=response.status) as span:
+        ret = _read_body(response, host, max_body_size, check)
+        span.set(bytes=len(ret))
+    return response, ret
+
+
+# size of reads from response stream
+_CHUNK_SIZE = 64 * 1024
+
+
+def _read_body(response, host, max_size, before_read=None):
+    """Reads response body in chunks, failing as soon as it grows over max_size
+
+    :param before_read: callable
+        called before each read, e.g. to check a deadline
+    :raises: ResponseTooLargeException
+    """
+    if max_size is None and before_read is None:
+        return response.read()
+    length = response.getheader('Content-Length')
+    if max_size is not None and length is not None and length.strip().isdigit() and int(length) > max_size:
+        raise ResponseTooLargeException(host, max_size, int(length))
+    # read1 does a single read of the socket, read may do many of them
+    single_reads = before_read is not None and hasattr(response, 'read1')
+    read = response.read1 if single_reads else response.read
+    chunks = []
+    size = 0
+    while True:
+        if before_read is not None:
+            before_read()
+        chunk = read(_CHUNK_SIZE if max_size is None else min(_CHUNK_SIZE, max_size + 1 - size))
+        if not chunk:
+            if single_reads:
+                # unlike read, read1 does not close the response at its end, the connection is not reusable then
+                response.close()
+            return b''.join(chunks)
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ResponseTooLargeException(host, max_size)
+        chunks.append(chunk)
+
+
+def _parse_json(context, data):
+    """Parses JSON document, bytes are decoded by the parser without intermediate copy"""
+    with trace(context.tracer, 'json', bytes=len(data)):
+        return json.loads(data)
+
+
+def _send(context, protocol, host, method, path, body, header, timeout=None):
+    """Sends request over pooled or fresh connection and reads the response
+
+    :param timeout: float
+        remaining budget of the operation, limits connect and read timeouts of the context
+    :return: (bytes, int, dict)
+        response body, status and response headers with lower case names
+    """
+    _check_budget(timeout)
+    deadline = None if timeout is None else time.time() + timeout
+    connect_timeout, read_timeout = context.timeouts(timeout)
+    pool = context.pool
+    if pool is None:
+        connection = _create_connection(context, protocol, host, connect_timeout)
+        try:
+            _connect(connection, read_timeout, context.tracer, host)
+            response, ret = _exchange(connection, context.tracer, host, method, path, body, header,
+                                      context.max_body_size, read_timeout, deadline)
+            _remember_session(connection)
+            return ret, response.status, dict((k.lower(), v) for k, v in response.getheaders())
+        finally:
+            connection.close()
+
+    key = (protocol, host.lower(), context.proxyHost, context.proxyPort)
+    idempotent = method.upper() in _IDEMPOTENT_METHODS
+    while True:
+        connection, reused = pool.acquire(key, lambda: _create_connection(context, protocol, host, connect_timeout),
+                                          None if deadline is None else deadline - time.time())
+        if reused and not idempotent and _closed_by_peer(connection):
+            # not resent if it fails later, so do not send it over a connection known to be closed
+            pool.discard(key, connection)
+            continue
+        try:
+            _connect(connection, read_timeout, context.tracer, host)
+            response, ret = _exchange(connection, context.tracer, host, method, path, body, header,
+                                      context.max_body_size, read_timeout, deadline)
+            if not reused:
+                _remember_session(connection)
+        except socket.timeout:
+            pool.discard(key, connection)
+            raise
+        except _STALE_CONNECTION_ERRORS as e:
+            pool.discard(key, connection)
+            if reused and (idempotent or isinstance(e, client.CannotSendRequest)):
+                logger.debug('Kept alive connection to %s closed by server, reconnecting: %s', host, e)
+                continue
+            raise
+        except Exception:
+            pool.discard(key, connection)
+            raise
+        if response.will_close:
+            pool.discard(key, connection)
+        else:
+            pool.release(key, connection)
+        return ret, response.status, dict((k.lower(), v) for k, v in response.getheaders())
+
+
+def _is_failure(status):
+    """Responses counted as failure of the host by circuit breaker"""
+    return status >= 500 or status == 429
 
 
-def http_request_json(*args, **kwargs):
+def _send_with_retries(context, protocol, host, method, path, body, header, accepted_statuses, timeout=None):
+    """Sends request honoring retry policy and circuit breaker of the context
+
+    :return: (bytes, int, dict)
+        response body, status and response headers with lower case names
+    """
+    breaker = context.circuit_breaker
+    policy = context.retry_policy
+    limiter = context.rate_limiter
+    start = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        budget = None if timeout is None else timeout - (time.time() - start)
+        _check_budget(budget)
+        if breaker is not None:
+            breaker.before_request(host)
+        try:
+            if limiter is None:
+                ret, status, response_headers = _send(context, protocol, host, method, path, body, header, budget)
+            else:
+                ret, status, response_headers = _send_limited(context, limiter, protocol, host, method, path, body,
+                                                              header, budget, start, timeout)
+        except (RateLimitExceededException, _BudgetExhausted):
+            # given up before sending, not a failure of the host
+            raise
+        except Exception as e:
+            if breaker is not None:
+                breaker.record_failure(host)
+            delay = policy.next_delay(method, attempt, error=e, budget=budget) if policy is not None else None
+            if delay is None:
+                raise
+            logger.debug('%s %s%s failed, retry in %.2fs: %s', method, host, path, delay, e)
+            policy.sleep(delay)
+            continue
+        if breaker is not None:
+            if _is_failure(status):
+                breaker.record_failure(host)
+            else:
+                breaker.record_success(host)
+        if status not in accepted_statuses and policy is not None:
+            delay = policy.next_delay(method, attempt, status=status, headers=response_headers, budget=budget)
+            if delay is not None:
+                logger.debug('%s %s%s returned %s, retry in %.2fs', method, host, path, status, delay)
+                policy.sleep(delay)
+                continue
+        return ret, status, response_headers
+
+
+def _send_limited(context, limiter, protocol, host, method, path, body, header, budget, start, timeout):
+    key = limiter.acquire(host, budget)
+    try:
+        # time spent waiting for the rate limit counts against the budget
+        budget = None if timeout is None else timeout - (time.time() - start)
+        _check_budget(budget)
+        ret, status, response_headers = _send(context, protocol, host, method, path, body, header, budget)
+    finally:
+        limiter.release(key)
+    if status in (429, 503):
+        limiter.throttled(host, parse_retry_after(response_headers.get('retry-after')))
+    return ret, status, response_headers
+
+
+def http_request_json(context, method, url, body=None, basic_auth=None, bearer=None, content_type=None,
+                      accepts=None, cache_control=None, accepted_statuses=None, timeout=None):
     """
 
     See: http_request
+    :return: (object, int)
+        parsed JSON document and status
     """
-    ret, status = http_request(*args, **kwargs)
+    ret, status, _ = _request(context, method, url, body=body, basic_auth=basic_auth, bearer=bearer,
+                              content_type=content_type, accepts=accepts, cache_control=cache_control,
+                              accepted_statuses=accepted_statuses, timeout=timeout)
     try:
-        return json.loads(ret), status
+        return _parse_json(context, ret), status
     except ValueError as e:
-        raise ValueError("Invalid JSON returned ({}): {}".format(status, ret))
+        raise ValueError("Invalid JSON returned ({}): {}".format(status, ret.decode('utf-8', 'replace')))
 
 
 def http_request(context, method, url, body=None, basic_auth=None, bearer=None, content_type=None,
-                 accepts=None, cache_control=None, accepted_statuses=None):
+                 accepts=None, cache_control=None, accepted_statuses=None, timeout=None):
     """
 
     :param context: NetworkContext
@@ -57,59 +734,78 @@ def http_request(context, method, url, body=None, basic_auth=None, bearer=None,
     :param cache_control: str
     :param accepted_statuses: list(str)
         list statuses which do not rise exception
+    :param timeout: float
+        remaining budget of the operation, limits connect and read timeouts of the context
     :return:
     """
+    ret, status, _ = http_request_with_headers(context, method, url, body=body, basic_auth=basic_auth,
+                                               bearer=bearer, content_type=content_type, accepts=accepts,
+                                               cache_control=cache_control, accepted_statuses=accepted_statuses,
+                                               timeout=timeout)
+    return ret, status
+
+
+def http_request_with_headers(context, method, url, body=None, basic_auth=None, bearer=None, content_type=None,
+                              accepts=None, cache_control=None, accepted_statuses=None, headers=None,
+                              timeout=None):
+    """Same as http_request, but also returns response headers
+
+    :param context: NetworkContext
+    :param method: str
+    :param url: str
+    :param body: str
+    :param basic_auth: str
+    :param bearer: str
+    :param content_type: str
+    :param accepts: str
+    :param cache_control: str
+    :param accepted_statuses: list(str)
+        list statuses which do not rise exception
+    :param headers: dict
+        additional request headers
+    :param timeout: float
+        remaining budget of the operation, limits connect and read timeouts of the context
+    :return: (str, int, dict)
+        response body, status and response headers with lower case names
+    """
+    ret, status, response_headers = _request(context, method, url, body, basic_auth, bearer, content_type,
+                                             accepts, cache_control, accepted_statuses, headers, timeout)
+    return ret.decode('utf-8'), status, response_headers
+
+
+def _request(context, method, url, body=None, basic_auth=None, bearer=None, content_type=None, accepts=None,
+             cache_control=None, accepted_statuses=None, headers=None, timeout=None):
+    """See: http_request_with_headers
+
+    :return: (bytes, int, dict)
+        undecoded response body, status and response headers with lower case names
+    """
     if accepted_statuses is None:
         accepted_statuses = [200]
 
-    connection = None
-    url_parts = re.match('(?i)(https?)://([^:/]+(?::\d+)?)(/.*)', url)
-    if url_parts is None:
-        raise Exception('Given issuer is not a valid URL')
-    protocol = url_parts.group(1).lower()
-    host = url_parts.group(2)
-    path = url_parts.group(3)
-    logger.debug('method = {} protocol = {}, host = {}, path = {}'.format(method, protocol, host, path))
-    try:
-        if protocol == 'http':
-            if context.proxyHost is not None and context.proxyPort is not None:
-                logger.debug('using proxy {}:{}'.format(context.proxyHost, context.proxyPort))
-                connection = client.HTTPConnection(context.proxyHost, context.proxyPort)
-                connection.set_tunnel(host)
-            else:
-                connection = client.HTTPConnection(host)
-        else:
-            # noinspection PyProtectedMember
-            ssl_context = ssl._create_unverified_context()
-            if context.proxyHost is not None and context.proxyPort is not None:
-                logger.debug('using proxy {}:{}'.format(context.proxyHost, context.proxyPort))
-                connection = client.HTTPSConnection(context.proxyHost, context.proxyPort, context=ssl_context)
-                connection.set_tunnel(host)
-            else:
-                connection = client.HTTPSConnection(host, context=ssl_context)
-        header = dict()
-        if basic_auth is not None:
-            user, password = basic_auth
-            head = ':'.join([user, password]).encode()
-            header['Authorization'] = ' '.join(['Basic', base64.b64encode(head).decode()])
-        if bearer is not None:
-            header['Authorization'] = ' '.join(['Bearer', bearer])
-        if content_type is not None:
-            header['Content-Type'] = content_type
-        if accepts is not None:
-            header['Accept'] = accepts
-        if cache_control is not None:
-            header['Cache-Control'] = cache_control
-        connection.request(method, path, body, header)
-        response = connection.getresponse()
-        if response.status not in accepted_statuses:
-            logger.debug('Failed to query {}: {}'.format(url, response.status))
-            raise Exception('Failed to read from {}. HTTP code: {}'.format(url, response.status))
-        ret = response.read().decode('utf-8')
-        return ret, response.status
-    finally:
-        if connection is not None:
-            connection.close()
+    protocol, host, path = split_url(url)
+    logger.debug('method = %s protocol = %s, host = %s, path = %s', method, protocol, host, path)
+    header = dict()
+    if headers is not None:
+        header.update(headers)
+    if basic_auth is not None:
+        user, password = basic_auth
+        head = ':'.join([user, password]).encode()
+        header['Authorization'] = ' '.join(['Basic', base64.b64encode(head).decode()])
+    if bearer is not None:
+        header['Authorization'] = ' '.join(['Bearer', bearer])
+    if content_type is not None:
+        header['Content-Type'] = content_type
+    if accepts is not None:
+        header['Accept'] = accepts
+    if cache_control is not None:
+        header['Cache-Control'] = cache_control
+    ret, status, response_headers = _send_with_retries(context, protocol, host, method, path, body, header,
+                                                       accepted_statuses, timeout)
+    if status not in accepted_statuses:
+        logger.debug('Failed to query %s: %s', url, status)
+        raise HttpStatusException(url, status, response_headers)
+    return ret, status, response_headers
 
 
 def post_data(context, url, data, basic_auth=None, bearer=None):
@@ -149,57 +845,52 @@ def post_json(context, url, content, basic_auth=None, bearer=None):
     return response.read().decode('utf-8')
 
 
-def get_json(context, url):
+def get_json(context, url, timeout=None):
     """
 
     :param context: NetworkContext
     :param url: str
+    :param timeout: float
     :return:
     """
-    return json.loads(get_http(context, url))
+    ret, _, _ = _request(context, 'GET', url, timeout=timeout)
+    return _parse_json(context, ret)
+
+
+def get_json_conditional(context, url, etag=None, last_modified=None, timeout=None):
+    """Conditional GET of JSON document
+
+    :param context: NetworkContext
+    :param url: str
+    :param etag: str
+        entity tag of cached document, sent as If-None-Match
+    :param last_modified: str
+        Last-Modified of cached document, sent as If-Modified-Since
+    :param timeout: float
+    :return: (dict, int, dict)
+        parsed document (None when not modified), status and response headers with lower case names
+    """
+    headers = dict()
+    if etag is not None:
+        headers['If-None-Match'] = etag
+    if last_modified is not None:
+        headers['If-Modified-Since'] = last_modified
+    ret, status, response_headers = _request(context, 'GET', url, headers=headers, accepted_statuses=[200, 304],
+                                             timeout=timeout)
+    if status == 304:
+        return None, status, response_headers
+    return _parse_json(context, ret), status, response_headers
 
 
-def get_http(context, url):
+def get_http(context, url, timeout=None):
     """
 
     :param context: NetworkContext
     :param url: str
+    :param timeout: float
     :return:
     """
-    connection = None
-    url_parts = re.match('(?i)(https?)://([^:/]+(?::\d+)?)(/.*)', url)
-    if url_parts is None:
-        raise Exception('Given issuer is not a valid URL')
-    protocol = url_parts.group(1).lower()
-    host = url_parts.group(2)
-    path = url_parts.group(3)
-    logger.debug('protocol = {}, host = {}, path = {}'.format(protocol, host, path))
-    try:
-        if protocol == 'http':
-            if context.proxyHost is not None and context.proxyPort is not None:
-                logger.debug('using proxy {}:{}'.format(context.proxyHost, context.proxyPort))
-                connection = client.HTTPConnection(context.proxyHost, context.proxyPort)
-                connection.set_tunnel(host)
-            else:
-                connection = client.HTTPConnection(host)
-        else:
-            # noinspection PyProtectedMember
-            ssl_context = ssl._create_unverified_context()
-            if context.proxyHost is not None and context.proxyPort is not None:
-                logger.debug('using proxy {}:{}'.format(context.proxyHost, context.proxyPort))
-                connection = client.HTTPSConnection(context.proxyHost, context.proxyPort, context=ssl_context)
-                connection.set_tunnel(host)
-            else:
-                connection = client.HTTPSConnection(host, context=ssl_context)
-        connection.request('GET', path)
-        response = connection.getresponse()
-        if response.status != 200:
-            logger.debug('Failed to query {}: {}'.format(url, response.status))
-            raise Exception('Failed to read from {}'.format(url))
-        ret = response.read().decode('utf-8')
-    finally:
-        if connection is not None:
-            connection.close()
+    ret, _ = http_request(context, 'GET', url, timeout=timeout)
     return ret
 
 
@@ -0,0 +1,202 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from six import string_types
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+'''
+
+
+class SQLiteStore(object):
+    """Cache entries in an SQLite file shared by all processes of a host
+
+    The database runs in WAL mode: readers do not block each other nor writers, so many workers can use one
+    file at once. Each thread (and each forked process) opens its own connection. Rows expired for longer than
+    retention seconds are deleted by a background thread every cleanup_interval seconds.
+
+    Errors of the database are logged and treated as cache misses, the cache never breaks discovery.
+    """
+
+    def __init__(self, path, retention=86400, cleanup_interval=300, busy_timeout=5.0, clock=time.time):
+        """
+
+        :param path: str
+            database file, created if missing
+        :param retention: float
+            seconds expired rows are kept, e.g. settings which can still be revalidated with ETag
+        :param cleanup_interval: float
+            seconds between deletions of expired rows, 0 disables the background cleanup
+        :param busy_timeout: float
+            seconds a writer waits for the write lock held by another process
+        :param clock: callable
+            source of current time, for tests
+        """
+        self.path = path
+        self.retention = retention
+        self.cleanup_interval = cleanup_interval
+        self.busy_timeout = busy_timeout
+        self._clock = clock
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cleaner = None
+        self._closed = threading.Event()
+        self.errors = 0
+
+    def namespace(self, name, encode, decode):
+        """Returns view of the store with the interface of LRUCache, used by caches given store=...
+
+        :param name: str
+            separates entries of different caches
+        :param encode: callable
+            entry -> (str, float): serialized entry and its expiry timestamp
+        :param decode: callable
+            (str, float) -> entry
+        :return: SQLiteNamespace
+        """
+        return SQLiteNamespace(self, name, encode, decode)
+
+    def _connection(self):
+        # connections must neither be shared between threads nor survive fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            return connection
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(_SCHEMA)
+        self._local.connection = connection
+        self._local.pid = os.getpid()
+        self._start_cleaner()
+        return connection
+
+    def execute(self, sql, parameters=()):
+        """Runs statement on the connection of the current thread
+
+        :return: list
+            fetched rows, None on database error
+        """
+        try:
+            return self._connection().execute(sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            with self._lock:
+                self.errors += 1
+            logger.debug('Cache database %s failed: %s', self.path, e)
+            return None
+
+    def cleanup(self):
+        """Deletes rows expired for longer than retention
+
+        :return: int
+            number of rows deleted, None on database error
+        """
+        try:
+            cursor = self._connection().execute('DELETE FROM entries WHERE expires < ?',
+                                                (self._clock() - self.retention,))
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logger.debug('Cleanup of cache database %s failed: %s', self.path, e)
+            return None
+
+    def _start_cleaner(self):
+        if self.cleanup_interval <= 0:
+            return
+        with self._lock:
+            if self._cleaner is not None and self._cleaner[1] == os.getpid():
+                return
+            thread = threading.Thread(target=self._clean_periodically)
+            thread.daemon = True
+            self._cleaner = (thread, os.getpid())
+        thread.start()
+
+    def _clean_periodically(self):
+        while not self._closed.wait(self.cleanup_interval):
+            self.cleanup()
+
+    def close(self):
+        """Stops the background cleanup and closes connection of the current thread"""
+        self._closed.set()
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class SQLiteNamespace(object):
+    """Entries of one cache in SQLiteStore, see: SQLiteStore.namespace"""
+
+    def __init__(self, store, name, encode, decode):
+        self._store = store
+        self.name = name
+        self._encode = encode
+        self._decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(key):
+        # composite keys like (urlAPI, provider_id, service_id) of TemplateCache
+        return key if isinstance(key, string_types) else json.dumps(list(key))
+
+    def get(self, key, default=None):
+        rows = self._store.execute('SELECT value, expires FROM entries WHERE namespace = ? AND key = ?',
+                                   (self.name, self._key(key)))
+        with self._lock:
+            if not rows:
+                self.misses += 1
+                return default
+            self.hits += 1
+        return self._decode(rows[0][0], rows[0][1])
+
+    def put(self, key, value):
+        text, expires = self._encode(value)
+        self._store.execute('INSERT OR REPLACE INTO entries (namespace, key, value, expires) VALUES (?, ?, ?, ?)',
+                            (self.name, self._key(key), text, expires))
+
+    def invalidate(self, key):
+        self._store.execute('DELETE FROM entries WHERE namespace = ? AND key = ?', (self.name, self._key(key)))
+
+    def clear(self):
+        self._store.execute('DELETE FROM entries WHERE namespace = ?', (self.name,))
+
+    def stats(self):
+        """Returns counters of this process and number of rows
+
+        :return: dict
+        """
+        with self._lock:
+            return {
+                'size': len(self),
+                'max_size': None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': 0,
+                'errors': self._store.errors,
+            }
+
+    def __len__(self):
+        rows = self._store.execute('SELECT COUNT(*) FROM entries WHERE namespace = ?', (self.name,))
+        return rows[0][0] if rows else 0
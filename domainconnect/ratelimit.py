@@ -0,0 +1,274 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import threading
+import time
+
+from six.moves import urllib
+
+
+class RateLimitExceededException(Exception):
+    """Request not sent, because the rate limit of the host would delay it beyond the time left"""
+
+    def __init__(self, host, wait):
+        Exception.__init__(self, 'Rate limit of {} exceeded, next request possible in {:.2f}s'.format(host, wait))
+        self.host = host
+        self.wait = wait
+
+
+def _host_of(url_or_host):
+    if '//' in url_or_host:
+        url_or_host = urllib.parse.urlsplit(url_or_host).netloc
+    return url_or_host.lower()
+
+
+class RateLimiter:
+    """Per host token bucket rate limits and concurrency caps of outbound requests
+
+    Each host gets rate requests per second with bursts of up to burst requests and at most max_concurrent
+    requests at once. Limits can be set per host or per provider id (providerId of the /settings document); a
+    provider's limit applies to its urlAPI host once the provider is known from discovery or from a context.
+
+    A 429 or 503 response pauses the host for its Retry-After (throttle_delay seconds if not given).
+    """
+
+    def __init__(self, rate=None, burst=None, max_concurrent=None, limits=None, throttle_delay=1.0,
+                 clock=time.time, sleep=time.sleep):
+        """
+
+        :param rate: float
+            default requests per second per host, no limit if None
+        :param burst: int
+            default number of requests which may be sent at once after a pause, max(1, rate) if not given
+        :param max_concurrent: int
+            default maximum of concurrent requests per host, no limit if None
+        :param limits: dict
+            host name (with port if not default) or provider id mapped to dict with rate, burst and/or
+            max_concurrent overriding the defaults
+        :param throttle_delay: float
+            seconds a host is paused after 429 or 503 without Retry-After
+        :param clock: callable
+            source of current time, for tests
+        :param sleep: callable
+            used to wait for the rate limit, for tests
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.limits = dict((key.lower(), value) for key, value in (limits or {}).items())
+        self.throttle_delay = throttle_delay
+        self._clock = clock
+        self.sleep = sleep
+        # host -> provider id, only for providers with own limits
+        self._providers = dict()
+        self._keys = dict()
+        self._condition = threading.Condition()
+
+    def register_provider(self, provider_id, url_api):
+        """Applies limits configured for the provider id to its API host
+
+        :param provider_id: str
+        :param url_api: str
+            urlAPI of the provider settings
+        """
+        if not provider_id or not url_api or provider_id.lower() not in self.limits:
+            return
+        host = _host_of(url_api)
+        with self._condition:
+            self._providers[host] = provider_id.lower()
+
+    def limit(self, host):
+        """Returns limits of the host
+
+        :param host: str
+        :return: (float, int, int)
+            rate, burst and max_concurrent, None for no limit
+        """
+        key = self._key(_host_of(host))
+        return self._limit(key)
+
+    def _key(self, host):
+        return self._providers.get(host, host)
+
+    def _limit(self, key):
+        limit = self.limits.get(key, {})
+        rate = limit.get('rate', self.rate)
+        burst = limit.get('burst', self.burst)
+        if rate is not None and burst is None:
+            burst = max(1, int(rate))
+        return rate, burst, limit.get('max_concurrent', self.max_concurrent)
+
+    def _state(self, key):
+        state = self._keys.get(key)
+        if state is None:
+            rate, burst, max_concurrent = self._limit(key)
+            state = self._keys[key] = {'rate': rate, 'burst': burst, 'max_concurrent': max_concurrent,
+                                       'tokens': float(burst or 0), 'updated': self._clock(), 'paused_until': 0.0,
+                                       'prepaid': 0, 'in_flight': 0, 'requests': 0, 'delayed': 0, 'rejected': 0,
+                                       'throttled': 0}
+        return state
+
+    def _refill(self, state, now):
+        if state['rate'] is not None:
+            state['tokens'] = min(float(state['burst']), state['tokens'] + (now - state['updated']) * state['rate'])
+        state['updated'] = now
+
+    def _wait(self, state, now):
+        wait = max(0.0, state['paused_until'] - now)
+        if state['rate'] is not None and state['tokens'] < 1:
+            wait = max(wait, (1 - state['tokens']) / state['rate'])
+        return wait
+
+    def delay(self, host):
+        """Returns seconds until a request to the host would be sent without waiting, nothing is reserved
+
+        :param host: str
+            host name or URL
+        :return: float
+        """
+        with self._condition:
+            state = self._state(self._key(_host_of(host)))
+            now = self._clock()
+            self._refill(state, now)
+            return self._wait(state, now)
+
+    def capacity(self, host):
+        """Returns maximum of concurrent requests to the host
+
+        :param host: str
+            host name or URL
+        :return: int
+            None for no limit
+        """
+        return self.limit(host)[2]
+
+    def take(self, host):
+        """Takes a token of the host if available now, for a request sent soon after without waiting
+
+        Used by schedulers to start a job only when its request may go out; the request then uses the taken
+        token instead of waiting for another one.
+
+        :param host: str
+            host name or URL
+        :return: bool
+            False if a request would have to wait
+        """
+        with self._condition:
+            state = self._state(self._key(_host_of(host)))
+            now = self._clock()
+            self._refill(state, now)
+            if self._wait(state, now) > 0:
+                return False
+            if state['rate'] is not None:
+                state['tokens'] -= 1
+                # a job may send no request at all (e.g. answered from cache), its token is lost then
+                state['prepaid'] = min(state['prepaid'] + 1, state['burst'])
+            return True
+
+    def reserve(self, host, timeout=None):
+        """Takes a token of the host for one request
+
+        :param host: str
+        :param timeout: float
+            seconds the request may be delayed, no limit if None
+        :return: float
+            seconds to wait before sending the request
+        :raises: RateLimitExceededException
+            when the request would have to wait longer than timeout
+        """
+        with self._condition:
+            return self._reserve(self._state(self._key(_host_of(host))), host, timeout)
+
+    def _reserve(self, state, host, timeout):
+        # called with the condition held
+        now = self._clock()
+        self._refill(state, now)
+        if state['prepaid'] > 0:
+            state['prepaid'] -= 1
+            state['requests'] += 1
+            return 0.0
+        wait = self._wait(state, now)
+        if timeout is not None and wait > timeout:
+            state['rejected'] += 1
+            raise RateLimitExceededException(host, wait)
+        if state['rate'] is not None:
+            # tokens may go negative, later requests queue up behind the earlier ones
+            state['tokens'] -= 1
+        state['requests'] += 1
+        if wait > 0:
+            state['delayed'] += 1
+        return wait
+
+    def acquire(self, host, timeout=None):
+        """Waits for a free request slot and a token of the host, to be followed by release
+
+        :param host: str
+        :param timeout: float
+            seconds the request may be delayed, no limit if None
+        :return: str
+            key of the taken slot, to be passed to release; stays valid when a provider is registered meanwhile
+        :raises: RateLimitExceededException
+        """
+        deadline = None if timeout is None else self._clock() + timeout
+        with self._condition:
+            key = self._key(_host_of(host))
+            state = self._state(key)
+            while state['max_concurrent'] is not None and state['in_flight'] >= state['max_concurrent']:
+                remaining = None if deadline is None else deadline - self._clock()
+                if remaining is not None and remaining <= 0:
+                    state['rejected'] += 1
+                    raise RateLimitExceededException(host, 0.0)
+                self._condition.wait(remaining)
+            state['in_flight'] += 1
+            try:
+                wait = self._reserve(state, host, None if deadline is None else deadline - self._clock())
+            except RateLimitExceededException:
+                state['in_flight'] -= 1
+                self._condition.notify_all()
+                raise
+        if wait > 0:
+            self.sleep(wait)
+        return key
+
+    def release(self, key):
+        """Frees the request slot taken by acquire
+
+        :param key: str
+            returned by acquire
+        """
+        with self._condition:
+            state = self._keys[key]
+            state['in_flight'] -= 1
+            self._condition.notify_all()
+
+    def throttled(self, host, retry_after=None):
+        """Pauses the host after it answered 429 or 503
+
+        :param host: str
+        :param retry_after: float
+            seconds from Retry-After header, throttle_delay if None
+        """
+        with self._condition:
+            state = self._state(self._key(_host_of(host)))
+            state['paused_until'] = max(state['paused_until'], self._clock() + (
+                self.throttle_delay if retry_after is None else retry_after))
+            state['throttled'] += 1
+
+    def stats(self):
+        """Returns counters per host or provider id
+
+        :return: dict
+            host or provider id mapped to dict with requests sent, delayed by the rate limit, rejected, throttled
+            by the server and currently in flight
+        """
+        with self._condition:
+            return dict((key, {'requests': state['requests'], 'delayed': state['delayed'],
+                               'rejected': state['rejected'], 'throttled': state['throttled'],
+                               'in_flight': state['in_flight']})
+                        for key, state in self._keys.items())
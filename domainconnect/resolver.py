@@ -0,0 +1,275 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dns.exception import Timeout
+from dns.resolver import Resolver, NXDOMAIN, NoAnswer, NoNameservers
+from six.moves import urllib
+
+# configured resolvers by (class, options), see: get_resolver
+_resolvers = dict()
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(context, resolver_class=Resolver):
+    """Returns resolver configured with DNS options of the network context
+
+    Resolvers are shared by all network contexts with the same options. They are never modified after creation,
+    so one resolver can be used by many threads at once.
+
+    :param context: NetworkContext
+    :param resolver_class: type
+        dns.resolver.Resolver or dns.asyncresolver.Resolver
+    :return: Resolver
+    """
+    key = (resolver_class, context.nameservers, context.dns_query_timeout, context.dns_edns, context.dns_payload)
+    with _resolvers_lock:
+        resolver = _resolvers.get(key)
+        if resolver is None:
+            resolver = _resolvers[key] = _create_resolver(context, resolver_class)
+    return resolver
+
+
+def _create_resolver(context, resolver_class):
+    if context.nameservers is not None:
+        # system configuration is not needed when nameservers are given
+        resolver = resolver_class(configure=False)
+        resolver.nameservers = [nameserver.strip() for nameserver in context.nameservers.split(',')]
+    else:
+        resolver = resolver_class()
+    if context.dns_query_timeout is not None:
+        resolver.timeout = context.dns_query_timeout
+    if context.dns_edns is not None or context.dns_payload is not None:
+        if context.dns_edns is False:
+            # dnspython 1.16 has no defaults for ednsflags and payload
+            resolver.use_edns(-1, 0, 0)
+        else:
+            edns = 0 if context.dns_edns in (None, True) else context.dns_edns
+            resolver.use_edns(edns, 0, context.dns_payload if context.dns_payload is not None else 1232)
+    return resolver
+
+
+def query_options(context, lifetime=None):
+    """Returns keyword arguments of a query for the network context
+
+    :param context: NetworkContext
+    :param lifetime: float
+        time limit of the whole lookup
+    :return: dict
+    """
+    options = dict()
+    if lifetime is not None:
+        options['lifetime'] = lifetime
+    if context.dns_tcp:
+        options['tcp'] = True
+    return options
+
+
+def get_dns_backend(context):
+    """Returns DNS backend of the network context, dnspython resolver if none configured
+
+    :param context: NetworkContext
+    :return: DnsBackend
+    """
+    if context.dns_backend is not None:
+        return context.dns_backend
+    return DnsPythonBackend(get_resolver(context), tcp=context.dns_tcp)
+
+
+class TxtAnswer(object):
+    """TXT records of a name"""
+
+    def __init__(self, values, ttl):
+        """
+
+        :param values: list(str)
+            TXT records, strings of each record concatenated
+        :param ttl: int
+            seconds the answer may be cached
+        """
+        self.values = values
+        self.ttl = ttl
+
+
+class DnsBackend(object):
+    """Interface of DNS lookup backends used for discovery
+
+    Lookups fail with exceptions of dnspython (NXDOMAIN, NoAnswer, NoNameservers, Timeout), regardless
+    of the backend, so that callers can tell missing records from failures.
+    """
+
+    def lookup_txt(self, name, lifetime=None):
+        """Looks up TXT records of a name
+
+        :param name: str
+        :param lifetime: float
+            time limit of the lookup, backend default if not given
+        :return: TxtAnswer
+        """
+        raise NotImplementedError()
+
+    def lookup_txt_many(self, names, lifetime=None):
+        """Looks up TXT records of many names
+
+        :param names: iterable(str)
+        :param lifetime: float
+            time limit of each lookup
+        :return: dict
+            name mapped to TxtAnswer or to the exception of its lookup
+        """
+        ret = dict()
+        for name in names:
+            # noinspection PyBroadException
+            try:
+                ret[name] = self.lookup_txt(name, lifetime)
+            except Exception as e:
+                ret[name] = e
+        return ret
+
+
+def _concurrent_lookups(backend, names, lifetime, max_workers):
+    names = list(set(names))
+    if len(names) <= 1:
+        return DnsBackend.lookup_txt_many(backend, names, lifetime)
+    with ThreadPoolExecutor(max_workers=min(len(names), max_workers)) as executor:
+        return dict(zip(names, executor.map(lambda name: DnsBackend.lookup_txt_many(backend, [name],
+                                                                                     lifetime)[name], names)))
+
+
+def txt_answer(answer):
+    """Converts dnspython answer to TxtAnswer
+
+    :param answer: dns.resolver.Answer
+    :return: TxtAnswer
+    """
+    return TxtAnswer([b''.join(rdata.strings).decode('utf-8') for rdata in answer], answer.rrset.ttl)
+
+
+class DnsPythonBackend(DnsBackend):
+    """Lookups with a dnspython resolver, see: get_resolver"""
+
+    def __init__(self, resolver, tcp=False, max_workers=16):
+        """
+
+        :param resolver: dns.resolver.Resolver
+        :param tcp: bool
+            send queries over TCP
+        :param max_workers: int
+            maximum number of concurrent lookups of lookup_txt_many
+        """
+        self.resolver = resolver
+        self.tcp = tcp
+        self.max_workers = max_workers
+
+    def lookup_txt(self, name, lifetime=None):
+        options = dict()
+        if lifetime is not None:
+            options['lifetime'] = lifetime
+        if self.tcp:
+            options['tcp'] = True
+        return txt_answer(self.resolver.query(name, 'TXT', **options))
+
+    def lookup_txt_many(self, names, lifetime=None):
+        return _concurrent_lookups(self, names, lifetime, self.max_workers)
+
+
+class DoHBackend(DnsBackend):
+    """Lookups with DNS-over-HTTPS JSON API (application/dns-json)
+
+    Requests go over the kept alive connections of the network context, so successive lookups do not pay
+    for a TLS handshake.
+    """
+
+    def __init__(self, context, url='https://cloudflare-dns.com/dns-query', max_workers=16):
+        """
+
+        :param context: NetworkContext
+            used for the HTTPS requests
+        :param url: str
+            endpoint of the JSON API, e.g. https://dns.google/resolve
+        :param max_workers: int
+            maximum number of concurrent lookups of lookup_txt_many
+        """
+        self.context = context
+        self.url = url
+        self.max_workers = max_workers
+
+    def lookup_txt(self, name, lifetime=None):
+        from .network import http_request_json
+
+        url = '{}?{}'.format(self.url, urllib.parse.urlencode([('name', name), ('type', 'TXT')]))
+        try:
+            response, _ = http_request_json(self.context, 'GET', url, accepts='application/dns-json',
+                                            timeout=lifetime)
+        except socket.timeout:
+            raise Timeout()
+        except Exception:
+            raise NoNameservers()
+        if response.get('Status') == 3:
+            raise NXDOMAIN()
+        if response.get('Status') != 0:
+            raise NoNameservers()
+        answers = [answer for answer in response.get('Answer', []) if answer.get('type') == 16]
+        if not answers:
+            raise NoAnswer()
+        return TxtAnswer([self._txt_data(answer['data']) for answer in answers], min(a['TTL'] for a in answers))
+
+    @staticmethod
+    def _txt_data(data):
+        # data is presentation format: one or more quoted strings
+        if not data.startswith('"'):
+            return data
+        return ''.join(part for i, part in enumerate(data.split('"')) if i % 2 == 1)
+
+    def lookup_txt_many(self, names, lifetime=None):
+        return _concurrent_lookups(self, names, lifetime, self.max_workers)
+
+
+class StaticBackend(DnsBackend):
+    """In-memory zone map, for tests and offline benchmarks
+
+    Names not in the map do not exist.
+    """
+
+    def __init__(self, zones, ttl=300, latency=0):
+        """
+
+        :param zones: dict
+            name mapped to TXT record or list of TXT records
+        :param ttl: int
+            TTL of all answers
+        :param latency: float
+            seconds every lookup takes, to emulate a real resolver
+        """
+        self.zones = zones
+        self.ttl = ttl
+        self.latency = latency
+
+    def lookup_txt(self, name, lifetime=None):
+        if self.latency:
+            if lifetime is not None and lifetime < self.latency:
+                time.sleep(lifetime)
+                raise Timeout()
+            time.sleep(self.latency)
+        values = self.zones.get(name.rstrip('.').lower())
+        if values is None:
+            raise NXDOMAIN()
+        if not isinstance(values, list):
+            values = [values]
+        return TxtAnswer(values, self.ttl)
+
+    def lookup_txt_many(self, names, lifetime=None):
+        if not self.latency:
+            return DnsBackend.lookup_txt_many(self, names, lifetime)
+        # lookups of a real resolver would overlap
+        return _concurrent_lookups(self, names, lifetime, 64)
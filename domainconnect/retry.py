@@ -0,0 +1,225 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import random
+import socket
+import ssl
+import threading
+import time
+from email.utils import parsedate_tz, mktime_tz
+
+from six.moves import http_client as client
+
+
+class CircuitOpenException(Exception):
+    """Request not sent, because the circuit breaker of the host is open"""
+
+    def __init__(self, host, retry_in):
+        Exception.__init__(self, 'Circuit breaker for {} is open, retry in {:.0f}s'.format(host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value, clock=time.time):
+    """Parses value of Retry-After header
+
+    :param value: str
+        delay in seconds or HTTP date
+    :return: float
+        seconds to wait, None if value is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(int(value)))
+    except ValueError:
+        pass
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - clock())
+
+
+class RetryPolicy:
+    """Retries of idempotent requests failing with transient errors
+
+    Delay between attempts grows exponentially and is randomized ("full jitter"), so clients failing at
+    the same time do not come back at the same time. Retry-After of 429 and 503 responses is honored.
+    """
+
+    # errors which are not worth to retry even if raised as socket errors
+    _PERMANENT_ERRORS = (ssl.SSLError, ssl.CertificateError)
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30, retry_statuses=(429, 500, 502, 503, 504),
+                 methods=('GET', 'HEAD'), rand=random.random, sleep=time.sleep):
+        """
+
+        :param max_attempts: int
+            maximum number of attempts including the first one
+        :param backoff: float
+            upper bound of the delay in seconds before the first retry, doubled with every next retry
+        :param max_backoff: float
+            maximum delay in seconds, also for Retry-After; a longer Retry-After gives up
+        :param retry_statuses: tuple(int)
+            HTTP statuses considered transient
+        :param methods: tuple(str)
+            idempotent HTTP methods which may be retried
+        :param rand: callable
+            source of random numbers in [0, 1), for tests
+        :param sleep: callable
+            used to wait between attempts, for tests
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = retry_statuses
+        self.methods = methods
+        self._rand = rand
+        self.sleep = sleep
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def next_delay(self, method, attempt, status=None, error=None, headers=None, budget=None):
+        """Decides whether a failed attempt is retried
+
+        :param method: str
+        :param attempt: int
+            number of the failed attempt, starting with 1
+        :param status: int
+            HTTP status of the response, if any
+        :param error: Exception
+            error raised by the attempt, if any
+        :param headers: dict
+            response headers with lower case names
+        :param budget: float
+            time left for the request, None if not limited
+        :return: float
+            seconds to wait before next attempt or None if not to retry
+        """
+        if attempt >= self.max_attempts or method.upper() not in self.methods:
+            return None
+        if error is not None:
+            if not isinstance(error, (socket.error, client.HTTPException)) \
+                    or isinstance(error, self._PERMANENT_ERRORS):
+                return None
+        elif status not in self.retry_statuses:
+            return None
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1)) * self._rand()
+        if status in (429, 503) and headers is not None:
+            retry_after = parse_retry_after(headers.get('retry-after'))
+            if retry_after is not None:
+                if retry_after > self.max_backoff:
+                    return None
+                delay = max(delay, retry_after)
+        if budget is not None and delay >= budget:
+            return None
+        with self._lock:
+            self.retries += 1
+        return delay
+
+    def stats(self):
+        """Returns counters of the policy
+
+        :return: dict
+        """
+        return {'retries': self.retries}
+
+
+class CircuitBreaker:
+    """Per host circuit breaker
+
+    After failure_threshold consecutive failures of a host its circuit opens and requests to it fail fast
+    with CircuitOpenException. After reset_timeout one probe request is let through (half-open); its success
+    closes the circuit, its failure opens it again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.time):
+        """
+
+        :param failure_threshold: int
+            consecutive failures opening the circuit
+        :param reset_timeout: float
+            seconds the circuit stays open before a probe request is allowed
+        :param clock: callable
+            source of current time, for tests
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._hosts = dict()
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = {'state': self.CLOSED, 'failures': 0, 'opened_at': None,
+                                         'times_opened': 0, 'rejected': 0}
+        return state
+
+    def before_request(self, host):
+        """Checks whether a request to the host may be sent
+
+        :param host: str
+        :raises: CircuitOpenException
+            when the circuit is open or a probe request is already running
+        """
+        with self._lock:
+            state = self._host(host.lower())
+            if state['state'] == self.CLOSED:
+                return
+            now = self._clock()
+            retry_in = state['opened_at'] + self.reset_timeout - now
+            if retry_in <= 0:
+                # let one probe through, another one if it does not report back within reset_timeout
+                state['state'] = self.HALF_OPEN
+                state['opened_at'] = now
+                return
+            state['rejected'] += 1
+        raise CircuitOpenException(host, max(0.0, retry_in))
+
+    def record_success(self, host):
+        with self._lock:
+            state = self._host(host.lower())
+            state['state'] = self.CLOSED
+            state['failures'] = 0
+
+    def record_failure(self, host):
+        with self._lock:
+            state = self._host(host.lower())
+            state['failures'] += 1
+            if state['state'] == self.HALF_OPEN or \
+                    (state['state'] == self.CLOSED and state['failures'] >= self.failure_threshold):
+                state['state'] = self.OPEN
+                state['opened_at'] = self._clock()
+                state['times_opened'] += 1
+
+    def state(self, host):
+        """Returns state of the circuit of the host
+
+        :param host: str
+        :return: str
+            CLOSED, OPEN or HALF_OPEN
+        """
+        with self._lock:
+            state = self._hosts.get(host.lower())
+            return self.CLOSED if state is None else state['state']
+
+    def stats(self):
+        """Returns state and counters per host
+
+        :return: dict
+            host mapped to dict with state, consecutive failures, times opened and rejected requests
+        """
+        with self._lock:
+            return dict((host, {'state': state['state'], 'failures': state['failures'],
+                                'times_opened': state['times_opened'], 'rejected': state['rejected']})
+                        for host, state in self._hosts.items())
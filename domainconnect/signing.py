@@ -0,0 +1,103 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import hashlib
+from base64 import b64encode
+
+from six.moves import urllib
+
+from .cache import LRUCache
+
+# cryptography is imported on first use, it is not needed unless requests are signed
+
+# parsed private keys by SHA-256 fingerprint of their PEM
+_private_keys = LRUCache(max_size=32)
+
+
+def load_private_key(private_key):
+    """Parses RSA private key in PEM format
+
+    Parsed keys are cached, so repeated signing with the same PEM does not parse it again.
+
+    :param private_key: str
+        RSA key in PEM format
+    :return: RSAPrivateKey
+    """
+    fingerprint = hashlib.sha256(private_key.encode()).hexdigest()
+    pk = _private_keys.get(fingerprint)
+    if pk is None:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.backends import default_backend
+
+        pk = serialization.load_pem_private_key(
+            private_key.encode(),
+            password=None,
+            backend=default_backend()
+        )
+        _private_keys.put(fingerprint, pk)
+    return pk
+
+
+class DomainConnectSigner:
+    """Signs sync URL query strings with one private key
+
+    The key is parsed once, the object can be shared between threads.
+    """
+
+    def __init__(self, private_key, keyid):
+        """
+
+        :param private_key: str
+            RSA key in PEM format
+        :param keyid: str
+            host name of the TXT record with public KEY (appended to syncPubKeyDomain)
+        """
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.hazmat.primitives.asymmetric import padding
+
+        self.keyid = keyid
+        self._key = load_private_key(private_key)
+        self._padding = padding.PKCS1v15()
+        self._hash = hashes.SHA256()
+
+    def sign(self, data):
+        """Generates a signature on the passed in data
+
+        :param data: str
+        :return: bytes
+            base64 encoded signature
+        """
+        sig = self._key.sign(
+            data.encode(),
+            self._padding,
+            self._hash
+        )
+
+        return b64encode(sig)
+
+    def sig_params(self, queryparams):
+        """Returns signature parameters to be appended to the query string
+
+        :param queryparams: str
+        :return: str
+        """
+        return '&' + urllib.parse.urlencode(
+            {
+                "sig": self.sign(queryparams),
+                "key": self.keyid,
+            }
+        )
+
+    def sig_params_many(self, querystrings):
+        """Returns signature parameters for many query strings
+
+        :param querystrings: iterable(str)
+        :return: list(str)
+        """
+        return [self.sig_params(queryparams) for queryparams in querystrings]
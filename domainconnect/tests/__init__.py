@@ -7,4 +7,14 @@ __maintainer__ = "Pawel Kowalik"
 __email__ = "pawel-kow@users.noreply.github.com"
 __status__ = "Beta"
 
+import sys
+
 from . import test_domainConnect
+from . import test_cache
+from . import test_network
+from . import test_bulk
+from . import test_signing
+from . import test_tokens
+from . import test_ratelimit
+if sys.version_info >= (3, 7):
+    from . import test_aio
@@ -0,0 +1,6 @@
+import sys
+
+collect_ignore = []
+if sys.version_info < (3, 7):
+    # asyncio client and its tests use syntax not available in older versions
+    collect_ignore.append('test_aio.py')
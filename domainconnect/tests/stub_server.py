@@ -0,0 +1,186 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import datetime
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+
+from domainconnect.resolver import StaticBackend
+
+
+def self_signed_certificate(hostname='127.0.0.1'):
+    """Creates self signed certificate for local TLS servers
+
+    :return: (str, str)
+        paths of PEM files with certificate and private key
+    """
+    import ipaddress
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.backends import default_backend
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'{}'.format(hostname))])
+    now = datetime.datetime.utcnow()
+    certificate = x509.CertificateBuilder() \
+        .subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)) \
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address(u'{}'.format(hostname))),
+                                                    x509.DNSName(u'localhost')]), critical=False) \
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True) \
+        .sign(key, hashes.SHA256(), default_backend())
+    directory = tempfile.mkdtemp()
+    cert_file = os.path.join(directory, 'cert.pem')
+    key_file = os.path.join(directory, 'key.pem')
+    with open(cert_file, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_file, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+    return cert_file, key_file
+
+
+class StubHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Local HTTP server answering from a route table, for tests without network access
+
+    Routes map (method, path) to (status, headers, body) or to a callable taking the request handler
+    and returning such tuple.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    block_on_close = False
+
+    def __init__(self, routes=None, tls=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StubRequestHandler)
+        self.routes = routes if routes is not None else dict()
+        self.requests = []
+        self.connections = 0
+        self.close_after = None
+        self.tls = tls
+        self.cert_file = None
+        self._thread = None
+        if tls:
+            self.cert_file, key_file = self_signed_certificate()
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(self.cert_file, key_file)
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def address(self):
+        return '127.0.0.1:{}'.format(self.server_address[1])
+
+    def url(self, path):
+        return '{}://{}{}'.format('https' if self.tls else 'http', self.address, path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # clients giving up on slow routes are expected
+        pass
+
+
+class StubRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        path = self.path.split('?', 1)[0]
+        self.server.requests.append((self.command, self.path, dict(self.headers.items())))
+        route = self.server.routes.get((self.command, path))
+        if route is None:
+            status, headers, body = 404, {}, {'error': 'not found'}
+        elif callable(route):
+            status, headers, body = route(self)
+        else:
+            status, headers, body = route
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.close_after is not None and len(self.server.requests) >= self.server.close_after:
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def slow(route, delay):
+    """Wraps a route answering after a delay"""
+    def handler(request_handler):
+        time.sleep(delay)
+        return route
+    return handler
+
+
+class FakeDnsBackend(StaticBackend):
+    """StaticBackend recording looked up names"""
+
+    def __init__(self, zones, ttl=300, delay=0):
+        StaticBackend.__init__(self, zones, ttl, delay)
+        self.queries = []
+
+    def lookup_txt(self, name, lifetime=None):
+        self.queries.append(name)
+        return StaticBackend.lookup_txt(self, name, lifetime)
+
+
+PROVIDER_ID = 'exampleservice.domainconnect.org'
+TEMPLATE_PATH = '/v2/domainTemplates/providers/exampleservice.domainconnect.org/services/{}'
+
+
+def provider_routes(server):
+    def apply(handler):
+        if 'force=true' in handler.path:
+            return 202, {}, {}
+        return 409, {}, {'error': 'conflict'}
+
+    return {
+        ('GET', '/v2/example.com/settings'): (200, {}, {
+            'providerId': 'stub', 'providerName': 'Stub', 'urlSyncUX': 'https://sync.example.net',
+            'urlAsyncUX': 'https://async.example.net', 'urlAPI': server.url('')}),
+        ('GET', TEMPLATE_PATH.format('template1')): (200, {}, {'serviceId': 'template1'}),
+        ('POST', '/v2/oauth/access_token'): (200, {}, {
+            'access_token': 'token', 'token_type': 'bearer', 'expires_in': 3600, 'refresh_token': 'refresh'}),
+        ('POST', TEMPLATE_PATH.format('template1') + '/apply'): apply,
+    }
+
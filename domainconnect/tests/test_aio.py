@@ -0,0 +1,130 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import sys
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase, skipIf
+else:
+    # Python 3.x
+    from unittest import TestCase, skipIf
+
+from domainconnect import DomainConnect, NetworkContext, DomainConnectAsyncContext, DomainConnectAsyncCredentials, \
+    TemplateNotSupportedException, ConflictOnApplyException, NoDomainConnectRecordException, \
+    NoDomainConnectSettingsException, DeadlineExceededException, HistogramCollector
+from .stub_server import StubHTTPServer, FakeDnsBackend, provider_routes, slow, PROVIDER_ID, TEMPLATE_PATH
+
+
+@skipIf(sys.version_info < (3, 7), "asyncio client requires python 3.7")
+class TestAsyncDomainConnect(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        self.server.start()
+        self.resolver = FakeDnsBackend({'_domainconnect.example.com': self.server.address})
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _run(self, coroutine_function, **context_options):
+        import asyncio
+        from domainconnect import AsyncDomainConnect
+
+        async_dc = AsyncDomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file, **context_options))
+        async_dc._dns = self.resolver
+
+        async def run():
+            async with async_dc:
+                return await coroutine_function(async_dc)
+        return asyncio.run(run())
+
+    def test_sync_url_same_as_blocking_client(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        dc._dns = self.resolver
+        expected = dc.get_domain_connect_template_sync_url('www.example.com', PROVIDER_ID, 'template1',
+                                                           params={'IP': '192.0.2.1'}, state='s')
+        res = self._run(lambda async_dc: async_dc.get_domain_connect_template_sync_url(
+            'www.example.com', PROVIDER_ID, 'template1', params={'IP': '192.0.2.1'}, state='s'))
+        assert res == expected, "URL is different than expected: {}".format(res)
+        assert res == 'https://sync.example.net/v2/domainTemplates/providers/exampleservice.domainconnect.org' \
+                      '/services/template1/apply?IP=192.0.2.1&domain=example.com&host=www&state=s', res
+
+    def test_errors(self):
+        with self.assertRaises(TemplateNotSupportedException):
+            self._run(lambda async_dc: async_dc.get_domain_connect_template_sync_url(
+                'example.com', PROVIDER_ID, ['template1', 'template_not_exists']))
+        with self.assertRaises(NoDomainConnectRecordException):
+            self._run(lambda async_dc: async_dc.get_domain_config('example.org'))
+
+    def test_deadline(self):
+        template = TEMPLATE_PATH.format('template1')
+        self.server.routes[('GET', template)] = slow(self.server.routes[('GET', template)], 2)
+        with self.assertRaises(DeadlineExceededException):
+            self._run(lambda async_dc: async_dc.get_domain_connect_template_sync_url(
+                'example.com', PROVIDER_ID, 'template1', timeout=0.5))
+
+    def test_follower_not_failed_by_leader_deadline(self):
+        import asyncio
+        settings = ('GET', '/v2/example.com/settings')
+        self.server.routes[settings] = slow(self.server.routes[settings], 0.3)
+
+        async def discover(async_dc):
+            leader = asyncio.ensure_future(async_dc.get_domain_config('www.example.com', timeout=0.1))
+            await asyncio.sleep(0.03)
+            config = await async_dc.get_domain_config('example.com', timeout=5)
+            with self.assertRaises(DeadlineExceededException):
+                await leader
+            return config
+        assert self._run(discover).providerId == 'stub'
+        paths = [r[1] for r in self.server.requests]
+        assert paths.count('/v2/example.com/settings') == 2, paths
+
+    def test_concurrent_discovery(self):
+        import asyncio
+
+        async def discover(async_dc):
+            return await asyncio.gather(*[async_dc.get_domain_config('host{}.example.com'.format(i))
+                                          for i in range(20)])
+        configs = self._run(discover)
+        assert [c.host for c in configs] == ['host{}'.format(i) for i in range(20)]
+        assert self.server.connections <= 10, "Connections not reused: {}".format(self.server.connections)
+        settings_requests = [r for r in self.server.requests if r[1] == '/v2/example.com/settings']
+        assert len(settings_requests) == 1, "Concurrent settings requests not coalesced: {}".format(settings_requests)
+
+    def test_token_and_apply(self):
+        credentials = DomainConnectAsyncCredentials('client', 'secret', self.server.url(''))
+
+        async def flow(async_dc):
+            config = await async_dc.get_domain_config('example.com')
+            context = DomainConnectAsyncContext(config, PROVIDER_ID, 'template1', 'https://return', {})
+            context.code = 'code'
+            await async_dc.get_async_token(context, credentials)
+            assert context.access_token == 'token' and context.refresh_token == 'refresh'
+            try:
+                await async_dc.apply_domain_connect_template_async(context, params={'IP': '192.0.2.1'})
+                assert False, "Conflict expected"
+            except ConflictOnApplyException:
+                pass
+            await async_dc.apply_domain_connect_template_async(context, params={'IP': '192.0.2.1'}, force=True)
+        self._run(flow)
+
+    def test_tracing(self):
+        collector = HistogramCollector()
+        self._run(lambda async_dc: async_dc.get_domain_connect_template_sync_url(
+            'www.example.com', PROVIDER_ID, 'template1'), tracer=collector)
+        series = dict((entry['stage'], entry) for entry in collector.snapshot())
+        assert sorted(series) == ['connect', 'json', 'request', 'resolve', 'settings', 'template'], sorted(series)
+        assert series['request']['statuses'] == {200: 2}, series['request']
+
+    def test_max_body_size(self):
+        self.server.routes[('GET', '/v2/example.com/settings')] = (200, {}, {'urlAPI': 'x' * 2000})
+        with self.assertRaises(NoDomainConnectSettingsException):
+            self._run(lambda async_dc: async_dc.get_domain_config('example.com'), max_body_size=1024)
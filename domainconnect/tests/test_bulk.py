@@ -0,0 +1,283 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import sys
+import threading
+import time
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase
+else:
+    # Python 3.x
+    from unittest import TestCase
+
+from domainconnect import DomainConnect, DomainConnectConfig, DomainConnectSigner, NetworkContext, TemplateCache, \
+    NoDomainConnectRecordException, NoDomainConnectSettingsException, TemplateNotSupportedException, \
+    DomainConnectAsyncContext, ConflictOnApplyException, ApplyException, DeadlineExceededException
+from domainconnect.concurrency import SingleFlight
+from .stub_server import StubHTTPServer, FakeDnsBackend, provider_routes, slow, PROVIDER_ID, TEMPLATE_PATH
+from .test_signing import priv_key
+
+
+class TestBulkDiscovery(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        self.server.start()
+        self.resolver = FakeDnsBackend({'_domainconnect.example.com': self.server.address,
+                                      '_domainconnect.example.net': self.server.address})
+        self.dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        self.dc._dns = self.resolver
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_get_domain_configs(self):
+        domains = ['host{}.example.com'.format(i) for i in range(30)] + ['example.org', 'www.example.net', 'com']
+        results = dict(self.dc.get_domain_configs(iter(domains), max_workers=4))
+
+        assert sorted(results) == sorted(domains)
+        for i in range(30):
+            config = results['host{}.example.com'.format(i)]
+            assert isinstance(config, DomainConnectConfig), config
+            assert (config.domain_root, config.host, config.providerId) == ('example.com', 'host{}'.format(i), 'stub')
+        assert isinstance(results['example.org'], NoDomainConnectRecordException)
+        assert isinstance(results['com'], NoDomainConnectRecordException)
+        assert isinstance(results['www.example.net'], NoDomainConnectSettingsException)
+        assert sorted(self.resolver.queries) == ['_domainconnect.example.com', '_domainconnect.example.net',
+                                                 '_domainconnect.example.org'], self.resolver.queries
+        settings_requests = [r for r in self.server.requests if r[1] == '/v2/example.com/settings']
+        assert len(settings_requests) == 1, "Settings fetched more than once: {}".format(len(settings_requests))
+
+    def test_get_domain_connect_template_sync_urls(self):
+        items = (('host{}.example.com'.format(i), {'IP': '192.0.2.{}'.format(i)}) for i in range(20))
+        results = dict(self.dc.get_domain_connect_template_sync_urls(
+            list(items) + [('example.org', None)], PROVIDER_ID, 'template1', state='s', max_workers=4))
+
+        assert len(results) == 21
+        assert isinstance(results['example.org'], NoDomainConnectRecordException)
+        url = results['host7.example.com']
+        assert url == 'https://sync.example.net/v2/domainTemplates/providers/exampleservice.domainconnect.org' \
+                      '/services/template1/apply?IP=192.0.2.7&domain=example.com&host=host7&state=s', url
+        template_requests = [r for r in self.server.requests if r[1] == TEMPLATE_PATH.format('template1')]
+        assert len(template_requests) == 1, "Template checked more than once: {}".format(len(template_requests))
+
+    def test_get_domain_connect_template_sync_urls_errors(self):
+        results = dict(self.dc.get_domain_connect_template_sync_urls(
+            [('a.example.com', None), ('b.example.com', None)], PROVIDER_ID, 'missing'))
+        assert all(isinstance(e, TemplateNotSupportedException) and not e.transient for e in results.values()), \
+            results
+        template_requests = [r for r in self.server.requests if r[1] == TEMPLATE_PATH.format('missing')]
+        assert len(template_requests) == 1, "Template checked more than once: {}".format(len(template_requests))
+
+    def test_get_domain_connect_template_sync_urls_transient_error(self):
+        route = ('GET', TEMPLATE_PATH.format('template1'))
+        answers = [(503, {}, {}), self.server.routes[route]]
+        self.server.routes[route] = lambda request_handler: answers.pop(0) if len(answers) > 1 else answers[0]
+        results = list(self.dc.get_domain_connect_template_sync_urls(
+            [('a.example.com', None), ('b.example.com', None), ('c.example.com', None)], PROVIDER_ID, 'template1',
+            max_workers=1))
+        failed = [domain for domain, url in results if isinstance(url, TemplateNotSupportedException)]
+        assert len(failed) == 1 and results[0][0] == failed[0], results
+        assert results[0][1].transient
+        template_requests = [r for r in self.server.requests if r[1] == TEMPLATE_PATH.format('template1')]
+        assert len(template_requests) == 2, "Template not checked again: {}".format(len(template_requests))
+
+    def test_get_domain_connect_template_sync_urls_signed(self):
+        signer = DomainConnectSigner(priv_key, '_dck1')
+        results = dict(self.dc.get_domain_connect_template_sync_urls(
+            [('a.example.com', {'IP': '192.0.2.1'}), ('b.example.com', {'IP': '192.0.2.2'})],
+            PROVIDER_ID, 'template1', sign=True, private_key=priv_key, keyid='_dck1'))
+        for domain, url in results.items():
+            query = url.split('?', 1)[1]
+            unsigned, sig = query.split('&sig=', 1)
+            assert '&sig=' + sig == signer.sig_params(unsigned), url
+
+
+class TestTemplateCheck(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        self.server.routes[('GET', TEMPLATE_PATH.format('template2'))] = (200, {}, {'serviceId': 'template2'})
+        self.server.start()
+        self.config = DomainConnectConfig('example.com', 'example.com', '', {'urlAPI': self.server.url('')})
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_reports_all_unsupported(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        dc.check_template_supported(self.config, PROVIDER_ID, ['template1', 'template2'])
+        try:
+            dc.check_template_supported(self.config, PROVIDER_ID, ['missing1', 'template1', 'missing2'])
+            assert False, "TemplateNotSupportedException expected"
+        except TemplateNotSupportedException as e:
+            assert e.service_ids == ['missing1', 'missing2'], e.service_ids
+            assert e.message == 'No template for serviceId: missing1, missing2 from {}'.format(PROVIDER_ID), e.message
+
+    def test_template_cache(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file), template_cache=TemplateCache())
+        for _ in range(3):
+            dc.check_template_supported(self.config, PROVIDER_ID, 'template1')
+            with self.assertRaises(TemplateNotSupportedException):
+                dc.check_template_supported(self.config, PROVIDER_ID, 'missing')
+        assert len(self.server.requests) == 2, "Template checks not cached: {}".format(self.server.requests)
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        settings = ('GET', '/v2/example.com/settings')
+        self.server.routes[settings] = slow(self.server.routes[settings], 0.3)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_concurrent_discovery_coalesced(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        dc._dns = FakeDnsBackend({'_domainconnect.example.com': self.server.address}, delay=0.3)
+        results = []
+
+        def discover(i):
+            config = dc.get_domain_config('host{}.example.com'.format(i))
+            dc.check_template_supported(config, PROVIDER_ID, 'template1')
+            results.append(config.host)
+
+        threads = [threading.Thread(target=discover, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == sorted('host{}'.format(i) for i in range(10))
+        assert dc._dns.queries == ['_domainconnect.example.com'], dc._dns.queries
+        paths = [r[1] for r in self.server.requests]
+        assert paths.count('/v2/example.com/settings') == 1, paths
+        assert dc._flights.stats()['in_flight'] == 0
+
+    def test_follower_not_failed_by_leader_deadline(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        dc._dns = FakeDnsBackend({'_domainconnect.example.com': self.server.address})
+        errors = []
+
+        def discover_in_time():
+            try:
+                dc.get_domain_config('www.example.com', timeout=0.1)
+            except DeadlineExceededException as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=discover_in_time)
+        leader.start()
+        time.sleep(0.03)
+        config = dc.get_domain_config('example.com', timeout=5)
+        leader.join()
+        assert config.providerId == 'stub' and len(errors) == 1, errors
+        paths = [r[1] for r in self.server.requests]
+        assert paths.count('/v2/example.com/settings') == 2, paths
+
+    def test_exception_shared(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        errors = []
+
+        def fail():
+            calls.append(1)
+            started.set()
+            release.wait()
+            raise ValueError('failed')
+
+        def call():
+            try:
+                flights.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        started.wait()
+        followers = [threading.Thread(target=call) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flights.stats()['shared'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        assert len(calls) == 1 and len(errors) == 4
+        assert flights.stats() == {'in_flight': 0, 'leaders': 1, 'shared': 3}
+
+
+class TestBulkApply(TestCase):
+
+    def setUp(self):
+        self.servers = []
+        # the slow provider without TLS, certificates of both stub servers have the same subject
+        for delay in (0, 0.5):
+            server = StubHTTPServer(tls=not delay)
+            server.routes.update(provider_routes(server))
+            apply = ('POST', TEMPLATE_PATH.format('template1') + '/apply')
+            if delay:
+                server.routes[apply] = slow((202, {}, {}), delay)
+            self.servers.append(server.start())
+        self.dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.servers[0].cert_file,
+                                                              max_connections_per_host=2))
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def _jobs(self, server, count):
+        ret = []
+        for i in range(count):
+            config = DomainConnectConfig('host{}.example.com'.format(i), 'example.com', 'host{}'.format(i),
+                                         {'urlAPI': server.url('')})
+            context = DomainConnectAsyncContext(config, PROVIDER_ID, 'template1', 'https://return', {})
+            context.access_token = 'token'
+            ret.append((context, None, None, {'IP': '192.0.2.{}'.format(i)}))
+        return ret
+
+    def _applies(self, server):
+        return [r for r in server.requests if '/apply?' in r[1]]
+
+    def test_conflicts_reported_or_retried(self):
+        fast = self.servers[0]
+        results = list(self.dc.apply_domain_connect_template_async_bulk(self._jobs(fast, 10), max_workers=4))
+        assert len(results) == 10
+        assert all(isinstance(result, ConflictOnApplyException) for _, result in results), results
+
+        results = list(self.dc.apply_domain_connect_template_async_bulk(self._jobs(fast, 10), retry_conflicts=True))
+        assert [result for _, result in results] == [202] * 10, results
+        applies = self._applies(fast)[10:]
+        assert len(applies) == 20 and len([r for r in applies if 'force=true' in r[1]]) == 10, applies
+        assert all(r[2].get('Authorization') == 'Bearer token' for r in applies)
+
+    def test_slow_provider_does_not_hold_up_others(self):
+        fast, slow_server = self.servers
+        jobs = self._jobs(slow_server, 4) + self._jobs(fast, 10)
+        order = [job[0].config.urlAPI for job, result in
+                 self.dc.apply_domain_connect_template_async_bulk(jobs, force=True, max_workers=4)]
+        assert order[:10] == [fast.url('')] * 10, order
+        assert len(self._applies(slow_server)) == 4
+        # at most max_connections_per_host applies at once, so two rounds of the slow provider
+        assert fast.connections <= 2, fast.connections
+
+    def test_errors_reported_per_job(self):
+        jobs = self._jobs(self.servers[0], 2)
+        jobs[1][0].config.urlAPI = 'https://127.0.0.1:1'
+        results = dict((job[0].config.domain, result) for job, result in
+                       self.dc.apply_domain_connect_template_async_bulk(jobs, force=True))
+        assert results['host0.example.com'] == 202
+        assert isinstance(results['host1.example.com'], ApplyException), results
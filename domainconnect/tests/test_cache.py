@@ -0,0 +1,213 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import os
+import shutil
+import sys
+import tempfile
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase
+else:
+    # Python 3.x
+    from unittest import TestCase
+
+import domainconnect.domainconnect
+from domainconnect import DomainConnect, DiscoveryCache, SettingsCache, TemplateCache, SQLiteStore, \
+    NoDomainConnectRecordException
+from .stub_server import FakeDnsBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDiscoveryCache(TestCase):
+
+    def _dc(self, cache, resolver):
+        dc = DomainConnect(discovery_cache=cache)
+        dc._dns = resolver
+        return dc
+
+    def test_positive_answer_follows_ttl(self):
+        clock = FakeClock()
+        cache = DiscoveryCache(clock=clock)
+        resolver = FakeDnsBackend({'_domainconnect.example.com': 'api.example.net'}, ttl=60)
+        dc = self._dc(cache, resolver)
+
+        assert dc._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert dc._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert len(resolver.queries) == 1, "Cached answer not used: {}".format(resolver.queries)
+
+        clock.now += 61
+        assert dc._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert len(resolver.queries) == 2, "Expired answer not refreshed: {}".format(resolver.queries)
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses']) == (1, 2), "Unexpected counters: {}".format(stats)
+
+    def test_negative_answer_cached(self):
+        clock = FakeClock()
+        cache = DiscoveryCache(negative_ttl=30, clock=clock)
+        resolver = FakeDnsBackend({})
+        dc = self._dc(cache, resolver)
+
+        for _ in range(2):
+            with self.assertRaises(NoDomainConnectRecordException):
+                dc._identify_domain_connect_api('example.com')
+        assert len(resolver.queries) == 1, "Negative answer not cached: {}".format(resolver.queries)
+
+        clock.now += 31
+        with self.assertRaises(NoDomainConnectRecordException):
+            dc._identify_domain_connect_api('example.com')
+        assert len(resolver.queries) == 2, "Negative answer not expired: {}".format(resolver.queries)
+
+    def test_lru_eviction(self):
+        cache = DiscoveryCache(max_size=2)
+        cache.put('a.com', 'api.a', 60)
+        cache.put('b.com', 'api.b', 60)
+        cache.get('a.com')
+        cache.put('c.com', 'api.c', 60)
+        assert cache.get('b.com') is None, "Least recently used entry not evicted"
+        assert cache.get('a.com').value == 'api.a'
+        assert cache.get('c.com').value == 'api.c'
+        assert cache.stats()['evictions'] == 1
+
+
+class TestSettingsCache(TestCase):
+
+    def test_freshness_from_max_age(self):
+        clock = FakeClock()
+        cache = SettingsCache(stale_while_revalidate=30, clock=clock)
+        cache.store('https://api/v2/example.com/settings', {'providerId': 'p'},
+                    {'cache-control': 'public, max-age=60', 'etag': '"v1"'})
+
+        entry, state = cache.lookup('https://api/v2/example.com/settings')
+        assert state == SettingsCache.FRESH and entry.settings == {'providerId': 'p'}
+        clock.now += 61
+        assert cache.lookup('https://api/v2/example.com/settings')[1] == SettingsCache.STALE
+        clock.now += 30
+        assert cache.lookup('https://api/v2/example.com/settings')[1] == SettingsCache.EXPIRED
+
+    def test_without_cache_control_not_served_stale(self):
+        clock = FakeClock()
+        cache = SettingsCache(clock=clock)
+        cache.store('https://api/v2/example.com/settings', {'providerId': 'p'}, {'etag': '"v1"'})
+        assert cache.lookup('https://api/v2/example.com/settings')[1] == SettingsCache.EXPIRED
+        cache.store('https://api/v2/example.com/settings', {'providerId': 'p'},
+                    {'cache-control': 'max-age=0', 'etag': '"v1"'})
+        assert cache.lookup('https://api/v2/example.com/settings')[1] == SettingsCache.STALE
+
+    def test_no_store_not_cached(self):
+        cache = SettingsCache()
+        assert cache.store('https://api/v2/example.com/settings', {}, {'cache-control': 'no-store'}) is None
+        assert cache.lookup('https://api/v2/example.com/settings') == (None, None)
+
+    def test_conditional_revalidation(self):
+        clock = FakeClock()
+        requests = []
+
+        def fake_get_json_conditional(context, url, etag=None, last_modified=None, timeout=None):
+            requests.append(etag)
+            if etag == '"v1"':
+                return None, 304, {'cache-control': 'max-age=60'}
+            return {'urlAPI': 'https://api.example.net'}, 200, {'cache-control': 'max-age=10', 'etag': '"v1"'}
+
+        dc = DomainConnect(settings_cache=SettingsCache(stale_while_revalidate=0, clock=clock))
+        original = domainconnect.domainconnect.get_json_conditional
+        domainconnect.domainconnect.get_json_conditional = fake_get_json_conditional
+        try:
+            for _ in range(2):
+                settings = dc._get_domain_config_for_root('example.com', 'api.example.net')
+                assert settings == {'urlAPI': 'https://api.example.net'}
+            clock.now += 11
+            settings = dc._get_domain_config_for_root('example.com', 'api.example.net')
+            assert settings == {'urlAPI': 'https://api.example.net'}
+            clock.now += 59
+            dc._get_domain_config_for_root('example.com', 'api.example.net')
+        finally:
+            domainconnect.domainconnect.get_json_conditional = original
+        assert requests == [None, '"v1"'], "Unexpected requests: {}".format(requests)
+
+
+class TestSQLiteStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_discovery_shared_between_stores(self):
+        clock = FakeClock()
+        resolver = FakeDnsBackend({'_domainconnect.example.com': 'api.example.net'}, ttl=60)
+        first = DomainConnect(discovery_cache=DiscoveryCache(clock=clock, store=SQLiteStore(self.path)))
+        first._dns = resolver
+        # second store opens its own connection, like another worker process
+        second = DomainConnect(discovery_cache=DiscoveryCache(clock=clock, store=SQLiteStore(self.path)))
+        second._dns = resolver
+
+        assert first._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert second._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert len(resolver.queries) == 1, "Answer not shared: {}".format(resolver.queries)
+
+        clock.now += 61
+        assert second._identify_domain_connect_api('example.com') == 'api.example.net'
+        assert len(resolver.queries) == 2, "Expired answer not refreshed: {}".format(resolver.queries)
+
+    def test_entries_round_trip(self):
+        store = SQLiteStore(self.path, cleanup_interval=0)
+        templates = TemplateCache(store=store)
+        templates.put_negative(('https://api.example.net', 'provider', 'template'), 'Template not found')
+        settings = SettingsCache(store=store)
+        settings.store('https://api/v2/example.com/settings', {'providerId': 'p'},
+                       {'cache-control': 'max-age=60', 'etag': '"v1"'})
+
+        other = SQLiteStore(self.path, cleanup_interval=0)
+        entry = TemplateCache(store=other).get(('https://api.example.net', 'provider', 'template'))
+        assert (entry.value, entry.negative) == ('Template not found', True)
+        entry, state = SettingsCache(store=other).lookup('https://api/v2/example.com/settings')
+        assert state == SettingsCache.FRESH, state
+        assert (entry.settings, entry.etag) == ({'providerId': 'p'}, '"v1"')
+        assert len(templates) == 1 and settings.stats()['size'] == 1
+
+    def test_cleanup_deletes_after_retention(self):
+        clock = FakeClock()
+        store = SQLiteStore(self.path, retention=100, cleanup_interval=0, clock=clock)
+        cache = DiscoveryCache(clock=clock, store=store)
+        cache.put('a.com', 'api.a', 10)
+        cache.put('b.com', 'api.b', 1000)
+
+        clock.now += 50
+        assert store.cleanup() == 0, "Entry deleted within retention"
+        clock.now += 100
+        assert store.cleanup() == 1
+        assert cache.get('a.com') is None
+        assert cache.get('b.com').value == 'api.b'
+
+    def test_expired_read_does_not_write(self):
+        clock = FakeClock()
+        cache = DiscoveryCache(clock=clock, store=SQLiteStore(self.path, cleanup_interval=0, clock=clock))
+        cache.put('a.com', 'api.a', 10)
+        clock.now += 20
+        assert cache.get('a.com') is None
+        assert len(cache) == 1, "Expired entry deleted by reader"
+        DiscoveryCache(clock=clock, store=SQLiteStore(self.path, cleanup_interval=0)).put('a.com', 'api.new', 60)
+        assert cache.get('a.com').value == 'api.new'
+
+    def test_unusable_database_is_a_miss(self):
+        cache = DiscoveryCache(store=SQLiteStore(self.directory))
+        cache.put('a.com', 'api.a', 60)
+        assert cache.get('a.com') is None
+        assert cache.stats()['errors'] > 0
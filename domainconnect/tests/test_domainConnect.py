@@ -7,6 +7,7 @@ __maintainer__ = "Pawel Kowalik"
 __email__ = "pawel-kow@users.noreply.github.com"
 __status__ = "Beta"
 
+import pickle
 import sys
 
 if sys.version_info[0] == 2 and sys.version_info[1] == 7:
@@ -17,7 +18,8 @@ else:
     from unittest import TestCase, skipIf
 
 from domainconnect import DomainConnect, DomainConnectAsyncCredentials, TemplateNotSupportedException, \
-    ConflictOnApplyException, NoDomainConnectRecordException, AsyncTokenException
+    ConflictOnApplyException, NoDomainConnectRecordException, AsyncTokenException, split_domain, split_domains, \
+    DomainConnectConfig, DomainConnectAsyncContext
 # to assure input works like raw_input in python 2
 from builtins import input
 from os import environ
@@ -229,6 +231,41 @@ class TestDomainConnect(TestCase):
         assert domain_root == config[1], "Wrong domain root found. Expected {}, Found {}".format(config[1], domain_root)
         assert '{}{}{}'.format(config[2], '' if config[2] == '' else '.', domain_root) == config[
             0], "Domain root + subdomain != domain"
+        assert split_domain(config[0]) == (config[1], config[2]), split_domain(config[0])
+
+    def test_split_domains(self):
+        domains = ['example.com.example.com', 'WWW.Example.COM', 'www.example.com.', 'com', 'example.com']
+        assert split_domains(domains) == [('example.com', 'example.com'), ('example.com', 'WWW'),
+                                          ('example.com', 'www'), (None, None), ('example.com', '')]
+
+    def test_lazy_imports(self):
+        import subprocess
+        code = 'import sys, domainconnect; ' \
+               'print([m for m in ("publicsuffixlist", "cryptography", "webbrowser") if m in sys.modules])'
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().strip()
+        assert output == '[]', "Modules imported eagerly: {}".format(output)
+
+    def test_import_does_not_configure_logging(self):
+        import subprocess
+        code = 'import logging, domainconnect; print(len(logging.getLogger().handlers))'
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().strip()
+        assert output == '0', "Root logger configured on import"
+
+    def test_set_public_suffix_list(self):
+        from publicsuffixlist import PublicSuffixList
+        from domainconnect import get_public_suffix_list, set_public_suffix_list
+        default = get_public_suffix_list()
+        custom = PublicSuffixList(source=[u'connect.domains'])
+        set_public_suffix_list(custom)
+        try:
+            assert DomainConnect.identify_domain_root('foo.bar.connect.domains') == 'bar.connect.domains'
+        finally:
+            set_public_suffix_list(default)
+        assert DomainConnect.identify_domain_root('foo.bar.connect.domains') == 'connect.domains'
+
+    def test_former_psl_attribute(self):
+        from domainconnect.domainconnect import psl
+        assert psl.privatesuffix('www.example.co.uk') == 'example.co.uk'
 
     def test_get_domain_connect_template_async_url(self):
         for i in configs:
@@ -401,3 +438,64 @@ class TestDomainConnect(TestCase):
             pass
 
         dc.apply_domain_connect_template_async(context, service_id='template2', params=params2, force=True)
+
+
+class TestSerialization(TestCase):
+
+    def _context(self):
+        config = DomainConnectConfig('www.example.com', 'example.com', 'www', {
+            'urlSyncUX': 'https://sync.example.net', 'urlAsyncUX': 'https://async.example.net',
+            'urlAPI': 'https://api.example.net', 'providerId': 'example', 'providerName': 'Example',
+            'width': 750, 'height': 750})
+        context = DomainConnectAsyncContext(config, 'exampleservice.domainconnect.org', 'template1',
+                                            'https://example.org/return', {'IP': '192.0.2.1'})
+        context.code = 'code'
+        context.access_token = 'token'
+        context.access_token_expires_in = 3600
+        context.iat = 1500000000
+        return context
+
+    def _assert_equal(self, restored, context):
+        assert restored.to_dict() == context.to_dict(), restored.to_dict()
+        assert restored.config.uxSize == (750, 750)
+        assert restored.config.urlControlPanel is None
+
+    def test_round_trips(self):
+        context = self._context()
+        self._assert_equal(DomainConnectAsyncContext.from_dict(context.to_dict()), context)
+        self._assert_equal(DomainConnectAsyncContext.from_json(context.to_json()), context)
+        self._assert_equal(DomainConnectAsyncContext.from_bytes(context.to_bytes()), context)
+        config = DomainConnectConfig.from_bytes(context.config.to_bytes())
+        assert config.to_dict() == context.config.to_dict()
+
+    def test_compact(self):
+        context = self._context()
+        assert not hasattr(context, '__dict__') and not hasattr(context.config, '__dict__')
+        assert len(context.to_bytes()) < len(context.to_json())
+
+    def test_pickle(self):
+        context = self._context()
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            self._assert_equal(pickle.loads(pickle.dumps(context, protocol)), context)
+
+    def test_unpickle_before_slots(self):
+        # protocol 0 pickle of a context created by releases without __slots__
+        data = b'ccopy_reg\n_reconstructor\np0\n(cdomainconnect.domainconnect\nDomainConnectAsyncContext\np1\n' \
+               b'c__builtin__\nobject\np2\nNtp3\nRp4\n(dp5\nVconfig\np6\ng0\n(cdomainconnect.domainconnect\n' \
+               b'DomainConnectConfig\np7\ng2\nNtp8\nRp9\n(dp10\nVdomain\np11\nVwww.example.com\np12\n' \
+               b'sVdomain_root\np13\nVexample.com\np14\nsVhost\np15\nVwww\np16\nsVurlAPI\np17\n' \
+               b'Vhttps://api.example.net\np18\nsVproviderId\np19\nVexample\np20\nsVuxSize\np21\n' \
+               b'(I750\nI750\ntp22\nsbsg19\nVexampleservice.domainconnect.org\np23\nsVserviceId\np24\n' \
+               b'Vtemplate1\np25\nsVreturn_url\np26\nVhttps://example.org/return\np27\nsVparams\np28\n' \
+               b'(dp29\nVIP\np30\nV192.0.2.1\np31\nssVclient_secret\np32\nV\np33\nsVaccess_token\np34\n' \
+               b'Vtoken\np35\nsb.'
+        context = pickle.loads(data)
+        assert (context.serviceId, context.access_token, context.code) == ('template1', 'token', None)
+        assert (context.config.urlAPI, context.config.uxSize, context.config.urlSyncUX) == \
+            ('https://api.example.net', (750, 750), None)
+        assert context.params == {'IP': '192.0.2.1'}
+
+    def test_invalid_bytes(self):
+        for data in [b'', b'\x00[]', b'\x01[1,2]', b'\x01{}']:
+            with self.assertRaises(ValueError):
+                DomainConnectAsyncContext.from_bytes(data)
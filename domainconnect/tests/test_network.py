@@ -0,0 +1,457 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import io
+import socket
+import ssl
+import sys
+import threading
+import time
+
+import dns.resolver
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase
+else:
+    # Python 3.x
+    from unittest import TestCase
+
+from domainconnect import DomainConnect, NetworkContext, Deadline, DeadlineExceededException, RetryPolicy, \
+    CircuitBreaker, CircuitOpenException, DoHBackend, StaticBackend, NoDomainConnectRecordException, \
+    DomainConnectSigner, DiscoveryCache, HistogramCollector, Tracer
+from domainconnect.network import get_json, get_http, http_request, HttpStatusException, ResponseTooLargeException, \
+    ConnectionPool, _create_connection, _read_body
+from domainconnect.resolver import get_resolver, query_options, _create_resolver
+from .test_signing import priv_key
+from .stub_server import StubHTTPServer, FakeDnsBackend, provider_routes, slow, PROVIDER_ID, TEMPLATE_PATH
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer({
+            ('GET', '/v2/example.com/settings'): (200, {}, {'providerId': 'stub'}),
+            ('POST', '/apply'): (202, {}, {}),
+        }).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_keep_alive_reuses_connection(self):
+        context = NetworkContext()
+        for _ in range(5):
+            assert get_json(context, self.server.url('/v2/example.com/settings')) == {'providerId': 'stub'}
+        http_request(context, 'POST', self.server.url('/apply'), body='{}', accepted_statuses=[202])
+        context.close()
+        assert self.server.connections == 1, "Connections not reused: {}".format(self.server.connections)
+        assert context.pool.stats()['reused'] == 5
+
+    def test_reconnect_when_server_closes(self):
+        self.server.close_after = 1
+        context = NetworkContext()
+        for _ in range(3):
+            assert get_json(context, self.server.url('/v2/example.com/settings')) == {'providerId': 'stub'}
+        context.close()
+        assert self.server.connections == 3, "Unexpected connections: {}".format(self.server.connections)
+
+    def test_post_over_closed_connection_not_resent(self):
+        def drop(request_handler):
+            raise socket.error('connection dropped after processing')
+        self.server.routes[('POST', '/apply')] = drop
+        self.server.routes[('GET', '/drop')] = drop
+        context = NetworkContext()
+        get_json(context, self.server.url('/v2/example.com/settings'))
+        with self.assertRaises(socket.error):
+            http_request(context, 'POST', self.server.url('/apply'), body='{}', accepted_statuses=[202])
+        assert len([r for r in self.server.requests if r[0] == 'POST']) == 1, "Apply sent twice"
+        get_json(context, self.server.url('/v2/example.com/settings'))
+        with self.assertRaises(socket.error):
+            get_json(context, self.server.url('/drop'))
+        assert len([r for r in self.server.requests if r[1] == '/drop']) == 2, "GET not resent"
+        context.close()
+
+    def test_post_not_sent_over_connection_closed_by_server(self):
+        self.server.close_after = 1
+        context = NetworkContext()
+        get_json(context, self.server.url('/v2/example.com/settings'))
+        time.sleep(0.1)
+        http_request(context, 'POST', self.server.url('/apply'), body='{}', accepted_statuses=[202])
+        context.close()
+        assert self.server.connections == 2
+
+    def test_idle_connections_of_all_hosts_closed(self):
+        now = [100.0]
+        pool = ConnectionPool(idle_timeout=30, max_idle=2, clock=lambda: now[0])
+        closed = []
+
+        class FakeConnection:
+            def __init__(self, name):
+                self.name = name
+
+            def close(self):
+                closed.append(self.name)
+        for name in ['a', 'b', 'c']:
+            connection, _ = pool.acquire(('https', name), lambda: FakeConnection(name))
+            pool.release(('https', name), connection)
+            now[0] += 1
+        assert closed == ['a'], "Oldest idle connection beyond max_idle not closed: {}".format(closed)
+        now[0] += 30
+        pool.acquire(('https', 'd'), lambda: FakeConnection('d'))
+        assert sorted(closed) == ['a', 'b', 'c'], "Expired connections of other hosts kept: {}".format(closed)
+        assert pool.stats()['open'] == 1 and pool.stats()['idle'] == 0, pool.stats()
+
+    def test_without_keep_alive(self):
+        context = NetworkContext(keep_alive=False)
+        for _ in range(2):
+            get_json(context, self.server.url('/v2/example.com/settings'))
+        assert self.server.connections == 2
+
+
+class TestTLS(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer({
+            ('GET', '/v2/example.com/settings'): (200, {}, {'providerId': 'stub'}),
+        }, tls=True).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_certificate_verified(self):
+        with self.assertRaises(ssl.SSLError):
+            get_json(NetworkContext(), self.server.url('/v2/example.com/settings'))
+        assert get_json(NetworkContext(verify_ssl=False), self.server.url('/v2/example.com/settings')) == \
+            {'providerId': 'stub'}
+
+    def test_shared_context_and_session_resumption(self):
+        context = NetworkContext(keep_alive=False, ca_file=self.server.cert_file)
+        ssl_context = context.get_ssl_context()
+        for _ in range(3):
+            assert get_json(context, self.server.url('/v2/example.com/settings')) == {'providerId': 'stub'}
+        assert context.get_ssl_context() is ssl_context
+
+        connection = _create_connection(context, 'https', self.server.address)
+        try:
+            connection.request('GET', '/v2/example.com/settings')
+            connection.getresponse().read()
+            assert connection.sock.session_reused, "TLS session not resumed"
+        finally:
+            connection.close()
+
+
+class TestTimeouts(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        template = TEMPLATE_PATH.format('template1')
+        self.server.routes[('GET', template)] = slow(self.server.routes[('GET', template)], 2)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_read_timeout(self):
+        context = NetworkContext(ca_file=self.server.cert_file, read_timeout=0.2)
+        assert get_json(context, self.server.url('/v2/example.com/settings'))['providerId'] == 'stub'
+        start = time.time()
+        with self.assertRaises(socket.timeout):
+            get_json(context, self.server.url(TEMPLATE_PATH.format('template1')))
+        assert time.time() - start < 1
+
+    def test_deadline_of_slowly_sent_response(self):
+        def trickle(request_handler):
+            request_handler.wfile.write(b'HTTP/1.1 200 OK\r\nContent-Length: 20\r\n\r\n')
+            for _ in range(20):
+                request_handler.wfile.write(b' ')
+                request_handler.wfile.flush()
+                time.sleep(0.1)
+            raise socket.error('response written')
+        self.server.routes[('GET', '/trickle')] = trickle
+        context = NetworkContext(ca_file=self.server.cert_file, read_timeout=0.5)
+        start = time.time()
+        with self.assertRaises(socket.timeout):
+            http_request(context, 'GET', self.server.url('/trickle'), timeout=0.5)
+        assert time.time() - start < 1
+
+    def test_wait_for_free_connection_within_budget(self):
+        context = NetworkContext(ca_file=self.server.cert_file, max_connections_per_host=1)
+        thread = threading.Thread(target=lambda: self.assertRaises(
+            socket.timeout, get_http, context, self.server.url(TEMPLATE_PATH.format('template1')), 1.5))
+        thread.start()
+        time.sleep(0.2)
+        start = time.time()
+        with self.assertRaises(socket.timeout):
+            get_http(context, self.server.url('/v2/example.com/settings'), timeout=0.5)
+        assert time.time() - start < 1, "Waited for connection beyond budget: {}".format(time.time() - start)
+        thread.join()
+
+    def test_budget_used_up(self):
+        context = NetworkContext(ca_file=self.server.cert_file)
+        for budget in [0, -1]:
+            with self.assertRaises(socket.timeout):
+                http_request(context, 'GET', self.server.url('/v2/example.com/settings'), timeout=budget)
+        assert self.server.requests == []
+
+    def test_deadline(self):
+        dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        dc._dns = FakeDnsBackend({'_domainconnect.example.com': self.server.address})
+        start = time.time()
+        try:
+            dc.get_domain_connect_template_sync_url('example.com', PROVIDER_ID, 'template1', timeout=0.5)
+            assert False, "DeadlineExceededException expected"
+        except DeadlineExceededException as e:
+            assert e.message == 'Deadline exceeded while checking template template1', e.message
+        assert time.time() - start < 1.5
+        assert dc._dns.queries == ['_domainconnect.example.com']
+
+    def test_deadline_budget(self):
+        now = [100.0]
+        deadline = Deadline(5, clock=lambda: now[0])
+        now[0] += 2
+        assert deadline.remaining() == 3
+        now[0] += 3
+        assert deadline.expired() and deadline.remaining() == 0
+        with self.assertRaises(DeadlineExceededException):
+            deadline.check('resolving')
+
+
+class TestRetryAndCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.responses = []
+
+        def flaky(handler):
+            return self.responses.pop(0) if self.responses else (200, {}, {'providerId': 'stub'})
+
+        self.server = StubHTTPServer({
+            ('GET', '/v2/example.com/settings'): flaky,
+            ('POST', '/apply'): flaky,
+        }).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_retry_after(self):
+        sleeps = []
+        policy = RetryPolicy(max_attempts=3, rand=lambda: 0.0, sleep=sleeps.append)
+        context = NetworkContext(retry_policy=policy)
+        self.responses = [(503, {'Retry-After': '1'}, {}), (429, {'Retry-After': '2'}, {})]
+        assert get_json(context, self.server.url('/v2/example.com/settings')) == {'providerId': 'stub'}
+        assert sleeps == [1.0, 2.0], sleeps
+
+        self.responses = [(503, {}, {}), (503, {}, {}), (503, {}, {})]
+        with self.assertRaises(HttpStatusException):
+            get_json(context, self.server.url('/v2/example.com/settings'))
+        assert len(self.server.requests) == 6
+        assert context.stats()['retry'] == {'retries': 4}
+
+    def test_no_retry_of_post(self):
+        context = NetworkContext(retry_policy=RetryPolicy(sleep=lambda delay: None))
+        self.responses = [(503, {}, {})]
+        with self.assertRaises(HttpStatusException):
+            http_request(context, 'POST', self.server.url('/apply'), body='{}')
+        assert len(self.server.requests) == 1
+
+    def test_circuit_breaker(self):
+        now = [1000.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=lambda: now[0])
+        context = NetworkContext(circuit_breaker=breaker)
+        url = self.server.url('/v2/example.com/settings')
+        self.responses = [(500, {}, {}), (502, {}, {}), (500, {}, {})]
+        for _ in range(2):
+            with self.assertRaises(HttpStatusException):
+                get_json(context, url)
+        with self.assertRaises(CircuitOpenException):
+            get_json(context, url)
+        assert len(self.server.requests) == 2, "Request sent while circuit is open"
+        assert context.stats()['circuit_breaker'][self.server.address] == \
+            {'state': 'open', 'failures': 2, 'times_opened': 1, 'rejected': 1}
+
+        now[0] += 31
+        with self.assertRaises(HttpStatusException):
+            get_json(context, url)
+        assert breaker.state(self.server.address) == CircuitBreaker.OPEN, "Failed probe shall open circuit again"
+        now[0] += 31
+        assert get_json(context, url) == {'providerId': 'stub'}
+        assert breaker.state(self.server.address) == CircuitBreaker.CLOSED
+
+
+class FakeResponse:
+    def __init__(self, body, length=None):
+        self._body = io.BytesIO(body)
+        self._length = length
+        self.reads = []
+
+    def getheader(self, name):
+        return self._length
+
+    def read(self, amount=None):
+        self.reads.append(amount)
+        return self._body.read(amount)
+
+
+class TestBodySize(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(routes={('GET', '/big'): (200, {}, b'[' + b'1,' * 1000 + b'1]'),
+                                             ('GET', '/small'): (200, {}, b'{"a": 1}')}, tls=True)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_announced_size_rejected(self):
+        context = NetworkContext(ca_file=self.server.cert_file, max_body_size=1024)
+        with self.assertRaises(ResponseTooLargeException) as cm:
+            get_json(context, self.server.url('/big'))
+        assert cm.exception.length == 2003, cm.exception.length
+        assert context.pool.stats()['open'] == 0, "Connection with unread body kept"
+        assert get_json(context, self.server.url('/small')) == {'a': 1}
+        assert len(get_json(NetworkContext(ca_file=self.server.cert_file, max_body_size=None),
+                            self.server.url('/big'))) == 1001
+
+    def test_streamed_size_rejected(self):
+        response = FakeResponse(b'x' * 200000)
+        with self.assertRaises(ResponseTooLargeException):
+            _read_body(response, 'example.com', 100000)
+        assert response.reads == [65536, 34465], response.reads
+        assert _read_body(FakeResponse(b'x' * 100000), 'example.com', 100000) == b'x' * 100000
+
+
+class TestResolver(TestCase):
+
+    def test_resolver_per_nameserver_set(self):
+        dc1 = DomainConnect(networkcontext=NetworkContext(nameservers='192.0.2.1'))
+        dc2 = DomainConnect(networkcontext=NetworkContext(nameservers='192.0.2.2, 192.0.2.3'))
+        dc3 = DomainConnect(networkcontext=NetworkContext(nameservers='192.0.2.1'))
+        assert dc1._dns.resolver.nameservers == ['192.0.2.1']
+        assert dc2._dns.resolver.nameservers == ['192.0.2.2', '192.0.2.3']
+        assert dc1._dns.resolver is dc3._dns.resolver
+
+    def test_resolver_options(self):
+        context = NetworkContext(nameservers='192.0.2.1', dns_query_timeout=1.5, dns_edns=0, dns_payload=4096,
+                                 dns_tcp=True)
+        resolver = get_resolver(context)
+        assert (resolver.timeout, resolver.edns, resolver.payload) == (1.5, 0, 4096)
+        assert get_resolver(NetworkContext(nameservers='192.0.2.1', dns_edns=False)).edns == -1
+        assert query_options(context, 2) == {'lifetime': 2, 'tcp': True}
+        assert query_options(NetworkContext()) == {}
+
+    def test_resolver_options_dnspython_1_16(self):
+        class Resolver116(dns.resolver.Resolver):
+            def use_edns(self, edns, ednsflags, payload):
+                dns.resolver.Resolver.use_edns(self, edns, ednsflags, payload)
+        for edns in [False, 0]:
+            resolver = _create_resolver(NetworkContext(nameservers='192.0.2.1', dns_edns=edns), Resolver116)
+            assert resolver.edns == (-1 if edns is False else 0)
+
+    def test_static_backend_batch_lookup(self):
+        backend = FakeDnsBackend({'_domainconnect.example.com': 'api.example.net',
+                                  '_domainconnect.example.org': ['api.example.org', 'other']})
+        dc = DomainConnect(networkcontext=NetworkContext(dns_backend=backend))
+        res = dc.identify_domain_connect_apis(['example.com', 'example.org', 'example.net'])
+        assert res['example.com'] == 'api.example.net', res
+        assert res['example.org'] == 'api.example.org', res
+        assert isinstance(res['example.net'], NoDomainConnectRecordException), res
+        assert sorted(backend.queries) == ['_domainconnect.example.com', '_domainconnect.example.net',
+                                           '_domainconnect.example.org'], backend.queries
+
+    def test_static_backend_lookups_overlap(self):
+        backend = StaticBackend(dict(('_domainconnect.example{}.com'.format(i), 'api.example.net')
+                                     for i in range(10)), latency=0.2)
+        start = time.time()
+        res = backend.lookup_txt_many(['_domainconnect.example{}.com'.format(i) for i in range(10)])
+        assert time.time() - start < 1, "Lookups not run concurrently"
+        assert all(answer.values == ['api.example.net'] for answer in res.values()), res
+
+    def test_doh_backend(self):
+        def resolve(handler):
+            if 'name=_domainconnect.example.com' in handler.path:
+                assert handler.headers.get('Accept') == 'application/dns-json'
+                return 200, {}, {'Status': 0, 'Answer': [
+                    {'name': '_domainconnect.example.com.', 'type': 5, 'TTL': 60, 'data': 'alias.example.com.'},
+                    {'name': 'alias.example.com.', 'type': 16, 'TTL': 120, 'data': '"api.exa" "mple.net"'}]}
+            return 200, {}, {'Status': 3}
+
+        server = StubHTTPServer(routes={('GET', '/dns-query'): resolve}, tls=True)
+        server.start()
+        try:
+            context = NetworkContext(ca_file=server.cert_file)
+            context.dns_backend = DoHBackend(context, server.url('/dns-query'))
+            dc = DomainConnect(networkcontext=context)
+            assert dc._identify_domain_connect_api('example.com') == 'api.example.net'
+            with self.assertRaises(NoDomainConnectRecordException):
+                dc._identify_domain_connect_api('example.org')
+            assert context.pool.stats()['created'] == 1, context.pool.stats()
+        finally:
+            server.stop()
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.spans = []
+
+    def on_span(self, stage, duration, attributes):
+        self.spans.append((stage, duration, attributes))
+
+
+class TestTracing(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_stages_of_sync_url(self):
+        tracer = RecordingTracer()
+        context = NetworkContext(ca_file=self.server.cert_file, tracer=tracer,
+                                 dns_backend=StaticBackend({'_domainconnect.example.com': self.server.address}))
+        dc = DomainConnect(networkcontext=context, discovery_cache=DiscoveryCache())
+        signer = DomainConnectSigner(priv_key, '_dck1')
+        dc.get_domain_connect_template_sync_url('www.example.com', PROVIDER_ID, 'template1', signer=signer)
+        stages = [stage for stage, _, _ in tracer.spans]
+        expected = ['resolve', 'connect', 'tls', 'request', 'response', 'json', 'settings', 'request', 'response',
+                    'template', 'sign']
+        assert stages == expected, stages
+        spans = dict((stage, attributes) for stage, _, attributes in tracer.spans)
+        assert spans['resolve'] == {'host': 'example.com'}, spans['resolve']
+        assert spans['request'] == {'host': self.server.address, 'method': 'GET', 'status': 200}, spans['request']
+        assert spans['response']['bytes'] > 0, spans['response']
+        assert spans['settings'] == {'host': self.server.address, 'domain': 'example.com'}, spans['settings']
+
+        del tracer.spans[:]
+        dc.get_domain_config('example.com')
+        assert tracer.spans[0] == ('resolve', 0.0, {'host': 'example.com', 'cache_hit': True, 'negative': False}), \
+            tracer.spans[0]
+
+    def test_histogram_collector(self):
+        collector = HistogramCollector(bounds=(0.01, 0.1))
+        context = NetworkContext(ca_file=self.server.cert_file, tracer=collector)
+        get_json(context, self.server.url('/v2/example.com/settings'))
+        with self.assertRaises(HttpStatusException):
+            get_json(context, self.server.url('/v2/example.org/settings'))
+        collector.on_span('resolve', 0.05, {'host': 'example.com'})
+        collector.on_span('resolve', 0.0, {'host': 'example.com', 'cache_hit': True})
+        collector.on_span('resolve', 1, {'host': 'example.net', 'error': 'Timeout'})
+
+        series = dict((entry['stage'], entry) for entry in collector.snapshot())
+        assert sorted(series) == ['connect', 'json', 'request', 'resolve', 'response', 'tls'], sorted(series)
+        assert series['request']['statuses'] == {200: 1, 404: 1}, series['request']
+        assert series['response']['bytes'] > 0, series['response']
+        assert series['resolve']['count'] == 2, series['resolve']
+        assert series['resolve']['buckets'] == [(0.01, 0), (0.1, 1), (float('inf'), 2)], series['resolve']
+        assert (series['resolve']['cache_hits'], series['resolve']['errors']) == (1, 1), series['resolve']
+
+        collector.reset()
+        assert collector.snapshot() == []
@@ -0,0 +1,164 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import sys
+import threading
+import time
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase
+else:
+    # Python 3.x
+    from unittest import TestCase
+
+from domainconnect import DomainConnect, NetworkContext, RateLimiter, RateLimitExceededException, CircuitBreaker
+from domainconnect.concurrency import FairScheduler
+from domainconnect.network import http_request_json
+from .stub_server import StubHTTPServer, FakeDnsBackend, provider_routes
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(TestCase):
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=2, clock=clock)
+        assert [limiter.reserve('api.example.net') for _ in range(4)] == [0, 0, 0.5, 1.0]
+        with self.assertRaises(RateLimitExceededException):
+            limiter.reserve('api.example.net', timeout=1.0)
+        clock.now += 1.5
+        assert limiter.delay('API.example.net') == 0.0
+        assert limiter.take('api.example.net') and not limiter.take('api.example.net')
+        assert limiter.reserve('api.example.net') == 0, "Token of take not used"
+        assert limiter.reserve('api.example.net') == 0.5
+        assert limiter.reserve('other.example.net') == 0, "Buckets not separate per host"
+        stats = limiter.stats()['api.example.net']
+        assert (stats['requests'], stats['delayed'], stats['rejected']) == (6, 3, 1), stats
+
+    def test_limits_per_provider(self):
+        limiter = RateLimiter(max_concurrent=10, limits={'BigProvider': {'rate': 1, 'max_concurrent': 2}})
+        assert limiter.limit('api.big.example') == (None, None, 10)
+        limiter.register_provider('bigprovider', 'https://API.big.example')
+        limiter.register_provider('other', 'https://api.other.example')
+        assert limiter.limit('api.big.example') == (1, 1, 2)
+        assert limiter.capacity('https://api.big.example/v2/x') == 2
+        assert limiter.limit('api.other.example') == (None, None, 10)
+
+    def test_release_matches_acquire(self):
+        limiter = RateLimiter(limits={'bigprovider': {'max_concurrent': 1}}, max_concurrent=1)
+        key = limiter.acquire('https://api.big.example/v2/x')
+        limiter.register_provider('BigProvider', 'https://api.big.example')
+        limiter.release(key)
+        assert limiter.stats()['api.big.example']['in_flight'] == 0
+        limiter.release(limiter.acquire('api.big.example', timeout=1))
+        assert limiter.stats()['bigprovider']['in_flight'] == 0
+
+    def test_throttled_pauses_host(self):
+        server = StubHTTPServer(tls=True)
+        server.routes[('GET', '/busy')] = (429, {'Retry-After': '3'}, {})
+        server.start()
+        try:
+            limiter = RateLimiter()
+            breaker = CircuitBreaker(failure_threshold=2)
+            context = NetworkContext(ca_file=server.cert_file, rate_limiter=limiter, circuit_breaker=breaker)
+            _, status = http_request_json(context, 'GET', server.url('/busy'), accepted_statuses=[429])
+            assert status == 429
+            assert 2 < limiter.delay(server.address) <= 3
+            for _ in range(2):
+                with self.assertRaises(RateLimitExceededException):
+                    http_request_json(context, 'GET', server.url('/busy'), accepted_statuses=[429], timeout=1)
+            assert context.stats()['rate_limiter'][server.address]['throttled'] == 1
+            assert breaker.state(server.address) == CircuitBreaker.CLOSED, "Local rate limit opened circuit"
+        finally:
+            server.stop()
+
+    def test_concurrency_cap(self):
+        server = StubHTTPServer(tls=True)
+        active = [0, 0]
+        lock = threading.Lock()
+
+        def handler(request_handler):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.1)
+            with lock:
+                active[0] -= 1
+            return 200, {}, {}
+        server.routes[('GET', '/slow')] = handler
+        server.start()
+        try:
+            context = NetworkContext(ca_file=server.cert_file, rate_limiter=RateLimiter(max_concurrent=2))
+            threads = [threading.Thread(target=http_request_json, args=(context, 'GET', server.url('/slow')))
+                       for _ in range(6)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert active[1] == 2, "Maximum of concurrent requests: {}".format(active[1])
+        finally:
+            server.stop()
+
+
+class TestFairScheduler(TestCase):
+
+    def test_keys_take_turns(self):
+        scheduler = FairScheduler()
+        for key, job in [('a', 1), ('a', 2), ('a', 3), ('b', 4), ('c', 5)]:
+            scheduler.push(key, job)
+        assert [scheduler.pop() for _ in range(6)] == [('a', 1), ('b', 4), ('c', 5), ('a', 2), ('a', 3), None]
+
+    def test_limits_and_delays(self):
+        delays = {'a': 0, 'b': 2.0}
+        scheduler = FairScheduler(max_per_key=1, take=lambda key: delays[key] <= 0, delay=delays.get)
+        for key, job in [('a', 1), ('a', 2), ('b', 3)]:
+            scheduler.push(key, job)
+        assert scheduler.pop() == ('a', 1)
+        assert scheduler.pop() is None, "Key over its limit or delayed key served"
+        assert scheduler.retry_in() == 2.0
+        scheduler.done('a')
+        scheduler.push('a', 0, first=True)
+        assert scheduler.pop() == ('a', 0)
+        assert (len(scheduler), scheduler.running()) == (2, 1)
+
+
+class TestFairDiscovery(TestCase):
+
+    def test_rate_limited_provider_does_not_hold_up_others(self):
+        server = StubHTTPServer(tls=True)
+        settings = provider_routes(server)[('GET', '/v2/example.com/settings')]
+        zones = dict()
+        domains = []
+        # one server under two host names, the certificate is valid for both
+        for name, address, count in [('big', server.address, 10),
+                                     ('small', 'localhost:{}'.format(server.server_address[1]), 5)]:
+            for i in range(count):
+                zones['_domainconnect.{}{}.com'.format(name, i)] = address
+                server.routes[('GET', '/v2/{}{}.com/settings'.format(name, i))] = settings
+                domains.append('{}{}.com'.format(name, i))
+        server.start()
+        try:
+            limiter = RateLimiter(limits={server.address: {'rate': 10, 'burst': 1}})
+            dc = DomainConnect(networkcontext=NetworkContext(ca_file=server.cert_file, rate_limiter=limiter))
+            dc._dns = FakeDnsBackend(zones)
+            order = [domain for domain, _ in dc.get_domain_configs(domains, max_workers=4)]
+        finally:
+            server.stop()
+        assert sorted(order) == sorted(domains)
+        small = [i for i, domain in enumerate(order) if domain.startswith('small')]
+        assert max(small) < 8, "Small provider waited behind rate limited one: {}".format(order)
+        assert limiter.stats()[server.address]['delayed'] == 0, "Requests blocked workers instead of waiting queued"
@@ -0,0 +1,121 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import sys
+import threading
+import time
+
+if sys.version_info[0] == 2 and sys.version_info[1] == 7:
+    # Python 2.7
+    from unittest2 import TestCase
+else:
+    # Python 3.x
+    from unittest import TestCase
+
+from domainconnect import DomainConnect, DomainConnectConfig, DomainConnectAsyncContext, \
+    DomainConnectAsyncCredentials, AsyncTokenManager, AsyncTokenException, NetworkContext
+from .stub_server import StubHTTPServer, provider_routes, slow, PROVIDER_ID
+
+
+class TestAsyncTokenManager(TestCase):
+
+    def setUp(self):
+        self.server = StubHTTPServer(tls=True)
+        self.server.routes.update(provider_routes(self.server))
+        self.server.start()
+        self.dc = DomainConnect(networkcontext=NetworkContext(ca_file=self.server.cert_file))
+        self.credentials = DomainConnectAsyncCredentials('client', 'secret', self.server.url(''))
+        self.manager = None
+
+    def tearDown(self):
+        if self.manager is not None:
+            self.manager.close()
+        self.server.stop()
+
+    def _context(self, issued_ago):
+        config = DomainConnectConfig('example.com', 'example.com', '', {'urlAPI': self.server.url('')})
+        context = DomainConnectAsyncContext(config, PROVIDER_ID, 'template1', 'https://return', {})
+        context.access_token = 'old'
+        context.refresh_token = 'refresh'
+        context.access_token_expires_in = 3600
+        context.iat = int(time.time()) - issued_ago
+        return context
+
+    def _token_requests(self):
+        return [r for r in self.server.requests if r[1].startswith('/v2/oauth/access_token')]
+
+    def test_refreshes_in_background_before_expiry(self):
+        refreshed = threading.Event()
+        self.manager = AsyncTokenManager(self.dc, refresh_margin=300, on_refresh=lambda context: refreshed.set())
+        due = self._context(3400)
+        fresh = self._context(0)
+        self.manager.add(fresh, self.credentials)
+        self.manager.add(due, self.credentials)
+
+        assert refreshed.wait(5), "Token not refreshed"
+        assert due.access_token == 'token', due.access_token
+        assert fresh.access_token == 'old', "Token refreshed too early"
+        requests = self._token_requests()
+        assert len(requests) == 1 and 'grant_type=refresh_token' in requests[0][1], requests
+        stats = self.manager.stats()
+        assert (stats['contexts'], stats['refreshes'], stats['failures']) == (2, 1, 0), stats
+
+    def test_token_does_not_refresh_valid_token(self):
+        self.manager = AsyncTokenManager(self.dc, refresh_margin=300)
+        context = self._context(3400)
+        assert self.manager.token(context) is context
+        assert context.access_token == 'old'
+        assert self._token_requests() == []
+
+    def test_concurrent_refreshes_coalesced(self):
+        route = ('POST', '/v2/oauth/access_token')
+        self.server.routes[route] = slow(self.server.routes[route], 0.3)
+        self.manager = AsyncTokenManager(self.dc)
+        context = self._context(3600)
+        errors = []
+
+        def call():
+            try:
+                assert self.manager.refresh(context, self.credentials).access_token == 'token'
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == [], errors
+        assert len(self._token_requests()) == 1, self._token_requests()
+        assert self.manager.stats()['coalesced'] == 7, self.manager.stats()
+
+    def test_no_busy_loop_at_refresh_time(self):
+        class UnchangedToken:
+            def __init__(self):
+                self.calls = []
+
+            def get_async_token(self, context, credentials, refresh_margin=60):
+                self.calls.append(refresh_margin)
+                return context
+        dc = UnchangedToken()
+        self.manager = AsyncTokenManager(dc, refresh_margin=300, retry_interval=10)
+        context = self._context(3300)
+        context.iat += 0.5
+        self.manager.add(context, self.credentials)
+        time.sleep(0.5)
+        assert dc.calls == [None], "Refresh not forced or repeated at once: {}".format(len(dc.calls))
+        assert self.manager.stats()['scheduled'] == 1
+
+    def test_failed_refresh_raises_on_expired_token(self):
+        self.server.routes[('POST', '/v2/oauth/access_token')] = (400, {}, {'error': 'invalid_grant'})
+        self.manager = AsyncTokenManager(self.dc, retry_interval=0.05)
+        context = self._context(3600)
+        self.manager.add(context, self.credentials)
+        with self.assertRaises(AsyncTokenException):
+            self.manager.token(context)
+        assert self.manager.stats()['failures'] >= 1
@@ -0,0 +1,240 @@
+__author__ = "Pawel Kowalik"
+__copyright__ = "Copyright 2018, 1&1 Internet SE"
+__credits__ = ["Andreea Dima"]
+__license__ = "MIT"
+__version__ = "0.0.1"
+__maintainer__ = "Pawel Kowalik"
+__email__ = "pawel-kow@users.noreply.github.com"
+__status__ = "Beta"
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .concurrency import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTokenManager(object):
+    """Keeps access tokens of many async contexts valid by refreshing them before expiry
+
+    Contexts are kept in an index ordered by refresh time. A background thread refreshes each token refresh_margin
+    seconds before it expires, so applying a template with a managed context does not wait for a refresh.
+    Concurrent refreshes of one context, background or explicit, result in a single token request.
+
+    Only contexts with a refresh token are refreshed. A failed refresh is retried every retry_interval seconds
+    until the token expires.
+
+    Usage:
+        manager = AsyncTokenManager(dc)
+        manager.add(context, credentials)
+        dc.apply_domain_connect_template_async(manager.token(context), params=...)
+    """
+
+    def __init__(self, domain_connect, refresh_margin=300, retry_interval=30, max_workers=4, on_refresh=None,
+                 clock=time.time):
+        """
+
+        :param domain_connect: DomainConnect
+        :param refresh_margin: int
+            seconds before expiry at which the token is refreshed
+        :param retry_interval: float
+            seconds between attempts after a failed refresh
+        :param max_workers: int
+            concurrent token requests of the background refresh
+        :param on_refresh: callable
+            called with the context after its token was refreshed, e.g. to persist it with context.to_bytes()
+        :param clock: callable
+            source of current unix time, for tests
+        """
+        self._dc = domain_connect
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.max_workers = max_workers
+        self.on_refresh = on_refresh
+        self._clock = clock
+        # context -> [credentials, scheduled refresh time or None]
+        self._entries = dict()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._flight = SingleFlight()
+        self._executor = None
+        self._thread = None
+        self._closed = False
+        self.refreshes = 0
+        self.failures = 0
+
+    def add(self, context, credentials):
+        """Starts managing token of the context
+
+        :param context: DomainConnectAsyncContext
+            with access token, see: DomainConnect.get_async_token
+        :param credentials: DomainConnectAsyncCredentials
+        """
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('AsyncTokenManager is closed')
+            self._entries[context] = [credentials, None]
+            self._schedule(context, self._refresh_at(context))
+            self._start()
+            self._condition.notify()
+
+    def remove(self, context):
+        """Stops managing token of the context"""
+        with self._condition:
+            self._entries.pop(context, None)
+
+    def token(self, context):
+        """Returns context with a valid access token
+
+        The token is refreshed in the calling thread only if it already expired, e.g. when background refresh
+        failed or the context is not managed.
+
+        :param context: DomainConnectAsyncContext
+        :return: DomainConnectAsyncContext
+        :raises: AsyncTokenException
+        """
+        if context.access_token and not self._expired(context):
+            return context
+        return self.refresh(context)
+
+    def refresh(self, context, credentials=None):
+        """Refreshes token of the context if it expires within refresh_margin
+
+        Concurrent calls for the same context share one token request.
+
+        :param context: DomainConnectAsyncContext
+        :param credentials: DomainConnectAsyncCredentials
+            needed only if the context is not managed
+        :return: DomainConnectAsyncContext
+        :raises: AsyncTokenException
+        """
+        if credentials is None:
+            with self._condition:
+                entry = self._entries.get(context)
+            if entry is None:
+                raise KeyError('Context is not managed and no credentials given')
+            credentials = entry[0]
+        return self._flight.do(id(context), self._refresh, context, credentials)
+
+    def stats(self):
+        """Returns number of managed contexts and counters of refreshes
+
+        :return: dict
+        """
+        with self._condition:
+            return {
+                'contexts': len(self._entries),
+                'scheduled': sum(1 for entry in self._entries.values() if entry[1] is not None),
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'coalesced': self._flight.stats()['shared'],
+            }
+
+    def close(self):
+        """Stops background refresh, running token requests are finished"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _expires(context):
+        if context.iat is None or context.access_token_expires_in is None:
+            return None
+        return context.iat + context.access_token_expires_in
+
+    def _expired(self, context):
+        expires = self._expires(context)
+        return expires is not None and self._clock() >= expires
+
+    def _refresh_at(self, context):
+        if not (context.iat and context.access_token_expires_in and context.refresh_token):
+            return None
+        return context.iat + context.access_token_expires_in - self.refresh_margin
+
+    def _schedule(self, context, when):
+        # called with the condition held; superseded heap items are skipped when popped
+        entry = self._entries.get(context)
+        if entry is None:
+            return
+        entry[1] = when
+        if when is not None:
+            heapq.heappush(self._heap, (when, next(self._sequence), context))
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        with self._condition:
+            while not self._closed:
+                while self._heap:
+                    when, _, context = self._heap[0]
+                    entry = self._entries.get(context)
+                    if entry is not None and entry[1] == when:
+                        break
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                delay = self._heap[0][0] - self._clock()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                _, _, context = heapq.heappop(self._heap)
+                entry = self._entries[context]
+                entry[1] = None
+                self._executor.submit(self._background_refresh, context, entry[0])
+
+    def _background_refresh(self, context, credentials):
+        try:
+            issued = context.iat
+            self.refresh(context, credentials)
+            when = self._refresh_at(context)
+            if when is not None and context.iat == issued:
+                # not refreshed, e.g. refresh time moved by the caller, not to be retried at once
+                when = max(when, self._clock() + self.retry_interval)
+        except Exception as e:
+            logger.debug('Refresh of token for %s failed: %s', context.config.domain, e)
+            when = self._clock() + self.retry_interval
+            if self._expires(context) is not None and when >= self._expires(context):
+                when = None
+        with self._condition:
+            self._schedule(context, when)
+            self._condition.notify()
+
+    def _refresh(self, context, credentials):
+        issued = context.iat
+        when = self._refresh_at(context)
+        if context.access_token and when is not None and when > self._clock():
+            # still valid beyond the margin, e.g. refreshed by an earlier caller
+            return context
+        try:
+            # due by the clock of the manager, refreshed regardless of rounding in get_async_token
+            self._dc.get_async_token(context, credentials, refresh_margin=None)
+        except Exception:
+            with self._condition:
+                self.failures += 1
+            raise
+        if context.iat == issued:
+            # no new token issued
+            return context
+        with self._condition:
+            self.refreshes += 1
+        if self.on_refresh is not None:
+            self.on_refresh(context)
+        return context